@@ -1,6 +1,6 @@
 __version__ = '1.0.7'
 
-from tornado.util import ObjectDict
+from bbtornado.frozen import GlobalConfig
 
-# Global config dict
-config = ObjectDict()
+# Global config, read only, loaded by main.setup_global_config
+config = GlobalConfig()
@@ -0,0 +1,206 @@
+"""
+Batched backfills for large tables, for use in alembic migrations or scripts.
+
+A single `UPDATE table SET ...` on millions of rows locks them all for the whole
+update. `backfill` walks the table by its key instead (keyset pagination), and
+updates `batch_size` rows at a time, each batch in its own transaction:
+
+```
+    from bbtornado.alembic import backfill
+
+    def upgrade():
+        op.add_column('user', sa.Column('score', sa.Integer))
+        backfill.backfill(op, 'user', {'score': sa.text('visits * 10')},
+                          where=sa.text('score IS NULL'), batch_size=5000, sleep=0.1)
+```
+
+Progress is logged with the last processed key, pass it as `start_after` to resume
+an interrupted backfill. With `dry_run=True` nothing is updated, the number of rows and
+batches is counted and logged. A real backfill does not count the rows first, progress
+is logged against the planner's estimate of the table size on PostgreSQL (pg_class.reltuples).
+
+Backfills need a database connection, they do not work in offline (as_sql) mode.
+"""
+
+import logging
+import time
+
+from sqlalchemy import MetaData, Table, func, select, text, update
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger('bbtornado.alembic.backfill')
+
+
+class BackfillResult(object):
+
+    __slots__ = ('rows', 'batches', 'last_key', 'elapsed', 'estimate')
+
+    def __init__(self, rows=0, batches=0, last_key=None, elapsed=0.0, estimate=None):
+        self.rows = rows
+        self.batches = batches
+        self.last_key = last_key
+        self.elapsed = elapsed
+        self.estimate = estimate
+
+    def __repr__(self):
+        return '<BackfillResult rows=%s batches=%s last_key=%r elapsed=%.1fs>' % (
+            self.rows, self.batches, self.last_key, self.elapsed)
+
+
+def _get_table(bind, table):
+    if isinstance(table, str):
+        return Table(table, MetaData(), autoload_with=bind)
+    return getattr(table, '__table__', table)
+
+
+def _key_column(table, key):
+    if key is None:
+        pk = list(table.primary_key.columns)
+        if len(pk) != 1:
+            raise ValueError('%s needs a single column key for backfills' % table.name)
+        return pk[0]
+    return table.c[key] if isinstance(key, str) else key
+
+
+def _condition(where):
+    if isinstance(where, str):
+        return text(where)
+    return where
+
+
+class _Runner(object):
+
+    """Runs each batch in its own transaction, on an engine, connection or alembic op"""
+
+    def __init__(self, bind):
+        self.op = None
+        if hasattr(bind, 'get_context'):
+            self.op = bind
+            if bind.get_context().as_sql:
+                raise Exception('Backfills do not work in offline (as_sql) mode')
+            bind = bind.get_bind()
+        self.bind = bind
+
+    def __enter__(self):
+        if self.op is not None and hasattr(self.op.get_context(), 'autocommit_block'):
+            # commit the migration so far, every statement then commits by itself
+            self._block = self.op.get_context().autocommit_block()
+            self._block.__enter__()
+        else:
+            self._block = None
+        return self
+
+    def __exit__(self, *exc):
+        if self._block is not None:
+            self._block.__exit__(*exc)
+
+    def execute(self, stmt, params=None):
+        if isinstance(self.bind, Engine):
+            with self.bind.begin() as conn:
+                return conn.execute(stmt, params or {})
+        return self.bind.execute(stmt, params or {})
+
+    def fetch(self, stmt):
+        if isinstance(self.bind, Engine):
+            with self.bind.connect() as conn:
+                return conn.execute(stmt).fetchall()
+        return self.bind.execute(stmt).fetchall()
+
+    def commit(self):
+        commit = getattr(self.bind, 'commit', None)
+        if self._block is None and not isinstance(self.bind, Engine) and commit is not None \
+                and self.bind.in_transaction():
+            commit()
+
+
+def estimate(bind, table, where=None, start_after=None, key=None):
+    """Returns the number of rows a backfill would update"""
+    runner = _Runner(bind)
+    table = _get_table(runner.bind, table)
+    key_column = _key_column(table, key)
+    stmt = select(func.count()).select_from(table)
+    if where is not None:
+        stmt = stmt.where(_condition(where))
+    if start_after is not None:
+        stmt = stmt.where(key_column > start_after)
+    return runner.fetch(stmt)[0][0]
+
+
+def table_estimate(bind, table):
+    """The planner's estimate of the rows in table (PostgreSQL only, otherwise None), without a scan"""
+    runner = _Runner(bind)
+    table = _get_table(runner.bind, table)
+    if runner.bind.dialect.name != 'postgresql':
+        return None
+    name = table.name if table.schema is None else '%s.%s' % (table.schema, table.name)
+    rows = runner.fetch(text('SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:name AS regclass)')
+                        .bindparams(name=name))
+    if not rows or rows[0][0] is None or rows[0][0] < 0:
+        # never analyzed
+        return None
+    return rows[0][0]
+
+
+def backfill(bind, table, values, where=None, key=None, batch_size=1000, sleep=0,
+             start_after=None, dry_run=False, log_interval=10):
+    """
+    Update `values` (a dict of column -> value or expression) of the rows matching `where`,
+    `batch_size` rows at a time, ordered by `key` (the primary key by default).
+
+    `bind` is an alembic op, an engine or a connection (committed after each batch).
+    Sleeps `sleep` seconds between batches, logs progress every `log_interval` seconds.
+    Starts after the key value `start_after`, to resume a backfill.
+
+    Returns a BackfillResult.
+    """
+    runner = _Runner(bind)
+    table = _get_table(runner.bind, table)
+    key_column = _key_column(table, key)
+    where = _condition(where)
+    result = BackfillResult(last_key=start_after)
+    start = last_log = time.time()
+
+    if dry_run:
+        result.estimate = estimate(runner.bind, table, where, start_after, key_column)
+        log.info('Backfill of %s would update %d rows in %d batches', table.name, result.estimate,
+                 -(-result.estimate // batch_size))
+        return result
+
+    # counting the rows would scan them all, only the table size is estimated
+    result.estimate = table_estimate(runner.bind, table)
+    log.info('Backfilling %s (about %s rows in the table)', table.name,
+             result.estimate if result.estimate is not None else 'unknown')
+    with runner:
+        while True:
+            keys = select(key_column).order_by(key_column).limit(batch_size)
+            if where is not None:
+                keys = keys.where(where)
+            if result.last_key is not None:
+                keys = keys.where(key_column > result.last_key)
+            batch = [row[0] for row in runner.fetch(keys)]
+            if not batch:
+                break
+
+            stmt = update(table).where(key_column >= batch[0], key_column <= batch[-1]).values(values)
+            if where is not None:
+                stmt = stmt.where(where)
+            runner.execute(stmt)
+            runner.commit()
+
+            result.rows += len(batch)
+            result.batches += 1
+            result.last_key = batch[-1]
+
+            if time.time() - last_log > log_interval:
+                last_log = time.time()
+                log.info('Backfill of %s: %d/~%s rows, last key %r', table.name, result.rows,
+                         result.estimate if result.estimate is not None else '?', result.last_key)
+            if len(batch) < batch_size:
+                break
+            if sleep:
+                time.sleep(sleep)
+
+    result.elapsed = time.time() - start
+    log.info('Backfill of %s done: %d rows in %d batches, %.1fs, last key %r', table.name,
+             result.rows, result.batches, result.elapsed, result.last_key)
+    return result
@@ -1,6 +1,3 @@
-import logging
-from sqlalchemy.dialects.postgresql import ENUM
-
 """
 This file contains utility methods for dealing with enums in alembic
 migration scripts.
@@ -12,6 +9,16 @@ already existing.
 
 Downgrading is not supported.
 
+To add many options, to many enums, use `sync`, it reads the existing options
+once, and adds only the missing ones in one autocommit block, in the given order:
+
+```
+    enums.sync(op, {
+        'status': ['draft', 'review', 'published', 'archived'],
+        'role': ['admin', 'editor', 'viewer'],
+    })
+```
+
 This requires that you set `transaction_per_migration=True` in the config clause for alembic:
 
 i.e. in the env.py file:
@@ -27,6 +34,12 @@ i.e. in the env.py file:
 
 """
 
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import ENUM
+
 log = logging.getLogger(__file__)
 
 def create(op, name, *values):
@@ -39,18 +52,116 @@ def create(op, name, *values):
 
 def add_options(op, name, *options):
 
-    log.warn("This will roll back any upgrades done before this!")
-
+    sync(op, {name: options}, ordered=False)
+
+
+def read_options(op, names):
+    """Returns {enum name: [options in order]} for the existing enums, with one query"""
+
+    rows = op.get_bind().execute(text(
+        "SELECT t.typname, e.enumlabel FROM pg_type t JOIN pg_enum e ON e.enumtypid = t.oid "
+        "WHERE t.typname = ANY(:names) ORDER BY t.typname, e.enumsortorder"), dict(names=list(names)))
+
+    existing = {}
+    for name, label in rows:
+        existing.setdefault(name, []).append(label)
+    return existing
+
+
+def _quote(value):
+    return "'%s'" % value.replace("'", "''")
+
+
+def missing_options(existing, values, ordered=True):
+    """
+    Returns (option, position) for the values not in existing, position is
+    None (append), or ('AFTER'|'BEFORE', other option) to keep the order of values
+    """
+
+    present = set(existing)
+    rval = []
+    for i, value in enumerate(values):
+        if value in present:
+            continue
+        position = None
+        if ordered:
+            before = [v for v in values[:i] if v in present]
+            after = [v for v in values[i + 1:] if v in present]
+            if before:
+                position = ('AFTER', before[-1])
+            elif after:
+                position = ('BEFORE', after[0])
+        rval.append((value, position))
+        present.add(value)
+    return rval
+
+
+def sync_statements(dialect, enums, existing, ordered=True):
+    """The ALTER TYPE statements adding the missing options of enums, {name: values}"""
+
+    statements = []
+    for name, values in enums.items():
+        type_name = dialect.identifier_preparer.quote(name)
+        for value, position in missing_options(existing.get(name, []), list(values), ordered):
+            statement = "ALTER TYPE %s ADD VALUE IF NOT EXISTS %s" % (type_name, _quote(value))
+            if position is not None:
+                statement += " %s %s" % (position[0], _quote(position[1]))
+            statements.append(statement)
+    return statements
+
+
+@contextmanager
+def _autocommit(op):
+    context = op.get_context()
+    if hasattr(context, 'autocommit_block'):
+        # alembic >= 1.2, commits the migration transaction so far, also in as_sql mode
+        with context.autocommit_block():
+            yield
+        return
+
+    log.warning("This will roll back any upgrades done before this!")
     connection = None
-    if not op.get_context().as_sql:
+    if not context.as_sql:
         connection = op.get_bind()
         connection.execution_options(isolation_level='AUTOCOMMIT')
-
-    for option in options:
-        op.execute("ALTER TYPE %s ADD VALUE IF NOT EXISTS '%s'"%(name, option))
-
-    if connection is not None:
-        connection.execution_options(isolation_level='READ_COMMITTED')
+    try:
+        yield
+    finally:
+        if connection is not None:
+            connection.execution_options(isolation_level='READ_COMMITTED')
+
+
+def sync(op, enums, ordered=True):
+    """
+    Add the missing options of enums, a dict of {enum name: [options]}.
+
+    The existing options are read from pg_enum once, missing options are
+    added in one autocommit block, positioned with BEFORE/AFTER to follow the
+    given order, unless ordered=False. Missing enums are created.
+
+    In offline (as_sql) mode the existing options can't be read, so all options
+    are added with IF NOT EXISTS.
+    """
+
+    context = op.get_context()
+    if context.as_sql:
+        existing = {}
+    else:
+        existing = read_options(op, enums.keys())
+
+    for name, values in enums.items():
+        if name not in existing and not context.as_sql:
+            create(op, name, *values)
+            existing[name] = list(values)
+
+    statements = sync_statements(context.dialect, enums, existing, ordered)
+    if not statements:
+        return
+
+    log.info('Adding %d enum options', len(statements))
+    with _autocommit(op):
+        for statement in statements:
+            op.execute(statement)
 
 
 def remove_option(op, name, option):
@@ -0,0 +1,128 @@
+"""
+Authentication without crypto or db work on the common path.
+
+Verifying the `user_id` secure cookie (HMAC, base64 and timestamp parsing) is done
+once per cookie value, the decoded user id is kept in a bounded LRU cache per application.
+Cached values keep the signature expiry: a cached cookie older than the max age is
+verified again, which fails like it did before. Only valid cookies are cached.
+
+Handlers with `user_snapshot_fields` also get a signed `user_token` when logging in a
+user, a stateless token with a snapshot of those fields of the user (as json).
+With a valid token, `current_user` is a UserSnapshot and the user is not loaded from the
+db. API clients can send the token, from `create_user_token`, as `Authorization: Bearer`.
+Snapshots can be stale, up to `user_token_max_age_days`.
+
+The cache size is the `auth_cache_size` app setting (default 10000).
+"""
+
+import time
+
+from collections import OrderedDict
+
+from tornado.escape import json_decode, json_encode
+from tornado.util import ObjectDict
+from tornado.web import create_signed_value, decode_signed_value
+
+from bbtornado import metrics
+from bbtornado.models import _to_json
+
+DEFAULT_CACHE_SIZE = 10000
+
+_missing = object()
+
+
+def signed_timestamp(value):
+    """The time a tornado signed value (version 1 or 2) was created, without verifying it"""
+    parts = value.split('|')
+    if parts[0] == '2':
+        return int(parts[2].split(':', 1)[1])
+    return int(parts[1])
+
+
+class SignedValueCache(object):
+
+    """
+    An LRU cache of verified signed values -> their decoded value, by the name they
+    were signed with, the same value is not valid as another name
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, name, value, max_age_days, default=None):
+        key = (name, value)
+        entry = self._cache.get(key)
+        if entry is None:
+            metrics.incr('auth.cache.misses')
+            return default
+        decoded, timestamp = entry
+        if timestamp < time.time() - max_age_days * 86400:
+            # expired, verifying it again fails
+            self._cache.pop(key, None)
+            metrics.incr('auth.cache.misses')
+            return default
+        self._cache.move_to_end(key)
+        metrics.incr('auth.cache.hits')
+        return decoded
+
+    def put(self, name, value, decoded):
+        try:
+            timestamp = signed_timestamp(value)
+        except (IndexError, ValueError):
+            return
+        key = (name, value)
+        self._cache[key] = (decoded, timestamp)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
+
+
+def signed_value_cache(application):
+    """The cache of an application, created with the first request"""
+    cache = getattr(application, 'auth_cache', None)
+    if cache is None:
+        cache = application.auth_cache = SignedValueCache(
+            application.settings.get('auth_cache_size', DEFAULT_CACHE_SIZE))
+    return cache
+
+
+class UserSnapshot(ObjectDict):
+
+    """The fields of a user stored in a user token"""
+
+
+def snapshot(user, fields):
+    data = dict((field, getattr(user, field)) for field in fields)
+    data['id'] = user.id
+    return _to_json(data)
+
+
+def create_token(secret, user, fields, name='user_token', key_version=None):
+    """A signed token with a snapshot of the fields of user"""
+    return create_signed_value(secret, name, json_encode(snapshot(user, fields)),
+                               key_version=key_version).decode()
+
+
+def decode_token(secret, token, max_age_days, name='user_token'):
+    """The snapshot of a token, None if it is not valid"""
+    value = decode_signed_value(secret, name, token, max_age_days=max_age_days)
+    if value is None:
+        return None
+    return json_decode(value)
+
+
+def cached_decode(cache, name, value, max_age_days, decode):
+    """Decode a value signed as name with decode(value), or get it from the cache"""
+    decoded = cache.get(name, value, max_age_days, _missing)
+    if decoded is _missing:
+        decoded = decode(value)
+        if decoded is not None:
+            cache.put(name, value, decoded)
+    return decoded
@@ -0,0 +1,179 @@
+"""
+A batch endpoint, to make many small API calls in one HTTP request.
+
+POST a json array of sub-requests (or an object with a `requests` array):
+
+[
+    {"method": "GET", "url": "/api/users/1"},
+    {"method": "GET", "url": "/api/teams/2", "headers": {"X-Foo": "bar"}},
+    {"method": "POST", "url": "/api/visits", "body": {"page": "home"}}
+]
+
+Sub-requests are dispatched in-process through the application's handlers, with the cookies,
+user and xsrf token of the batch request. Consecutive GET/HEAD requests run concurrently, other
+requests run one at a time, in order. Every sub-request has its own db session, so a group of
+concurrent GETs holds one connection each. The response is one JSend object with a list of results:
+
+{"status": "success", "data": [{"status": 200, "headers": {...}, "body": {...}}, ...]}
+
+The batch is one request for the load shedder, the in-flight metrics and the application's
+rate limits, sub-requests only take tokens from rate limits set on their own handler class.
+
+Enable it with the `batch_url` app setting, or add the handler to your routes yourself.
+"""
+
+import json
+
+from tornado.concurrent import Future
+from tornado.escape import json_decode, json_encode
+from tornado.gen import coroutine, multi, Return
+from tornado.httputil import HTTPConnection, HTTPHeaders, HTTPServerRequest
+from tornado.web import HTTPError
+
+from bbtornado import metrics
+from bbtornado.handlers import BaseHandler
+from bbtornado.jsend import JSendMixin
+
+READ_ONLY_METHODS = ('GET', 'HEAD')
+
+
+class _BatchConnection(HTTPConnection):
+
+    """Collects the response of a sub-request"""
+
+    def __init__(self, context):
+        self.context = context
+        self.status_code = None
+        self.headers = None
+        self.chunks = []
+        self.finished = Future()
+
+    def set_close_callback(self, callback):
+        pass
+
+    def write_headers(self, start_line, headers, chunk=None):
+        self.status_code = start_line.code
+        self.headers = headers
+        return self.write(chunk)
+
+    def write(self, chunk):
+        if chunk:
+            self.chunks.append(chunk)
+        f = Future()
+        f.set_result(None)
+        return f
+
+    def finish(self):
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+
+class BatchHandler(JSendMixin, BaseHandler):
+
+    # maximum number of sub-requests in one batch
+    max_requests = 50
+    # response headers included in the results
+    response_headers = ('Content-Type', 'Location', 'Etag', 'Retry-After')
+
+    @coroutine
+    def prepare(self):
+        # the body is an array, not the key value objects BaseHandler.prepare accepts
+        yield self.check_limits()
+        try:
+            requests = json_decode(self.request.body)
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON structure.", reason="Invalid JSON structure.")
+        if isinstance(requests, dict):
+            requests = requests.get('requests')
+        if not isinstance(requests, list) or not all(isinstance(r, dict) and 'url' in r for r in requests):
+            raise HTTPError(400, "Expected a list of requests", reason="Expected a list of requests")
+        if len(requests) > self.max_requests:
+            raise HTTPError(400, "Too many requests in batch", reason="Too many requests in batch")
+        self.batch_requests = requests
+
+    @coroutine
+    def post(self):
+        results = [None] * len(self.batch_requests)
+        metrics.incr('batch.requests')
+        metrics.incr('batch.sub_requests', len(self.batch_requests))
+
+        # run consecutive read-only requests concurrently, anything else on its own
+        group = []
+        for i, r in enumerate(self.batch_requests):
+            if r.get('method', 'GET').upper() in READ_ONLY_METHODS:
+                group.append(i)
+                continue
+            yield self._run_group(group, results)
+            group = []
+            results[i] = yield self.run_sub_request(self.batch_requests[i])
+        yield self._run_group(group, results)
+
+        self.success(results)
+
+    @coroutine
+    def _run_group(self, group, results):
+        if group:
+            group_results = yield multi([self.run_sub_request(self.batch_requests[i]) for i in group])
+            for i, result in zip(group, group_results):
+                results[i] = result
+
+    def create_sub_request(self, r):
+        method = r.get('method', 'GET').upper()
+        headers = HTTPHeaders()
+        # the same cookies (i.e. the user) as the batch request
+        for name in ('Cookie', 'Authorization', 'Accept-Language', 'User-Agent'):
+            if name in self.request.headers:
+                headers[name] = self.request.headers[name]
+        # the batch request passed the xsrf check, its sub-requests are sent with the same token
+        xsrf_token = (self.get_query_argument('_xsrf', None) or self.request.headers.get('X-Xsrftoken')
+                      or self.request.headers.get('X-Csrftoken'))
+        if xsrf_token:
+            headers['X-Xsrftoken'] = xsrf_token
+        for name, value in (r.get('headers') or {}).items():
+            headers[name] = value
+
+        body = r.get('body')
+        if body is not None and not isinstance(body, str):
+            body = json_encode(body)
+            headers['Content-Type'] = 'application/json'
+
+        connection = _BatchConnection(getattr(self.request.connection, 'context', None))
+        request = HTTPServerRequest(method=method, uri=r['url'], version=self.request.version,
+                                    headers=headers, body=body.encode('utf8') if body else b'',
+                                    host=self.request.host, connection=connection)
+        return request
+
+    @coroutine
+    def run_sub_request(self, r):
+        try:
+            request = self.create_sub_request(r)
+        except Exception:
+            raise Return(dict(status=400, body='Invalid request'))
+
+        delegate = self.application.find_handler(request)
+        if issubclass(delegate.handler_class, BatchHandler):
+            raise Return(dict(status=400, body='Batches can not be nested'))
+
+        handler = delegate.handler_class(self.application, request, **delegate.handler_kwargs)
+        # share the user, limits and metrics are counted for the batch request
+        handler._current_user = self.current_user
+        if isinstance(handler, BaseHandler):
+            handler.batch_parent = self
+
+        yield handler._execute([], *delegate.path_args, **delegate.path_kwargs)
+        yield request.connection.finished
+
+        raise Return(self.format_result(request.connection))
+
+    def format_result(self, connection):
+        body = b''.join(connection.chunks)
+        headers = connection.headers or HTTPHeaders()
+        body = body.decode('utf8', 'replace')
+        if body and 'json' in headers.get('Content-Type', ''):
+            try:
+                body = json.loads(body)
+            except ValueError:
+                pass
+        return dict(status=connection.status_code,
+                    headers={k: headers[k] for k in self.response_headers if k in headers},
+                    body=body)
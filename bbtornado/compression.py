@@ -0,0 +1,227 @@
+"""
+Response compression and caching of (compressed) responses.
+
+Configure compression with the `compression` app setting:
+
+tornado:
+  app_settings:
+    compression:
+      min_size: 1024     # smaller responses are not compressed
+      level: 6           # gzip level
+      brotli: true       # use brotli when the client accepts it (needs the brotli package)
+      brotli_quality: 5
+
+Responses of GET methods decorated with @cache_response are cached per url (and
+optionally per user), the compressed body is cached per content encoding, so
+a cache hit is written as is, without serialising or compressing again:
+
+class TeamsHandler(BaseHandler):
+    @cache_response(ttl=30)
+    def get(self):
+        self.write(...)
+"""
+
+import gzip
+import threading
+import time
+
+from collections import OrderedDict
+from functools import wraps
+from io import BytesIO
+
+from tornado.web import OutputTransform, GZipContentEncoding
+
+from bbtornado import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def negotiate_encoding(request, use_brotli=False):
+    """Returns the content encoding to use for the request, 'br', 'gzip' or 'identity'"""
+    accept = request.headers.get('Accept-Encoding', '')
+    if use_brotli and brotli is not None and 'br' in accept:
+        return 'br'
+    if 'gzip' in accept:
+        return 'gzip'
+    return 'identity'
+
+
+class CompressionTransform(OutputTransform):
+
+    """
+    Like tornado's GZipContentEncoding, with a configurable level, size threshold and brotli.
+    Use `compression_transform` to create one with other settings.
+    """
+
+    CONTENT_TYPES = GZipContentEncoding.CONTENT_TYPES
+    MIN_SIZE = 1024
+    LEVEL = 6
+    BROTLI = False
+    BROTLI_QUALITY = 5
+
+    def __init__(self, request):
+        self.request = request
+        self._encoding = negotiate_encoding(request, self.BROTLI)
+
+    def _compressible_type(self, ctype):
+        return ctype.startswith('text/') or ctype in self.CONTENT_TYPES
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        ctype = headers.get('Content-Type', '').split(';')[0]
+        if not self._compressible_type(ctype):
+            self._encoding = 'identity'
+        else:
+            if 'Vary' in headers:
+                if 'Accept-Encoding' not in headers['Vary']:
+                    headers['Vary'] += ', Accept-Encoding'
+            else:
+                headers['Vary'] = 'Accept-Encoding'
+
+            if 'Content-Encoding' in headers or (finishing and len(chunk) < self.MIN_SIZE):
+                # already compressed (i.e. from the cache), or too small to bother
+                if self._encoding != 'identity':
+                    metrics.incr('compression.skipped')
+                self._encoding = 'identity'
+
+        if self._encoding != 'identity':
+            headers['Content-Encoding'] = self._encoding
+            if self._encoding == 'br':
+                self._compressor = brotli.Compressor(quality=self.BROTLI_QUALITY)
+            else:
+                self._buffer = BytesIO()
+                self._compressor = gzip.GzipFile(mode='w', fileobj=self._buffer, compresslevel=self.LEVEL)
+            metrics.incr('compression.%s' % self._encoding)
+
+            chunk = self.transform_chunk(chunk, finishing)
+            if 'Content-Length' in headers:
+                if finishing:
+                    headers['Content-Length'] = str(len(chunk))
+                else:
+                    del headers['Content-Length']
+
+        if finishing:
+            _store_cached_response(self.request, self._encoding, status_code, headers, chunk)
+
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if self._encoding == 'br':
+            chunk = self._compressor.process(chunk) + \
+                    (self._compressor.finish() if finishing else self._compressor.flush())
+        elif self._encoding == 'gzip':
+            self._compressor.write(chunk)
+            if finishing:
+                self._compressor.close()
+            else:
+                self._compressor.flush()
+            chunk = self._buffer.getvalue()
+            self._buffer.truncate(0)
+            self._buffer.seek(0)
+        return chunk
+
+
+def compression_transform(min_size=1024, level=6, brotli=False, brotli_quality=5):
+    """Create a CompressionTransform class with the given settings"""
+    return type('CompressionTransform', (CompressionTransform,),
+                dict(MIN_SIZE=min_size, LEVEL=level, BROTLI=brotli, BROTLI_QUALITY=brotli_quality))
+
+
+# headers that must not be replayed from the cache
+_UNCACHED_HEADERS = ('Date', 'Content-Length', 'Set-Cookie', 'Server')
+
+
+class ResponseCache(object):
+
+    """
+    An in-process LRU cache of responses, stored as (status, headers, body)
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                return None
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_default_cache = ResponseCache()
+
+
+def _store_cached_response(request, encoding, status_code, headers, body):
+    cache_info = getattr(request, '_bb_response_cache', None)
+    if cache_info is None or status_code != 200 or body is None:
+        return
+    cache, key, ttl = cache_info
+    headers = [(k, v) for k, v in headers.get_all() if k not in _UNCACHED_HEADERS]
+    cache.set(key + (encoding,), (status_code, headers, body), ttl)
+
+
+def cache_response(ttl=60, vary_user=False, cache=None):
+    """
+    Decorate GET methods of a BaseHandler to cache their response for ttl seconds.
+
+    The cache key is the request uri and format (and the current user if `vary_user` is set).
+    Uses the `response_cache` of the application, or a cache shared by all handlers.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            response_cache = cache or getattr(self.application, 'response_cache', None) or _default_cache
+            # the negotiated format (json or msgpack) of a BaseHandler is part of the key
+            key = (self.request.uri, getattr(self, 'response_format', None))
+            if vary_user:
+                user = self.current_user
+                key += (getattr(user, 'id', user),)
+
+            transform = getattr(self.application, 'compression', None)
+            encoding = negotiate_encoding(self.request, transform is not None and transform.BROTLI)
+            if transform is None:
+                encoding = 'identity'
+
+            for enc in (encoding, 'identity'):
+                entry = response_cache.get(key + (enc,))
+                if entry is None:
+                    continue
+                metrics.incr('response_cache.hits')
+                if enc != encoding:
+                    # the transform compresses and caches it for this encoding
+                    self.request._bb_response_cache = (response_cache, key, ttl)
+                status_code, headers, body = entry
+                self.set_status(status_code)
+                for name, value in headers:
+                    self.set_header(name, value)
+                self.finish(body)
+                return
+
+            metrics.incr('response_cache.misses')
+            self.request._bb_response_cache = (response_cache, key, ttl)
+            if transform is None:
+                # without a transform, the handler stores the response when it is flushed
+                self.add_response_listener(lambda status, headers, body:
+                                           _store_cached_response(self.request, 'identity', status, headers, body))
+            return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
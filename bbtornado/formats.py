@@ -0,0 +1,103 @@
+"""
+Response formats, JSON and MessagePack (when the msgpack package is installed).
+
+BaseHandler writes dicts in the format negotiated from the Accept header,
+using the same `_to_json` output for both, and decodes request bodies
+with a matching Content-Type.
+"""
+
+from bbtornado.models import _to_json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack')
+
+
+def is_msgpack(content_type):
+    return any(t in (content_type or '') for t in MSGPACK_TYPES)
+
+
+def parse_accept(accept):
+    """The (media range, quality) pairs of an Accept header, in order"""
+    rval = []
+    for part in (accept or '').split(','):
+        params = part.split(';')
+        media_range = params[0].strip().lower()
+        if not media_range:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        rval.append((media_range, quality))
+    return rval
+
+
+def _preference(accepted, media_types):
+    """
+    How much one of media_types is accepted: (quality, specificity, -position) of the most
+    specific media range matching it, None if none does
+    """
+    best = None
+    for position, (media_range, quality) in enumerate(accepted):
+        for media_type in media_types:
+            if media_range == media_type:
+                specificity = 2
+            elif media_range == media_type.split('/')[0] + '/*':
+                specificity = 1
+            elif media_range == '*/*':
+                specificity = 0
+            else:
+                continue
+            if best is None or specificity > best[1]:
+                best = (quality, specificity, -position)
+    return best
+
+
+def negotiate_format(request):
+    """
+    Returns the response format for the request, MSGPACK if it is preferred over JSON
+    in the Accept header (by quality, then the most specific and first media range),
+    and available, else JSON
+    """
+    if msgpack is None:
+        return JSON
+    accepted = parse_accept(request.headers.get('Accept'))
+    preferred = _preference(accepted, MSGPACK_TYPES)
+    if preferred is None or preferred[0] <= 0:
+        return JSON
+    json_preference = _preference(accepted, (JSON,))
+    if json_preference is not None and json_preference >= preferred:
+        return JSON
+    return MSGPACK
+
+
+def _default(o):
+    # only called for types msgpack can't pack, i.e. models and datetimes
+    rval = _to_json(o)
+    if rval is o:
+        raise TypeError('%r is not serializable' % o)
+    return rval
+
+
+def packb(data):
+    """Serialise models/queries/dicts to MessagePack"""
+    if msgpack is None:
+        raise RuntimeError('msgpack is not installed')
+    return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+def unpackb(data):
+    if msgpack is None:
+        raise RuntimeError('msgpack is not installed')
+    return msgpack.unpackb(data, raw=False)
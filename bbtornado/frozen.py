@@ -0,0 +1,110 @@
+"""
+Read only config objects.
+
+`bbtornado.config` is built once by `main.setup_global_config`, and only read after
+that, often on hot paths (i.e. `bbtornado.config.tornado.server.base`). The yaml
+dicts are frozen into FrozenConfig objects, with a slotted class per set of keys, so
+attribute lookups are plain slot reads instead of ObjectDict's `__getattr__` fallback.
+Lists become tuples.
+
+FrozenConfig is a Mapping, `config.db['uri']`, `config.db.get('echo')`, `dict(config.db)`
+and `**config.db` work as they did with ObjectDict. Keys that are not identifiers, or
+that shadow a Mapping method (i.e. `items`) can only be read with `config['items']`.
+Use `thaw` for a mutable copy, and `main.update_global_config` to change values.
+"""
+
+from collections.abc import Mapping
+
+_classes = {}
+
+
+class FrozenConfig(Mapping):
+
+    __slots__ = ('_data',)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getattr__(self, name):
+        # keys without a slot, slots are found before this is called
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise TypeError('Config is read only, change it with main.update_global_config')
+
+    __delattr__ = __setattr__
+
+    def __reduce__(self):
+        return freeze, (thaw(self),)
+
+    def __repr__(self):
+        return 'FrozenConfig(%r)' % self._data
+
+
+def _slot_names(keys):
+    return tuple(k for k in keys if isinstance(k, str) and k.isidentifier() and not k.startswith('__')
+                 and not hasattr(FrozenConfig, k))
+
+
+def _set(obj, data):
+    object.__setattr__(obj, '_data', data)
+    for name in _slot_names(data):
+        object.__setattr__(obj, name, data[name])
+
+
+def freeze(value):
+    """Convert dicts (recursively) to FrozenConfig, and lists to tuples"""
+    if isinstance(value, FrozenConfig):
+        return value
+    if isinstance(value, Mapping):
+        data = dict((k, freeze(v)) for k, v in value.items())
+        names = tuple(sorted(_slot_names(data)))
+        cls = _classes.get(names)
+        if cls is None:
+            cls = _classes[names] = type('FrozenConfig', (FrozenConfig,),
+                                         dict(__slots__=names, __module__=__name__))
+        obj = object.__new__(cls)
+        _set(obj, data)
+        return obj
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """A mutable copy of a frozen config, with dicts and lists"""
+    if isinstance(value, Mapping):
+        return dict((k, thaw(v)) for k, v in value.items())
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+class GlobalConfig(FrozenConfig):
+
+    """
+    The root of `bbtornado.config`. Modules keep a reference to it from import time,
+    so it is loaded in place, its sections are FrozenConfig objects.
+    """
+
+    def __init__(self, data=None):
+        _set(self, {})
+        if data:
+            self._load(data)
+
+    def _load(self, data):
+        frozen = dict((k, freeze(v)) for k, v in data.items())
+        self.__dict__.clear()
+        _set(self, frozen)
@@ -1,23 +1,48 @@
 import os
 import tornado.web
 import traceback
-import threading
 import logging
 import socket
+import contextvars
+import math
+
+from collections.abc import MutableMapping
 
 from functools import wraps, partial
 
-from concurrent.futures import ThreadPoolExecutor
-from tornado.escape import json_decode
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from tornado.concurrent import is_future
+from tornado.escape import json_decode, json_encode
 from tornado.web import HTTPError
-from tornado.util import ObjectDict
 from tornado.gen import coroutine, Return
+from tornado.ioloop import IOLoop
+from sqlalchemy.orm.query import Query
 
 from six import with_metaclass
 
+from bbtornado import auth, formats, logs, metrics
+from bbtornado.models import BaseModel, _load_for_json, _to_json, parse_fields, project_query
+from bbtornado.session import RequestSession
+from bbtornado.tasks import default_queue
+
 
 log = logging.getLogger('bbtornado')
 
+# Payloads above these sizes are decoded/serialised on the executor,
+# override with the app_settings of the same name (None disables offloading)
+DEFAULT_OFFLOAD_BODY_SIZE = 512 * 1024 # bytes of request body
+DEFAULT_OFFLOAD_OUTPUT_ITEMS = 1000 # items in a list/dict/query
+
+
+def _payload_items(o):
+    """
+    Cheap estimate of how much work serialising `o` is.
+    Queries are not executed to count them, load them (`query.all()`) first.
+    """
+    if isinstance(o, (list, tuple, dict, set)):
+        return len(o)
+    return 0
+
 
 def authenticated(error_code=403, error_message="Not Found"):
     """Decorate methods with this to require that the user be logged in.
@@ -39,9 +64,18 @@ class JsonError(HTTPError):
     Exception to be raised to return errors with JSON body to the client
     """
 
-    def __init__(self, status_code, message, details=None):
+    def __init__(self, status_code, message, details=None, headers=None):
         HTTPError.__init__(self, status_code, log_message=message, reason=message)
         self.details = details
+        # extra headers for the error response, i.e. Retry-After
+        self.headers = headers
+
+
+def _set_error_headers(handler, args):
+    if "exc_info" in args:
+        headers = getattr(args["exc_info"][1], 'headers', None)
+        for name, value in (headers or {}).items():
+            handler.set_header(name, value)
 
 class JsonErrorHandler():
 
@@ -52,7 +86,11 @@ class JsonErrorHandler():
     def write_error(self, code, **args):
 
         if code == 500:
-            log.error("[%s] 500 error: %s %s %s"%(socket.gethostname(), self.request.method, self.request.uri, self.request.body))
+            # formatted by the logging handlers, the body is truncated to the max_body_log setting
+            log.error("[%s] 500 error: %s %s %s", socket.gethostname(), self.request.method, self.request.uri,
+                      logs.truncate(self.request.body, self.settings.get('max_body_log', logs.DEFAULT_MAX_BODY_LOG)))
+
+        _set_error_headers(self, args)
 
         out = dict(status=code)
 
@@ -68,83 +106,356 @@ class JsonErrorHandler():
 
 
 
+# The data of the request currently being handled. Context variables follow
+# asyncio tasks and callbacks, and are copied into executor threads by run_in_context
+_request_context = contextvars.ContextVar('bbtornado_request_context', default=None)
+
+
+def run_in_context(executor, fn, *args, **kwargs):
+    """
+    Run fn on the executor in a copy of the current context, so
+    ThreadRequestContext.data (and the request scoped db session) is available.
+    Process pools can't take a context, so fn is submitted as is.
+
+    Returns a future that can be yielded or awaited on the current IOLoop.
+    """
+    fn = partial(fn, *args, **kwargs)
+    if not isinstance(executor, ProcessPoolExecutor):
+        fn = partial(contextvars.copy_context().run, fn)
+    return IOLoop.current().run_in_executor(executor, fn)
+
+
+_missing = object()
+
+
+class RequestData(MutableMapping):
+    """
+    The data of a request context, created for every request.
+
+    The keys bbtornado uses are slots, that are unset until a value (including None)
+    is set, other keys go in an instance dict that is only created when one is set.
+    A mutable mapping, that also supports attribute access. Only the data is a key,
+    not the methods of the mapping.
+    """
+
+    __slots__ = ('request', 'current_user', 'memo', 'memo_stats', '__dict__')
+
+    _slots = frozenset(__slots__[:-1])
+
+    def __init__(self, request=_missing, current_user=_missing, **data):
+        if request is not _missing:
+            self.request = request
+        if current_user is not _missing:
+            self.current_user = current_user
+        if data:
+            self.__dict__.update(data)
+
+    def get(self, key, default=None):
+        if key in RequestData._slots:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                return default
+        return self.__dict__.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in RequestData._slots:
+            setattr(self, key, value)
+        else:
+            self.__dict__[key] = value
+
+    def __delitem__(self, key):
+        if key in RequestData._slots:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        else:
+            del self.__dict__[key]
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __iter__(self):
+        for key in RequestData.__slots__[:-1]:
+            if self.get(key, _missing) is not _missing:
+                yield key
+        for key in list(self.__dict__):
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def setdefault(self, key, default=None):
+        value = self.get(key, _missing)
+        if value is _missing:
+            self[key] = default
+            return default
+        return value
+
+    def pop(self, key, default=_missing):
+        value = self.get(key, _missing)
+        if value is _missing:
+            if default is _missing:
+                raise KeyError(key)
+            return default
+        del self[key]
+        return value
+
+    def __repr__(self):
+        return 'RequestData(%s)' % ', '.join('%s=%r' % item for item in self.items())
+
+
 class ThreadRequestContextMeta(type):
     # property() doesn't work on classmethods,
     #  see http://stackoverflow.com/q/128573/1231454
     @property
     def data(cls):
-        if not hasattr(cls._state, 'data'):
-           return ObjectDict()
-        return cls._state.data
+        data = _request_context.get()
+        if data is None:
+            return RequestData()
+        return data
 
 
 class ThreadRequestContext(with_metaclass(ThreadRequestContextMeta)):
-    """A context manager that saves some per-thread state globally.
-    Intended for use with Tornado's StackContext.
+    """A context manager that saves some per-request state in a context variable.
+    Works with tornado coroutines, native `async def` handlers, and executor
+    threads started with run_in_context.
 
     Provide arbitrary data as kwargs upon creation,
     then use ThreadRequestContext.data to access it.
     """
 
-    _state = threading.local()
-    _state.data = {}
+    __slots__ = ('_data', '_token')
 
     def __init__(self, **data):
-        self._data = ObjectDict(data)
+        self._data = RequestData(**data)
 
     def __enter__(self):
-        self._prev_data = self.__class__.data
-        self.__class__._state.data = self._data
+        self._token = _request_context.set(self._data)
 
     def __exit__(self, *exc):
-        self.__class__._state.data = self._prev_data
-        del self._prev_data
+        _request_context.reset(self._token)
+        del self._token
         return False
 
+
+def request_memoize(func):
+    """
+    Cache the result of func for the rest of the current request.
+
+    The cache lives in ThreadRequestContext.data and is cleared when the request finishes,
+    this is useful for permission checks or lookups that are done many times per request:
+
+    @request_memoize
+    def get_team(db, team_id):
+        return db.query(Team).get(team_id)
+
+    All arguments must be hashable, otherwise func is just called.
+    Outside of a request nothing is cached.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        data = ThreadRequestContext.data
+        if 'request' not in data:
+            return func(*args, **kwargs)
+
+        try:
+            key = (func, args, frozenset(kwargs.items()))
+            hash(key)
+        except TypeError:
+            return func(*args, **kwargs)
+
+        memo = data.setdefault('memo', {})
+        stats = data.setdefault('memo_stats', dict(hits=0, misses=0))
+        if key in memo:
+            stats['hits'] += 1
+            metrics.incr('request.memoize.hits')
+            return memo[key]
+
+        stats['misses'] += 1
+        metrics.incr('request.memoize.misses')
+        rval = memo[key] = func(*args, **kwargs)
+        return rval
+    return wrapper
+
+
 class BaseHandler(tornado.web.RequestHandler):
 
-    def _execute(self, transforms, *args, **kwargs):
+    # fields (dotted paths) that ?fields= may add to the output, see parse_fields
+    allowed_fields = None
+    fields_argument = 'fields'
+    # the BaseModel class of the output, ?fields= can then only name fields it renders
+    fields_model = None
+    # run db statements in autocommit mode, and refuse flushes, see bbtornado.session
+    read_only_db = False
+    # signed cookie expiry, and user fields stored in a stateless user token, see bbtornado.auth
+    user_cookie_max_age_days = 31
+    user_snapshot_fields = None
+    user_token_max_age_days = 1
+    # the BatchHandler running this as a sub-request, see bbtornado.batch
+    batch_parent = None
+
+    async def _execute(self, transforms, *args, **kwargs):
         """
-        Override this to save some data in a StackContact local dict
+        Override this to save some data in the request context
         """
-        global_data = dict(request=self.request)
-
-        with tornado.stack_context.StackContext(partial(ThreadRequestContext, **global_data)):
+        # sub-requests are counted as part of their batch request
+        if self.batch_parent is None:
+            self._in_flight = True
+            metrics.incr('requests.in_flight')
+            self._load_shedder = getattr(self.application, 'load_shedder', None)
+            if self._load_shedder is not None:
+                self._load_shedder.started()
+
+        with ThreadRequestContext(request=self.request):
+            # kept for callbacks from outside the request, i.e. on_connection_close
+            self._context = contextvars.copy_context()
             # this uses ORM, which needs a DB connection, which needs ThreadRequestContext.data.request
             # so it must be here.
             ThreadRequestContext.data.current_user = self.current_user
-            return super(BaseHandler, self)._execute(transforms, *args, **kwargs)
+            return await super(BaseHandler, self)._execute(transforms, *args, **kwargs)
+
+    @property
+    def request_session(self):
+        """The lazily created db session and connection of this request, see bbtornado.session"""
+        if not hasattr(self, '_request_session'):
+            self._request_session = RequestSession(self.application, read_only=self.read_only_db,
+                                                  request=self.request)
+        return self._request_session
 
     @property
     def db(self):
-        if not hasattr(self, '_session'):
-            self._session = self.application.Session()
-        return self._session
+        return self.request_session.session
+
+    @property
+    def conn(self):
+        """A Core connection, for handlers that do not need the ORM"""
+        return self.request_session.conn
+
+    @property
+    def memo_stats(self):
+        """Hits and misses of @request_memoize functions during this request"""
+        return ThreadRequestContext.data.get('memo_stats', dict(hits=0, misses=0))
 
     def on_finish(self):
-        if hasattr(self, '_session') and self._session:
-            self.application.Session.remove()
-            del self._session
+        if getattr(self, '_in_flight', False):
+            self._in_flight = False
+            metrics.incr('requests.in_flight', -1)
+            metrics.incr('requests.served')
+            if self._load_shedder is not None:
+                self._load_shedder.finished()
+
+        # may be called twice, from on_connection_close and finish, closing only what is open
+        if hasattr(self, '_request_session'):
+            self._request_session.close()
+
+        # background tasks run after the response is sent
+        for fn, args, kwargs in getattr(self, '_tasks', ()):
+            try:
+                self.task_queue.enqueue(fn, *args, **kwargs)
+            except Exception:
+                log.exception('Could not enqueue task %s', fn)
+        self._tasks = []
+
+        memo_stats = ThreadRequestContext.data.pop('memo_stats', None)
+        if memo_stats:
+            log.debug('%s %s memoize hits: %d misses: %d', self.request.method, self.request.uri,
+                      memo_stats['hits'], memo_stats['misses'])
+        ThreadRequestContext.data.pop('memo', None)
+
+    @property
+    def task_queue(self):
+        tasks = getattr(self.application, 'tasks', None)
+        if tasks is None:
+            tasks = default_queue()
+        return tasks
+
+    def enqueue(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) in the background after the response is sent,
+        see bbtornado.tasks
+        """
+        if not hasattr(self, '_tasks'):
+            self._tasks = []
+        self._tasks.append((fn, args, kwargs))
 
     def on_connection_close(self):
-        self.on_finish()
+        # this is called from the connection, outside the request context
+        context = getattr(self, '_context', None)
+        if context is not None:
+            context.run(self.on_finish)
+        else:
+            self.on_finish()
 
     def get_current_user(self):
-        user_id = self.get_secure_cookie('user_id')
         try:
+            snapshot = self.get_user_snapshot()
+            if snapshot is not None:
+                return snapshot
+            user_id = self.get_user_id()
             if self.application.user_model is not None:
-                return self.db.query(self.application.user_model).get(int(user_id)) if user_id else None
+                return self.db.query(self.application.user_model).get(user_id) if user_id else None
             else:
-                return int(user_id) if user_id else None
+                return user_id
         except:
             log.exception('Exception while trying to get current user')
             return None
 
+    def get_user_id(self):
+        """The user id of the user_id cookie, verified once per cookie value, see bbtornado.auth"""
+        value = self.get_cookie('user_id')
+        if not value:
+            return None
+
+        def decode(value):
+            user_id = self.get_secure_cookie('user_id', value=value, max_age_days=self.user_cookie_max_age_days)
+            return int(user_id) if user_id else None
+        return auth.cached_decode(auth.signed_value_cache(self.application), 'user_id', value,
+                                  self.user_cookie_max_age_days, decode)
+
+    def get_user_snapshot(self):
+        """The UserSnapshot of a valid user token, if the handler has user_snapshot_fields"""
+        if self.user_snapshot_fields is None:
+            return None
+        token = self.get_cookie('user_token')
+        header = self.request.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            token = header[7:].strip()
+        if not token:
+            return None
+
+        self.require_setting('cookie_secret', 'user tokens')
+        secret = self.application.settings['cookie_secret']
+        data = auth.cached_decode(auth.signed_value_cache(self.application), 'user_token', token,
+                                  self.user_token_max_age_days,
+                                  lambda token: auth.decode_token(secret, token, self.user_token_max_age_days))
+        return auth.UserSnapshot(data) if data is not None else None
+
+    def create_user_token(self, user):
+        """A signed token with a snapshot of the user_snapshot_fields of user"""
+        self.require_setting('cookie_secret', 'user tokens')
+        return auth.create_token(self.application.settings['cookie_secret'], user, self.user_snapshot_fields or (),
+                                 key_version=self.application.settings.get('key_version'))
+
     @tornado.web.RequestHandler.current_user.setter
     def current_user(self, value):
+        user = value
         if self.application.user_model is not None and isinstance(value, self.application.user_model):
             value = value.id
         self.set_secure_cookie('user_id', str(value), domain=self.application.domain)
+        if self.user_snapshot_fields is not None:
+            if user is not value:
+                self.set_cookie('user_token', self.create_user_token(user), domain=self.application.domain,
+                                expires_days=self.user_token_max_age_days)
+            else:
+                self.clear_cookie('user_token', domain=self.application.domain)
 
 
     @property
@@ -155,16 +466,227 @@ class BaseHandler(tornado.web.RequestHandler):
     def get_executor(self):
         return self._default_executor
 
-    def prepare(self):
-        """Puts any json data into self.request.arguments"""
-        if any(('application/json' in x for x in self.request.headers.get_list('Content-Type'))):
+    # Per-route overrides for the offload thresholds, None means use the
+    # application setting. Set to float('inf') to never offload for a handler.
+    offload_body_size = None
+    offload_output_items = None
+
+    def get_offload_threshold(self, name, default):
+        value = getattr(self, name, None)
+        if value is None:
+            value = self.settings.get(name, default)
+        return value
+
+    def should_offload(self, kind, size):
+        """
+        Decide if work of the given kind (decode, serialize or validate) and size
+        should run on the executor rather than the IOLoop thread.
+        Decoding is measured in bytes, the rest in number of items.
+        """
+        if kind == 'decode':
+            threshold = self.get_offload_threshold('offload_body_size', DEFAULT_OFFLOAD_BODY_SIZE)
+        else:
+            threshold = self.get_offload_threshold('offload_output_items', DEFAULT_OFFLOAD_OUTPUT_ITEMS)
+
+        offload = threshold is not None and size > threshold
+        metrics.incr('offload.%s.%s' % (kind, 'offloaded' if offload else 'inline'))
+        return offload
+
+    def run_offloaded(self, fn, *args, **kwargs):
+        """Run fn on the handlers executor in the request context, returns a future"""
+        return run_in_context(self.executor, fn, *args, **kwargs)
+
+    @property
+    def fields(self):
+        """
+        The `extra_fields` from the `?fields=` argument, see `parse_fields`.
+        Fields that add to the output must be in `allowed_fields`,
+        with a `fields_model` all fields must be visible fields of the model.
+        """
+        if not hasattr(self, '_fields'):
+            spec = self.get_query_argument(self.fields_argument, None)
             try:
-                json_data = json_decode(self.request.body)
-            except ValueError:
-                raise tornado.web.HTTPError(400, "Invalid JSON structure.", reason="Invalid JSON structure.")
-            if type(json_data) != dict:
-                raise tornado.web.HTTPError(400, "We only accept key value objects!", reason="We only accept key value objects!")
-            self.json_data = json_data
+                self._fields = parse_fields(spec, self.allowed_fields, self.fields_model) if spec else []
+            except ValueError as e:
+                # the error response is written without fields
+                self._fields = []
+                raise JsonError(400, str(e))
+        return self._fields
+
+    def _json_kwargs(self, kwargs):
+        if self.fields:
+            kwargs['extra_fields'] = list(kwargs.get('extra_fields') or []) + self.fields
+        return kwargs
+
+    @property
+    def response_format(self):
+        """The format dicts are written in, negotiated from the Accept header, see bbtornado.formats"""
+        if not hasattr(self, '_response_format'):
+            self._response_format = formats.negotiate_format(self.request)
+        return self._response_format
+
+    def write(self, chunk):
+        """
+        Models and queries are written with `_to_json`, with the requested `fields`,
+        as MessagePack if the client accepts it.
+        """
+        if isinstance(chunk, (Query, BaseModel)) or (self.fields and isinstance(chunk, (dict, list, tuple))):
+            if isinstance(chunk, Query):
+                chunk = project_query(chunk, self.fields)
+            chunk = _to_json(chunk, **self._json_kwargs({}))
+
+        if isinstance(chunk, (dict, list)) and formats.msgpack is not None:
+            vary = self._headers.get('Vary')
+            if not vary:
+                self.set_header('Vary', 'Accept')
+            elif 'Accept' not in [v.strip() for v in vary.split(',')]:
+                self.set_header('Vary', vary + ', Accept')
+            if self.response_format == formats.MSGPACK:
+                self.set_header('Content-Type', formats.MSGPACK)
+                chunk = formats.packb(chunk)
+
+        if isinstance(chunk, list):
+            # lists can be written with json_encode
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+            chunk = json_encode(chunk)
+        return super(BaseHandler, self).write(chunk)
+
+    @coroutine
+    def to_json(self, data, **kwargs):
+        """
+        Serialise models/queries into json-able structures with `_to_json`,
+        with the requested `fields`. Large results are serialised on the executor.
+
+        Queries are executed, and the relationships the output needs are loaded, on the
+        IOLoop thread, the request session is never used from the executor.
+        """
+        kwargs = self._json_kwargs(kwargs)
+        if isinstance(data, Query):
+            data = project_query(data, kwargs.get('extra_fields') or []).all()
+
+        if self.should_offload('serialize', _payload_items(data)):
+            _load_for_json(data, **kwargs)
+            raise Return((yield self.run_offloaded(_to_json, data, **kwargs)))
+        raise Return(_to_json(data, **kwargs))
+
+    def add_response_listener(self, listener):
+        """
+        Call listener(status_code, headers, body) with the complete response
+        before it is written, i.e. to cache it. For streamed responses the body is None.
+        """
+        if not hasattr(self, '_response_listeners'):
+            self._response_listeners = []
+        self._response_listeners.append(listener)
+
+    def flush(self, include_footers=False, *args, **kwargs):
+        if not self._headers_written and getattr(self, '_response_listeners', None):
+            body = b''.join(self._write_buffer) if include_footers else None
+            for listener in self._response_listeners:
+                listener(self._status_code, self._headers, body)
+        return super(BaseHandler, self).flush(include_footers, *args, **kwargs)
+
+    def write_error(self, status_code, **kwargs):
+        _set_error_headers(self, kwargs)
+        super(BaseHandler, self).write_error(status_code, **kwargs)
+
+    # Rate limits for this handler, None means use the rate_limits of the application
+    rate_limits = None
+
+    def get_rate_limits(self):
+        if self.rate_limits is not None:
+            return self.rate_limits
+        return getattr(self.application, 'rate_limits', None) or ()
+
+    def check_limits(self):
+        """
+        Reject the request with a 503 if the application is overloaded,
+        or with a 429 if the client is over a rate limit.
+
+        Sub-requests of a batch were checked against the load and the application's
+        rate limits with their batch request, only the rate_limits of the handler apply.
+
+        Returns a future only when a rate limit store is asynchronous.
+        """
+        if self.batch_parent is None:
+            load_shedder = getattr(self.application, 'load_shedder', None)
+            if load_shedder is not None:
+                load_shedder.check(self)
+            rate_limits = iter(self.get_rate_limits())
+        else:
+            rate_limits = iter(self.rate_limits or ())
+        for rate_limit in rate_limits:
+            retry_after = rate_limit.take(self)
+            if is_future(retry_after):
+                return self._check_limits_async(retry_after, rate_limits)
+            self._check_retry_after(retry_after)
+
+    @coroutine
+    def _check_limits_async(self, retry_after, rate_limits):
+        self._check_retry_after((yield retry_after))
+        for rate_limit in rate_limits:
+            retry_after = rate_limit.take(self)
+            if is_future(retry_after):
+                retry_after = yield retry_after
+            self._check_retry_after(retry_after)
+
+    def _check_retry_after(self, retry_after):
+        if retry_after:
+            metrics.incr('ratelimit.rejected')
+            raise JsonError(429, 'Too many requests',
+                            headers={'Retry-After': str(int(math.ceil(retry_after)))})
+
+    def prepare(self):
+        """
+        Checks rate limits and load, and puts any json data into self.request.arguments
+
+        Errors are raised right away. Only large bodies (decoded on the executor) and
+        asynchronous rate limit stores make this return a future, subclasses overriding
+        prepare should return (or yield) the result of the super call when it is not None.
+        """
+        limits = self.check_limits()
+        if limits is not None:
+            return self._prepare_async(limits)
+
+        decode = self._body_decoder()
+        if decode is not None:
+            if self.should_offload('decode', len(self.request.body)):
+                return self._prepare_async(None, decode)
+            self._set_json_data(self._decode_body(decode))
+
+    @coroutine
+    def _prepare_async(self, limits, decode=None):
+        if limits is not None:
+            yield limits
+            decode = self._body_decoder()
+            if decode is None:
+                return
+            if not self.should_offload('decode', len(self.request.body)):
+                self._set_json_data(self._decode_body(decode))
+                return
+        json_data = yield self.run_offloaded(self._decode_body, decode)
+        self._set_json_data(json_data)
+
+    def _body_decoder(self):
+        """The function decoding the request body, from its Content-Type"""
+        content_types = self.request.headers.get_list('Content-Type')
+        if any(('application/json' in x for x in content_types)):
+            return json_decode
+        elif any(formats.is_msgpack(x) for x in content_types):
+            if formats.msgpack is None:
+                raise tornado.web.HTTPError(415, "MessagePack is not supported.", reason="MessagePack is not supported.")
+            return formats.unpackb
+        return None
+
+    def _decode_body(self, decode):
+        try:
+            return decode(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400, "Invalid request body.", reason="Invalid request body.")
+
+    def _set_json_data(self, json_data):
+        if type(json_data) != dict:
+            raise tornado.web.HTTPError(400, "We only accept key value objects!", reason="We only accept key value objects!")
+        self.json_data = json_data
 
     def _get_arguments(self, name, source, strip=True):
         """Override _get_arguments to also look-up json args"""
@@ -0,0 +1,278 @@
+"""
+Operational endpoints for load balancers and monitoring.
+
+- `/healthz`: the process and its IOLoop are alive, does not touch the db.
+- `/readyz`: a db connection can be checked out within `readiness_timeout` seconds, and
+  the application is not shutting down. Returns 503 with the reason otherwise.
+- `/stats`: in-flight requests, handler executor queue depth, db pool usage, IOLoop lag
+  and background tasks of this process, as json.
+
+Enable them with the `health` app setting, they are added under the server base:
+
+tornado:
+  app_settings:
+    health:
+      prefix: ''               # i.e. /internal for /internal/healthz
+      readiness_timeout: 1     # seconds
+      stats: true
+      drain_grace: 5           # seconds to keep serving after /readyz fails on shutdown
+
+When the server runs several processes (tornado.process.fork_processes), or
+`stats_dir` is set, every process writes its stats to a file in `stats_dir` every
+`stats_interval` seconds, and /stats also returns the stats of all workers and their totals.
+Workers start writing with the first request to one of these endpoints (the load balancer
+probes), or when `application.worker_stats.start()` is called.
+
+All of these are cheap enough to poll every second.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import tornado.web
+from tornado import gen
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.process import task_id
+
+from bbtornado import metrics
+from bbtornado.lag import LagMonitor
+from bbtornado.ratelimit import executor_queue_depth
+
+log = logging.getLogger('bbtornado.health')
+
+DEFAULT_STATS_INTERVAL = 1.0
+DEFAULT_DRAIN_GRACE = 5
+
+_started = time.time()
+
+
+def _lag_monitor(application):
+    """The lag monitor of the load shedder, or one started for the stats"""
+    monitor = getattr(getattr(application, 'load_shedder', None), 'lag_monitor', None)
+    if monitor is None:
+        monitor = getattr(application, 'lag_monitor', None)
+        if monitor is None:
+            monitor = application.lag_monitor = LagMonitor()
+    monitor.start()
+    return monitor
+
+
+def process_stats(application, executor=None):
+    """The stats of this process"""
+    if executor is None:
+        from bbtornado.handlers import BaseHandler
+        executor = BaseHandler._default_executor
+    monitor = _lag_monitor(application)
+    tasks = getattr(application, 'tasks', None)
+    pool_stats = getattr(application, 'pool_stats', None)
+    return dict(pid=os.getpid(),
+                worker=task_id(),
+                time=time.time(),
+                uptime=time.time() - _started,
+                draining=getattr(application, 'draining', False),
+                requests=dict(in_flight=metrics.get('requests.in_flight'),
+                              served=metrics.get('requests.served')),
+                executor=dict(queue_depth=executor_queue_depth(executor),
+                              threads=getattr(executor, '_max_workers', None)),
+                db_pool=pool_stats.as_dict() if pool_stats is not None else None,
+                ioloop=dict(lag=monitor.lag, max_lag=monitor.max_lag),
+                tasks=dict(unfinished=tasks.unfinished) if tasks is not None else None)
+
+
+def aggregate(workers):
+    """Totals of the stats of several workers"""
+    def total(section, key, fn=sum):
+        values = [w[section][key] for w in workers if w.get(section) and w[section].get(key) is not None]
+        return fn(values) if values else None
+
+    return dict(workers=len(workers),
+                requests=dict(in_flight=total('requests', 'in_flight'),
+                              served=total('requests', 'served')),
+                executor=dict(queue_depth=total('executor', 'queue_depth')),
+                db_pool=dict(checked_out=total('db_pool', 'checked_out'),
+                             timeouts=total('db_pool', 'timeouts')),
+                ioloop=dict(lag=total('ioloop', 'lag', max),
+                            max_lag=total('ioloop', 'max_lag', max)),
+                tasks=dict(unfinished=total('tasks', 'unfinished')))
+
+
+class WorkerStats(object):
+
+    """
+    Shares the stats of each worker process through files in a directory.
+    Enabled in forked worker processes, or when a directory is given.
+    """
+
+    def __init__(self, application, directory=None, interval=DEFAULT_STATS_INTERVAL):
+        self.application = application
+        self._directory = directory
+        self.interval = interval
+        self._timer = None
+
+    @property
+    def enabled(self):
+        return self._directory is not None or task_id() is not None
+
+    @property
+    def directory(self):
+        if self._directory is None:
+            # shared by the processes forked from the same parent
+            return os.path.join(tempfile.gettempdir(), 'bbtornado-stats-%d' % os.getppid())
+        return self._directory
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, '%d.json' % os.getpid())
+
+    def start(self):
+        """Start writing the stats of this process, on the current IOLoop"""
+        if self._timer is None and self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            self._timer = PeriodicCallback(self.write, self.interval * 1000)
+            self._timer.start()
+            self.write()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def write(self):
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as fd:
+                json.dump(process_stats(self.application), fd)
+            os.rename(tmp, self.path)
+        except (OSError, ValueError):
+            log.exception('Could not write worker stats')
+
+    def read(self):
+        """The stats of all live workers, files of workers that stopped writing are skipped"""
+        rval = []
+        oldest = time.time() - 3 * self.interval
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as fd:
+                    stats = json.load(fd)
+            except (OSError, ValueError):
+                continue
+            if stats['time'] >= oldest:
+                rval.append(stats)
+        rval.sort(key=lambda s: (s['worker'] is None, s['worker'] or 0, s['pid']))
+        return rval
+
+
+class ReadinessCheck(object):
+
+    """Checks out a db connection on its own thread, at most one check at a time"""
+
+    def __init__(self, engine, timeout=1.0):
+        self.engine = engine
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(1)
+        self._pending = None
+
+    def _checkout(self):
+        self.engine.connect().close()
+
+    @coroutine
+    def check(self):
+        """Returns why the application is not ready, or None"""
+        if self._pending is None or self._pending.done():
+            self._pending = IOLoop.current().run_in_executor(self.executor, self._checkout)
+        try:
+            yield gen.with_timeout(timedelta(seconds=self.timeout), self._pending)
+        except gen.TimeoutError:
+            return 'db_timeout'
+        except Exception:
+            log.exception('Readiness check failed')
+            return 'db_error'
+        return None
+
+
+class _HealthHandler(tornado.web.RequestHandler):
+
+    def set_default_headers(self):
+        self.set_header('Cache-Control', 'no-cache')
+
+    def prepare(self):
+        # workers share their stats from the first probe, the IOLoop runs in the worker by then
+        worker_stats = getattr(self.application, 'worker_stats', None)
+        if worker_stats is not None:
+            worker_stats.start()
+
+
+class HealthHandler(_HealthHandler):
+
+    """The process is alive, and its IOLoop is running this"""
+
+    def get(self):
+        self.write(dict(status='ok'))
+
+    head = get
+
+
+class ReadyHandler(_HealthHandler):
+
+    """The application can serve requests: it is not shutting down, and has db connections"""
+
+    def initialize(self, readiness):
+        self.readiness = readiness
+
+    @coroutine
+    def get(self):
+        if getattr(self.application, 'draining', False):
+            reason = 'draining'
+        else:
+            reason = yield self.readiness.check()
+        if reason is not None:
+            self.set_status(503)
+            self.write(dict(status='unavailable', reason=reason))
+        else:
+            self.write(dict(status='ok'))
+
+    head = get
+
+
+class StatsHandler(_HealthHandler):
+
+    """The stats of this process, and of all workers when they share them"""
+
+    def get(self):
+        stats = process_stats(self.application)
+        worker_stats = getattr(self.application, 'worker_stats', None)
+        if worker_stats is not None and worker_stats.enabled:
+            workers = worker_stats.read()
+            stats = dict(stats, workers=workers, total=aggregate(workers))
+        self.write(stats)
+
+
+def add_handlers(application, base='', prefix='', readiness_timeout=1.0, stats=True, stats_dir=None,
+                 stats_interval=DEFAULT_STATS_INTERVAL, drain_grace=DEFAULT_DRAIN_GRACE):
+    """Add the health, readiness and stats endpoints to an application"""
+    # seconds between /readyz failing and the server stopping, see main.shutdown
+    application.drain_grace = drain_grace
+    prefix = base + prefix
+    readiness = ReadinessCheck(application.engine, readiness_timeout)
+    handlers = [(prefix + '/healthz', HealthHandler),
+                (prefix + '/readyz', ReadyHandler, dict(readiness=readiness))]
+
+    if stats:
+        application.worker_stats = WorkerStats(application, stats_dir, stats_interval)
+        handlers.append((prefix + '/stats', StatsHandler))
+
+    application.add_handlers('.*$', handlers)
+    return handlers
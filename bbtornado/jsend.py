@@ -1,6 +1,20 @@
 # source:
 # https://github.com/hfaran/Tornado-JSON/blob/master/tornado_json/jsend.py
 
+import logging
+
+from collections.abc import Iterator
+
+from sqlalchemy.orm.query import Query
+from tornado.escape import json_encode
+from tornado.gen import coroutine
+from tornado.iostream import StreamClosedError
+
+from bbtornado.models import _to_json
+
+
+log = logging.getLogger('bbtornado')
+
 
 class JSendMixin(object):
 
@@ -18,10 +32,59 @@ class JSendMixin(object):
         :type  data: A JSON-serializable object
         :param data: Acts as the wrapper for any data returned by the API
             call. If the call returns no data, data should be set to null.
+            Iterators (i.e. generators) and queries are written as a list,
+            use ``stream_success`` to stream them.
         """
+        if isinstance(data, (Iterator, Query)):
+            json_kwargs = self._json_kwargs({}) if hasattr(self, '_json_kwargs') else {}
+            data = _to_json(list(data), **json_kwargs)
         self.write({'status': 'success', 'data': data})
         self.finish()
 
+    # stream iterators and queries returned by validate_json_output methods
+    stream_output = False
+    # items written between flushes when streaming
+    stream_batch_size = 100
+
+    @coroutine
+    def stream_success(self, items):
+        """Write a success envelope with a list of items, flushing every
+        ``stream_batch_size`` items, so the response is sent with chunked
+        transfer encoding while the items are generated.
+
+        The status comes after the data, if an exception happens after the
+        first flush the envelope is closed with an error status instead:
+        {"data": [...], "status": "error", "message": "..."}
+        Before the first flush, the exception is raised as usual.
+        Streaming stops when the client disconnects.
+
+        Returns a future, return or yield it from the handler method.
+        """
+        json_kwargs = self._json_kwargs({}) if hasattr(self, '_json_kwargs') else {}
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write('{"data": [')
+        count = 0
+        try:
+            for item in items:
+                self.write((', ' if count else '') + json_encode(_to_json(item, **json_kwargs)))
+                count += 1
+                if count % self.stream_batch_size == 0:
+                    yield self.flush()
+        except StreamClosedError:
+            log.debug('Client disconnected while streaming response')
+            return
+        except Exception:
+            if not self._headers_written:
+                self.clear()
+                raise
+            log.exception('Error while streaming response')
+            self.write('], "status": "error", "message": "Internal error"}')
+            self.finish()
+            return
+
+        self.write('], "status": "success"}')
+        self.finish()
+
     def fail(self, message, data=None, field=None):
         """There was a problem with the data submitted, or some pre-condition
         of the API call wasn't satisfied.
@@ -0,0 +1,58 @@
+"""
+Measure IOLoop lag, i.e. how late scheduled callbacks run.
+
+A callback is scheduled every `interval` seconds, the difference between
+when it should have run and when it did is the lag. If the IOLoop is blocked
+by synchronous code, the lag grows.
+
+The last measured lag is available as `monitor.lag` and the `ioloop.lag` gauge.
+"""
+
+import time
+
+from tornado.ioloop import IOLoop
+
+from bbtornado import metrics
+
+
+class LagMonitor(object):
+
+    def __init__(self, interval=0.5, io_loop=None):
+        self.interval = interval
+        self.io_loop = io_loop
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._timeout = None
+        self._deadline = None
+
+    @property
+    def running(self):
+        return self._timeout is not None
+
+    def start(self):
+        if self.running:
+            return
+        if self.io_loop is None:
+            self.io_loop = IOLoop.current()
+        self._schedule()
+
+    def stop(self):
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _schedule(self):
+        self._deadline = time.time() + self.interval
+        self._timeout = self.io_loop.call_later(self.interval, self._tick)
+
+    def _tick(self):
+        self.lag = max(0.0, time.time() - self._deadline)
+        if self.lag > self.max_lag: self.max_lag = self.lag
+        metrics.gauge('ioloop.lag', self.lag)
+        metrics.timing('ioloop.lag', self.lag)
+        self.on_lag(self.lag)
+        self._schedule()
+
+    def on_lag(self, lag):
+        """Override to act on each measurement"""
+        pass
@@ -0,0 +1,168 @@
+"""
+Logging off the IOLoop.
+
+`setup_logging` moves the handlers of the root logger (i.e. the console handler of
+tornado.options, files, a SlackHandler) behind a queue: the IOLoop only puts records
+in the queue, formatting (including tracebacks) and I/O happen on a listener thread.
+When the queue is full, records are dropped and counted in `logs.dropped`.
+
+Repeated errors (same logger, level, message template and exception type, whatever the
+arguments, i.e. the uri and body of a 500) are sampled:
+`sample_burst` of them are logged per `sample_window` seconds, the next one logged
+says how many were suppressed, counted in `logs.suppressed`.
+
+`main.setup` enables it from the `logging` section of the config:
+
+logging:
+  queue: true
+  max_queue: 10000
+  sample_window: 60     # seconds, 0 disables sampling
+  sample_burst: 5
+  sample_level: ERROR
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+
+from bbtornado import metrics
+
+DEFAULT_MAX_BODY_LOG = 1024
+
+_listener = None
+_lock = threading.Lock()
+
+
+def truncate(value, max_length=DEFAULT_MAX_BODY_LOG):
+    """Shorten a logged value (i.e. a request body) to max_length characters/bytes"""
+    if max_length is None or value is None or len(value) <= max_length:
+        return value
+    if isinstance(value, bytes):
+        return value[:max_length] + b'... (%d bytes)' % len(value)
+    return value[:max_length] + '... (%d characters)' % len(value)
+
+
+class SamplingFilter(logging.Filter):
+
+    """Logs `burst` identical records per `window` seconds, at or above `level`"""
+
+    def __init__(self, window=60, burst=5, level=logging.ERROR, max_keys=1000):
+        super(SamplingFilter, self).__init__()
+        self.window = window
+        self.burst = burst
+        self.level = level
+        self.max_keys = max_keys
+        # key -> [window start, count, suppressed]
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, record):
+        # the unformatted message, so records differing only in their arguments are sampled together
+        msg = record.msg if isinstance(record.msg, str) else str(record.msg)[:200]
+        exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        return (record.name, record.levelno, msg, exc_type)
+
+    def filter(self, record):
+        if record.levelno < self.level or not self.window:
+            return True
+        key = self.key(record)
+        now = time.time()
+        with self._lock:
+            seen = self._seen.pop(key, None)
+            if seen is None or now - seen[0] > self.window:
+                suppressed = seen[2] if seen is not None else 0
+                seen = [now, 0, 0]
+            else:
+                suppressed = 0
+            self._seen[key] = seen
+            while len(self._seen) > self.max_keys:
+                self._seen.popitem(last=False)
+
+            seen[1] += 1
+            if seen[1] > self.burst:
+                seen[2] += 1
+                metrics.incr('logs.suppressed')
+                return False
+
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = '%s (%d similar messages suppressed)' % (record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+
+class AsyncQueueHandler(QueueHandler):
+
+    """
+    Puts records in the queue without formatting them, only the message is merged
+    with its args. Tracebacks are formatted by the listener.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            metrics.incr('logs.dropped')
+
+
+def setup_logging(handlers=None, logger=None, queue=True, max_queue=10000, sample_window=60, sample_burst=5,
+                  sample_level=logging.ERROR):
+    """
+    Put the handlers of logger (the root logger by default) behind a queue and a listener thread,
+    and sample repeated errors. Returns the QueueListener, it is stopped at exit.
+    """
+    global _listener
+    logger = logger or logging.getLogger()
+    if isinstance(sample_level, str):
+        sample_level = logging.getLevelName(sample_level)
+    sampling = SamplingFilter(sample_window, sample_burst, sample_level) if sample_window else None
+
+    with _lock:
+        if not queue:
+            if sampling is not None:
+                for handler in logger.handlers:
+                    handler.addFilter(sampling)
+            return None
+        if _listener is not None:
+            return _listener
+
+        if handlers is None:
+            handlers = list(logger.handlers)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+
+        records = Queue(max_queue)
+        queue_handler = AsyncQueueHandler(records)
+        if sampling is not None:
+            queue_handler.addFilter(sampling)
+        logger.addHandler(queue_handler)
+
+        _listener = QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.queue_handler = queue_handler
+        _listener.logger = logger
+        _listener.start()
+        atexit.register(stop_logging)
+        return _listener
+
+
+def stop_logging():
+    """Log the queued records, and put the handlers back on the logger"""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+        if listener is None:
+            return
+        listener.stop()
+        listener.logger.removeHandler(listener.queue_handler)
+        for handler in listener.handlers:
+            listener.logger.addHandler(handler)
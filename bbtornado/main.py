@@ -1,6 +1,7 @@
 import logging
 import time
 import signal
+import warnings
 import yaml
 from os.path import abspath, join, pardir
 
@@ -10,11 +11,15 @@ import tornado.options
 import tornado.log
 from tornado.util import ObjectDict
 from bbtornado import config as le_config
+from bbtornado.frozen import GlobalConfig, thaw
+from bbtornado.logs import setup_logging
+from bbtornado.watchdog import Watchdog
 
 
 log = logging.getLogger(__name__)
 
 http_server = None
+watchdog = None
 
 DEFAULT_HOST = "127.0.0.1"
 DEFAULT_PORT = 5000
@@ -47,6 +52,11 @@ def setup():
                         db_path=opts.db_path,
                         config=opts.config)
 
+    # log from a thread, with sampling of repeated errors, see bbtornado.logs
+    logging_opts = le_config.get('logging')
+    if logging_opts:
+        setup_logging(**({} if logging_opts is True else logging_opts))
+
     return not_parsed
 
 
@@ -105,11 +115,36 @@ def setup_global_config(**kwargs):
 
     validate_config(config)
 
-    # Update global config object
-    deep_copy(le_config, config)
+    # Update global config object, frozen for fast read only lookups
+    le_config._load(config)
+
+
+def update_global_config(changes):
+    '''Merges the (nested) dict changes into `bbtornado.config`, which is read
+    only, i.e. for tests or setup scripts changing some values.'''
+    config = thaw(le_config)
+    _merge(config, changes)
+    le_config._load(config)
+
+
+def _merge(config, changes):
+    for key, val in changes.items():
+        if isinstance(val, dict) and isinstance(config.get(key), dict):
+            _merge(config[key], val)
+        else:
+            config[key] = val
 
 
 def deep_copy(obj_cfg, src_dict):
+    '''Copies src_dict into obj_cfg, with nested dicts as ObjectDicts.
+    Deprecated, `bbtornado.config` is read only, change it with update_global_config.'''
+    warnings.warn('deep_copy is deprecated, use update_global_config to change bbtornado.config',
+                  DeprecationWarning, stacklevel=2)
+    if isinstance(obj_cfg, GlobalConfig):
+        config = thaw(obj_cfg)
+        config.update(src_dict)
+        obj_cfg._load(config)
+        return
     for key in src_dict.keys():
         val = src_dict[key]
         if isinstance(val, dict):
@@ -120,7 +155,6 @@ def deep_copy(obj_cfg, src_dict):
         obj_cfg[key] = new_val
 
 
-
 def read_config(config_path):
     '''Reads the config yaml.'''
     try:
@@ -173,28 +207,63 @@ def validate_config(config):
 
 
 MAX_WAIT_SECONDS_BEFORE_SHUTDOWN = 0
+MAX_WAIT_SECONDS_FOR_TASKS = 30
 
 def sig_handler(sig, frame):
     log.warning('Caught signal: %s', sig)
     tornado.ioloop.IOLoop.instance().add_callback_from_signal(shutdown)
 
 def shutdown():
+    # /readyz reports the drain, so load balancers stop sending requests,
+    # requests keep being served for the drain_grace seconds it takes them to notice
+    http_server.request_callback.draining = True
+    worker_stats = getattr(http_server.request_callback, 'worker_stats', None)
+    if worker_stats is not None:
+        worker_stats.stop()
+
+    drain_grace = getattr(http_server.request_callback, 'drain_grace', 0)
+    if drain_grace:
+        log.info('Draining for %s seconds ...', drain_grace)
+        tornado.ioloop.IOLoop.current().add_timeout(time.time() + drain_grace, stop_server)
+    else:
+        stop_server()
+
+
+def stop_server():
     log.info('Stopping http server')
     http_server.stop()
 
+    if watchdog is not None:
+        watchdog.stop()
+
     if hasattr(http_server.request_callback, 'shutdown_hook'):
         http_server.request_callback.shutdown_hook()
 
+    # write buffered rows
+    write_behind = getattr(http_server.request_callback, 'write_behind', None)
+    if write_behind is not None:
+        write_behind.close()
+
+    # wait for queued background tasks, at most their drain_timeout (or MAX_WAIT_SECONDS_FOR_TASKS)
+    tasks = getattr(http_server.request_callback, 'tasks', None)
+    drain_timeout = (tasks.drain_timeout or MAX_WAIT_SECONDS_FOR_TASKS) if tasks is not None else 0
+    drained = tasks.drain(drain_timeout) if tasks is not None else None
+
     log.info('Will shutdown in %s seconds ...', MAX_WAIT_SECONDS_BEFORE_SHUTDOWN)
     io_loop = tornado.ioloop.IOLoop.instance()
 
     deadline = time.time() + MAX_WAIT_SECONDS_BEFORE_SHUTDOWN
+    drain_deadline = time.time() + drain_timeout
 
     def stop_loop():
         now = time.time()
         if now < deadline and (io_loop._callbacks or io_loop._timeouts):
             io_loop.add_timeout(now + 1, stop_loop)
+        elif drained is not None and not drained.done() and now < drain_deadline:
+            io_loop.add_timeout(now + 0.1, stop_loop)
         else:
+            if drained is not None and not drained.done():
+                log.warning('Shutting down with %d unfinished tasks', tasks.unfinished)
             io_loop.stop()
             log.info('Shutdown')
     stop_loop()
@@ -204,6 +273,33 @@ def get_http_server():
     return http_server
 
 
+def start_watchdog():
+    """Start the IOLoop watchdog if it is enabled in config.tornado.watchdog"""
+    global watchdog
+
+    watchdog_opts = le_config.tornado.get('watchdog')
+    if not watchdog_opts:
+        return None
+    if watchdog_opts is True:
+        watchdog_opts = {}
+
+    watchdog = Watchdog(**watchdog_opts)
+    watchdog.start()
+    return watchdog
+
+
+def start_tasks(app):
+    """
+    Start the task queue of app if it is durable, so the tasks stored by a previous
+    process are recovered now, not with the next enqueue
+    """
+    tasks = getattr(app, 'tasks', None)
+    if tasks is None or not tasks.durable:
+        return None
+    tasks.start()
+    return tasks
+
+
 def main(app):
 
     global http_server
@@ -223,6 +319,9 @@ def main(app):
         signal.signal(signal.SIGTERM, sig_handler)
         signal.signal(signal.SIGINT, sig_handler)
 
+        start_watchdog()
+        start_tasks(app)
+
         try:
             tornado.ioloop.IOLoop.instance().start()
         except KeyboardInterrupt:
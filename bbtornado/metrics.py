@@ -0,0 +1,89 @@
+"""
+A very small in-process metrics registry.
+
+Counters, gauges and timers are kept in memory per process, and can be
+read back with `snapshot()`, i.e. for logging or from a stats handler.
+
+>>> from bbtornado import metrics
+>>> metrics.incr('json.offload.decode')
+>>> metrics.gauge('db.pool.checkedout', 3)
+>>> with metrics.timer('db.pool.checkout_wait'):
+...     conn = engine.connect()
+
+All operations are thread-safe, so they can be used from executor threads.
+"""
+
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = defaultdict(int)
+            self.gauges = {}
+            # name -> [count, total, max]
+            self.timers = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def timing(self, name, seconds):
+        with self._lock:
+            t = self.timers.get(name)
+            if t is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                t[0] += 1
+                t[1] += seconds
+                if seconds > t[2]: t[2] = seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, time.time() - start)
+
+    def get(self, name, default=0):
+        """Returns the current value of a counter or gauge"""
+        with self._lock:
+            if name in self.counters:
+                return self.counters[name]
+            return self.gauges.get(name, default)
+
+    def snapshot(self):
+        """Returns a json-serialisable copy of all current values"""
+        with self._lock:
+            timers = {}
+            for name, (count, total, mx) in self.timers.items():
+                timers[name] = dict(count=count, total=total, max=mx, avg=total/count)
+            return dict(counters=dict(self.counters),
+                        gauges=dict(self.gauges),
+                        timers=timers)
+
+
+# the global registry, and shortcuts for it
+registry = Metrics()
+
+incr = registry.incr
+gauge = registry.gauge
+timing = registry.timing
+timer = registry.timer
+get = registry.get
+snapshot = registry.snapshot
+reset = registry.reset
@@ -0,0 +1,327 @@
+"""
+A read-through cache of rows of BaseModel subclasses, for `Model.cached_get(session, id)`.
+
+Models opt in with a ttl in seconds:
+
+class User(Base, BaseModel):
+    _cache_ttl = 300
+
+    user = User.cached_get(self.db, user_id)
+
+Rows are cached as json snapshots of their column values, in two tiers: a per-process
+LRU (`max_entries` rows, kept at most `local_ttl` seconds), and an optional shared
+backend (i.e. redis, implement ModelCacheBackend) for `_cache_ttl` seconds. Rows with
+column values json can not hold (see `_encode`) are not cached. A cached row is added
+to the session as a persistent object without querying the db, relationships and other
+attributes are still loaded from the db when used.
+
+Only sessions of a watched sessionmaker (`watch(sessionmaker)`) use the cache, other
+sessions load the rows from the db. Rows changed or deleted through a watched session
+are invalidated when the session commits. Bulk updates (query.update, Core statements,
+the write-behind buffer) bypass the session, call `invalidate(Model, id)` after them,
+or do not cache those models. Other processes keep their local copy for at most
+`local_ttl` seconds.
+
+Enable it with the `model_cache` app setting, Application then watches its sessionmaker:
+
+tornado:
+  app_settings:
+    model_cache:
+      max_entries: 10000
+      local_ttl: 10
+"""
+
+import base64
+import datetime
+import decimal
+import json
+import logging
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+
+import sqlalchemy.orm
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from bbtornado import metrics
+
+log = logging.getLogger('bbtornado.modelcache')
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_LOCAL_TTL = 10
+
+
+class ModelCacheBackend(object):
+
+    """Interface for the shared tier, values are bytes"""
+
+    def get(self, key):
+        """Returns the value, or None"""
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError()
+
+    def delete(self, keys):
+        raise NotImplementedError()
+
+
+def cache_key(model, ident):
+    if not isinstance(ident, tuple):
+        ident = (ident,)
+    return '%s:%s' % (model.__table__.name, ':'.join(str(v) for v in ident))
+
+
+class ModelCache(object):
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, local_ttl=DEFAULT_LOCAL_TTL, backend=None):
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # rows loaded while anything was invalidated are not stored, they may be stale
+        self._invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def configure(self, max_entries=None, local_ttl=None, backend=None):
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if local_ttl is not None:
+            self.local_ttl = local_ttl
+        if backend is not None:
+            self.backend = backend
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # snapshots
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] >= time.time():
+                self._entries[key] = entry
+                metrics.incr('modelcache.hits.local')
+                return entry[1]
+
+        if self.backend is not None:
+            try:
+                value = self.backend.get(key)
+            except Exception:
+                log.exception('Model cache backend get failed')
+                value = None
+            if value is not None:
+                metrics.incr('modelcache.hits.shared')
+                self._set_local(key, value)
+                return value
+
+        metrics.incr('modelcache.misses')
+        return None
+
+    def _set_local(self, key, value, ttl=None):
+        ttl = self.local_ttl if ttl is None else min(ttl, self.local_ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _set(self, key, value, ttl):
+        self._set_local(key, value, ttl)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value, ttl)
+            except Exception:
+                log.exception('Model cache backend set failed')
+
+    def invalidate_keys(self, keys):
+        if not keys:
+            return
+        with self._lock:
+            self._invalidations += 1
+            for key in keys:
+                self._entries.pop(key, None)
+        metrics.incr('modelcache.invalidations', len(keys))
+        if self.backend is not None:
+            try:
+                self.backend.delete(list(keys))
+            except Exception:
+                log.exception('Model cache backend delete failed')
+
+    # models
+
+    def get(self, session, model, ident):
+        """The instance of model with the primary key ident, from the session, the cache or the db"""
+        ttl = getattr(model, '_cache_ttl', None)
+        if ttl is None or not session.info.get(_WATCHED):
+            # changes through unwatched sessions would not invalidate the row
+            return session.get(model, ident)
+
+        obj = session.identity_map.get(identity_key(model, ident))
+        if obj is not None:
+            return obj
+
+        key = cache_key(model, ident)
+        value = self._get(key)
+        if value is not None:
+            try:
+                return _restore(session, model, _loads(value))
+            except (ValueError, KeyError, TypeError):
+                log.exception('Invalid cached row %s', key)
+
+        invalidations = self._invalidations
+        obj = session.get(model, ident)
+        if obj is not None:
+            snapshot = _snapshot(obj)
+            # uncommitted changes of this session, or changes committed meanwhile, are not cached
+            if snapshot is not None and not session.is_modified(obj) and invalidations == self._invalidations:
+                self._set(key, _dumps(snapshot), ttl)
+        return obj
+
+    def invalidate(self, model, ident):
+        self.invalidate_keys([cache_key(model, ident)])
+
+
+# column values json can not hold, tagged with their type. Snapshots are never unpickled,
+# whoever can write to the shared backend can not run code in the application.
+_TYPES = (
+    (datetime.datetime, 'datetime', datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+    (datetime.date, 'date', datetime.date.isoformat, datetime.date.fromisoformat),
+    (datetime.time, 'time', datetime.time.isoformat, datetime.time.fromisoformat),
+    (datetime.timedelta, 'timedelta', datetime.timedelta.total_seconds, lambda v: datetime.timedelta(seconds=v)),
+    (decimal.Decimal, 'decimal', str, decimal.Decimal),
+    (uuid.UUID, 'uuid', str, uuid.UUID),
+    (bytes, 'bytes', lambda v: base64.b64encode(v).decode('ascii'), base64.b64decode),
+)
+_DECODERS = dict((tag, decode) for _, tag, _, decode in _TYPES)
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _encode(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    for cls, tag, encode, _ in _TYPES:
+        if type(value) is cls:
+            return {'$' + tag: encode(value)}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict) and all(isinstance(k, str) and not k.startswith('$') for k in value):
+        return dict((k, _encode(v)) for k, v in value.items())
+    raise _Unsupported(type(value))
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict):
+        if len(value) == 1:
+            key, = value
+            if key.startswith('$'):
+                return _DECODERS[key[1:]](value[key])
+        return dict((k, _decode(v)) for k, v in value.items())
+    return value
+
+
+def _dumps(snapshot):
+    return json.dumps(snapshot, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(value):
+    return dict((k, _decode(v)) for k, v in json.loads(value.decode('utf-8')).items())
+
+
+def _snapshot(obj):
+    """The json-able column values of obj, None if some are not loaded, or json can not hold them"""
+    state = sqlalchemy.inspect(obj)
+    loaded = state.dict
+    rval = {}
+    for attr in state.mapper.column_attrs:
+        if attr.key not in loaded:
+            return None
+        try:
+            rval[attr.key] = _encode(loaded[attr.key])
+        except _Unsupported:
+            return None
+    return rval
+
+
+def _restore(session, model, snapshot):
+    obj = sqlalchemy.orm.class_mapper(model).class_manager.new_instance()
+    for key, value in snapshot.items():
+        set_committed_value(obj, key, value)
+    make_transient_to_detached(obj)
+    return session.merge(obj, load=False)
+
+
+_default_cache = ModelCache()
+
+
+def default_cache():
+    return _default_cache
+
+
+def invalidate(model, ident):
+    """Remove a row from the cache, i.e. after updating it without the session"""
+    _default_cache.invalidate(model, ident)
+
+
+# invalidation through session events, of watched sessionmakers only
+
+_WATCHED = 'bbtornado_modelcache'
+_PENDING = 'bbtornado_modelcache_invalidate'
+
+
+def _after_flush(session, flush_context):
+    keys = None
+    for obj in list(session.dirty) + list(session.deleted):
+        if getattr(obj, '_cache_ttl', None) is None:
+            continue
+        ident = sqlalchemy.inspect(obj).identity
+        if ident is None:
+            continue
+        if keys is None:
+            keys = session.info.setdefault(_PENDING, set())
+        keys.add(cache_key(type(obj), tuple(ident)))
+
+
+def _after_commit(session):
+    keys = session.info.pop(_PENDING, None)
+    if keys:
+        _default_cache.invalidate_keys(keys)
+
+
+def _after_rollback(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_PENDING, None)
+
+
+_LISTENERS = (('after_flush', _after_flush),
+              ('after_commit', _after_commit),
+              ('after_soft_rollback', _after_rollback))
+
+
+def watch(maker):
+    """
+    Use the cache for the sessions of `maker` (a sessionmaker), and invalidate the rows
+    changed through them when they commit. Application does this for its sessionmaker
+    when the `model_cache` setting is set.
+    """
+    for name, fn in _LISTENERS:
+        if not event.contains(maker, name, fn):
+            event.listen(maker, name, fn)
+    info = dict(maker.kw.get('info') or {})
+    info[_WATCHED] = True
+    maker.configure(info=info)
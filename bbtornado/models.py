@@ -6,6 +6,8 @@ Mainly code for json serialisation, and protected/private fields that should not
 
 import sqlalchemy.orm
 
+from sqlalchemy import insert
+
 from datetime import datetime, date
 from decimal import Decimal
 
@@ -13,6 +15,8 @@ from sqlalchemy.orm.query import Query
 from sqlalchemy.orm.session import Session
 from sqlalchemy.ext.declarative import declarative_base
 
+from bbtornado import modelcache
+
 import uuid
 import json
 
@@ -56,6 +60,46 @@ def _to_json(o, *args, **kwargs):
 
     return o
 
+def _load_for_json(o, private=False, extra_fields=[], **kwargs):
+    """
+    Load the relationships and deferred columns `_to_json` reads from `o`, so
+    serialising it afterwards does no db work, i.e. when it runs on another thread
+    than the one owning the session.
+    """
+    if isinstance(o, dict):
+        o = o.values()
+    elif not isinstance(o, (list, tuple)):
+        o = [o]
+
+    for v in o:
+        if isinstance(v, (dict, list, tuple)):
+            _load_for_json(v, private, extra_fields)
+        elif isinstance(v, BaseModel):
+            state = sqlalchemy.inspect(v)
+            relationships = state.mapper.relationships
+            unloaded = state.unloaded
+            for k in v._json_fields(private, extra_fields):
+                if k in relationships or k in unloaded:
+                    next_fields = [ f[f.index('.')+1:] for f in extra_fields if '.' in f and f.startswith(k) ]
+                    _load_for_json(getattr(v, k), private, next_fields)
+
+def _only_field(val, field, private, extra_fields):
+    """
+    The values of a single ^field of a list of objects, for `users.^id`.
+    Objects that do not render the field (i.e. it is hidden) are rendered as usual.
+    """
+    visible = {}
+    rval = []
+    for v in val:
+        t = type(v)
+        if t not in visible:
+            visible[t] = hasattr(v, '_json_fields') and field in v._json_fields(private, extra_fields)
+        if visible[t]:
+            rval.append(_to_json(getattr(v, field)))
+        else:
+            rval.append(_to_json(v, private=private, extra_fields=extra_fields))
+    return rval
+
 class BaseModel(object):
 
     @property
@@ -84,20 +128,7 @@ class BaseModel(object):
 
         """
 
-        fields = { p.key for p in sqlalchemy.orm.object_mapper(self).iterate_properties }
-        fields.update(f for f in self._json_fields_public)
-
-        if not private:
-            fields.difference_update( self._json_fields_private )
-
-        fields.update(f for f in extra_fields if '.' not in f and f[0] not in ('!^'))
-        fields.difference_update( f[1:] for f in extra_fields if f.startswith('!') )
-
-        fields.difference_update( self._json_fields_hidden )
-
-        only_fields = [ f[1:] for f in extra_fields if f.startswith('^') ]
-        if only_fields:
-            fields.intersection_update(only_fields)
+        fields = self._json_fields(private, extra_fields)
 
         rval = {}
         for k in fields:
@@ -108,7 +139,7 @@ class BaseModel(object):
             val = getattr(self, k)
 
             if len(only_fields) == 1 and isinstance(val, (list, tuple)):
-                rval[k] = [ getattr(v, only_fields[0][1:]) for v in val ]
+                rval[k] = _only_field(val, only_fields[0][1:], private, next_fields)
             else:
 
                 rval[k] = _to_json(val,
@@ -121,10 +152,269 @@ class BaseModel(object):
 
         return rval
 
+    def _json_fields(self, private=False, extra_fields=[]):
+        """
+        The names of the fields `_to_json` renders for these arguments
+        """
+
+        fields = { p.key for p in sqlalchemy.orm.object_mapper(self).iterate_properties }
+        fields.update(f for f in self._json_fields_public)
+
+        if not private:
+            fields.difference_update( self._json_fields_private )
+
+        fields.update(f for f in extra_fields if '.' not in f and f[0] not in ('!^'))
+        fields.difference_update( f[1:] for f in extra_fields if f.startswith('!') )
+
+        fields.difference_update( self._json_fields_hidden )
+
+        only_fields = [ f[1:] for f in extra_fields if f.startswith('^') ]
+        if only_fields:
+            fields.intersection_update(only_fields)
+
+        return fields
+
     _json_fields_public = []
     _json_fields_private = []
     _json_fields_hidden = []
 
+    # rows per executemany in bulk_insert/bulk_upsert
+    _bulk_batch_size = 1000
+
+    # seconds rows are kept by cached_get, None does not cache them, see bbtornado.modelcache
+    _cache_ttl = None
+
+    @classmethod
+    def cached_get(cls, session, id):
+
+        """
+        Get the object with the primary key `id`, like `session.get(cls, id)`, but from
+        the model cache when the model has a `_cache_ttl`.
+        """
+
+        return modelcache.default_cache().get(session, cls, id)
+
+    @classmethod
+    def bulk_insert(cls, session, rows, return_pks=False, batch_size=None):
+
+        """
+        Insert many rows (dicts of column values) at once, bypassing the ORM unit of work.
+
+        Rows are inserted with one executemany per `batch_size` rows (defaults to `_bulk_batch_size`),
+        `session` can be a Session or a Connection, and nothing is committed.
+
+        set `return_pks=True` to get a list with the primary key (tuple) of each row, in order.
+        """
+
+        return cls._bulk_execute(session, insert(cls.__table__), rows, return_pks, batch_size)
+
+    @classmethod
+    def bulk_upsert(cls, session, rows, index_elements=None, update_columns=None, return_pks=False, batch_size=None):
+
+        """
+        Insert many rows, updating the existing row when `index_elements` conflict.
+
+        `index_elements` defaults to the primary key columns, `update_columns` to all other
+        columns given in the rows. This uses `INSERT ... ON CONFLICT` on PostgreSQL and sqlite,
+        other dialects raise a ValueError.
+
+        Without `update_columns` (i.e. all columns are index elements) conflicting rows are
+        skipped with `ON CONFLICT DO NOTHING`, which returns no key for them, so `return_pks`
+        can not be used then and raises a ValueError.
+
+        Otherwise the same as `bulk_insert`.
+        """
+
+        rows = list(rows)
+        if not rows:
+            return [] if return_pks else None
+
+        table = cls.__table__
+        if index_elements is None:
+            index_elements = [c.name for c in table.primary_key.columns]
+        if update_columns is None:
+            update_columns = [k for k in rows[0] if k not in index_elements]
+
+        dialect = _session_dialect(session)
+        if dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        elif dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            raise ValueError('bulk_upsert is not supported for dialect %s' % dialect.name)
+
+        stmt = dialect_insert(table)
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(index_elements=index_elements,
+                                              set_={c: stmt.excluded[c] for c in update_columns})
+        else:
+            if return_pks:
+                # the keys would not line up with the rows
+                raise ValueError('return_pks needs update_columns, skipped rows return no key')
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+
+        return cls._bulk_execute(session, stmt, rows, return_pks, batch_size)
+
+    @classmethod
+    def _bulk_execute(cls, session, stmt, rows, return_pks, batch_size):
+
+        batch_size = batch_size or cls._bulk_batch_size
+        pk_columns = list(cls.__table__.primary_key.columns)
+        dialect = _session_dialect(session)
+
+        # RETURNING with executemany needs SQLAlchemy 2 and a supporting dialect
+        executemany_returning = return_pks and \
+            getattr(dialect, 'insert_executemany_returning_sort_by_parameter_order', False)
+        if executemany_returning:
+            stmt = stmt.returning(*pk_columns, sort_by_parameter_order=True)
+
+        pks = []
+        for batch in _chunks(rows, batch_size):
+            if not return_pks:
+                session.execute(stmt, batch)
+            elif executemany_returning:
+                pks.extend(tuple(r) for r in session.execute(stmt, batch))
+            else:
+                # one row at a time to get the generated keys
+                for row in batch:
+                    pks.append(tuple(session.execute(stmt, row).inserted_primary_key))
+
+        if return_pks:
+            return pks
+
+
+def _session_dialect(session):
+    if hasattr(session, 'dialect'):
+        return session.dialect # a connection
+    return session.get_bind().dialect
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _visible_fields(model, allowed_fields, path):
+    """
+    The fields of a BaseModel class `_to_json` can render at path:
+    hidden fields never, private fields only when they are allowed
+    """
+    fields = { p.key for p in sqlalchemy.orm.class_mapper(model).iterate_properties }
+    fields.update(model._json_fields_public)
+    fields.difference_update(f for f in model._json_fields_private if path + f not in allowed_fields)
+    fields.difference_update(model._json_fields_hidden)
+    return fields
+
+
+def _check_field(model, parts, allowed_fields):
+    """
+    Check every segment of a dotted field against the visible fields of the
+    model it belongs to, following relationships from model
+    """
+    path = ''
+    for part in parts:
+        if model is None:
+            raise ValueError('Field not allowed: %s' % '.'.join(parts))
+        name = part.lstrip('^!')
+        if name in model._json_fields_hidden or \
+           (name not in _visible_fields(model, allowed_fields, path) and path + name not in allowed_fields):
+            raise ValueError('Field not allowed: %s' % (path + name))
+        prop = sqlalchemy.orm.class_mapper(model).attrs.get(name)
+        if isinstance(prop, sqlalchemy.orm.RelationshipProperty) and issubclass(prop.mapper.class_, BaseModel):
+            model = prop.mapper.class_
+        else:
+            model = None
+        path += name + '.'
+
+
+def parse_fields(spec, allowed_fields=None, model=None):
+    """
+    Parse a sparse fieldset, i.e. the `?fields=id,name,users.^id` query argument,
+    into `extra_fields` for `_to_json`.
+
+    Top-level names select the only fields to include, `!name` excludes a field,
+    and dotted names select/include fields of related objects, with the same
+    grammar as `extra_fields`.
+
+    Only restricting the output is always allowed, any field that adds to it
+    (i.e. `users`, or `users.team`) must be in `allowed_fields`, otherwise
+    a ValueError is raised.
+
+    With a `model` (a BaseModel class), every segment must also be a field
+    the model (or the related model) renders, so hidden and private fields
+    cannot be named, i.e. `users.^password`.
+    """
+
+    allowed_fields = set(allowed_fields or ())
+    extra_fields = []
+
+    def add(f):
+        if f not in extra_fields:
+            extra_fields.append(f)
+
+    for f in spec.split(','):
+        f = f.strip()
+        if not f:
+            continue
+
+        parts = f.split('.')
+        if not all(p.lstrip('^!') for p in parts):
+            raise ValueError('Invalid field %s' % f)
+        if model is not None:
+            _check_field(model, parts, allowed_fields)
+
+        if f.startswith('!'):
+            if len(parts) > 1:
+                raise ValueError('Invalid field %s' % f)
+            add(f)
+            continue
+
+        top = parts[0].lstrip('^')
+        add('^' + top)
+        if top in allowed_fields:
+            add(top)
+
+        if len(parts) > 1:
+            for i in range(1, len(parts)):
+                if parts[i][0] in '^!':
+                    continue
+                path = '.'.join(p.lstrip('^') for p in parts[:i + 1])
+                if path not in allowed_fields:
+                    raise ValueError('Field not allowed: %s' % path)
+            add('.'.join([top] + parts[1:]))
+
+    return extra_fields
+
+
+def project_query(query, extra_fields):
+    """
+    Only load the columns selected by top-level ^ fields,
+    for a query of a single model. Other queries are returned as is.
+    """
+
+    only_fields = {f[1:] for f in extra_fields if f.startswith('^') and '.' not in f}
+    if not only_fields or len(query.column_descriptions) != 1:
+        return query
+
+    entity = query.column_descriptions[0]['entity']
+    if query.column_descriptions[0]['type'] is not entity:
+        # not an entity query, i.e. query(Model.id)
+        return query
+    mapper = sqlalchemy.orm.class_mapper(entity)
+    if set(getattr(entity, '_json_fields_public', ())) & only_fields:
+        # properties may use any column
+        return query
+
+    columns = [getattr(entity, c.key) for c in mapper.column_attrs if c.key in only_fields]
+    if not columns:
+        return query
+    return query.options(sqlalchemy.orm.load_only(*columns))
+
+
 def init_db(engine=None):
     Base.metadata.create_all(bind=engine)
 
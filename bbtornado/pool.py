@@ -0,0 +1,199 @@
+"""
+Connection pool settings and telemetry for `Application.engine`
+
+Pool settings are read from the `pool` section of the db config:
+
+db:
+  uri: postgresql://...
+  pool:
+    size: 10           # connections kept open
+    overflow: 20       # extra connections allowed under load
+    timeout: 10        # seconds to wait for a connection before failing
+    recycle: 1800      # seconds before a connection is replaced
+    pre_ping: true     # test connections on checkout
+    lifo: true         # reuse the most recent connection, lets idle ones time out
+    slow_checkout: 0.5 # log a warning when waiting longer than this for a connection
+
+The defaults below are only used for databases that use a QueuePool
+(i.e. not in-memory sqlite), and when no `poolclass` is passed to create_engine
+(i.e. `create_engine_settings=dict(poolclass=NullPool)`).
+
+The statistics are part of /stats (see bbtornado.health), or served by
+PoolStatsHandler at the `pool_stats_url` app setting:
+
+tornado:
+  app_settings:
+    pool_stats_url: /internal/db_pool
+"""
+
+import logging
+import threading
+import time
+
+import tornado.web
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+from bbtornado import metrics
+
+log = logging.getLogger('bbtornado.pool')
+
+# config name -> create_engine argument
+POOL_SETTINGS = dict(size='pool_size',
+                     overflow='max_overflow',
+                     timeout='pool_timeout',
+                     recycle='pool_recycle',
+                     pre_ping='pool_pre_ping',
+                     lifo='pool_use_lifo')
+
+DEFAULT_POOL_SETTINGS = dict(size=10,
+                             overflow=20,
+                             timeout=10,
+                             recycle=1800,
+                             pre_ping=True,
+                             lifo=True)
+
+DEFAULT_SLOW_CHECKOUT = 0.5
+
+
+class PoolStats(object):
+
+    """
+    Collects statistics from the pool events of an engine
+    """
+
+    def __init__(self, slow_checkout=DEFAULT_SLOW_CHECKOUT):
+        self.slow_checkout = slow_checkout
+        self.pool = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_hits = 0
+        self.slow_checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def attach(self, engine):
+        self.pool = engine.pool
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+        metrics.incr('db.pool.checkouts')
+        metrics.gauge('db.pool.checkedout', self.checked_out())
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        metrics.gauge('db.pool.checkedout', self.checked_out())
+
+    def on_wait(self, pool, seconds, overflow=False, timeout=False):
+        with self._lock:
+            self.wait_total += seconds
+            if seconds > self.wait_max: self.wait_max = seconds
+            if overflow: self.overflow_hits += 1
+            if timeout: self.timeouts += 1
+            slow = self.slow_checkout is not None and seconds > self.slow_checkout
+            if slow: self.slow_checkouts += 1
+
+        metrics.timing('db.pool.checkout_wait', seconds)
+        if overflow: metrics.incr('db.pool.overflow_hits')
+        if timeout: metrics.incr('db.pool.timeouts')
+
+        if slow:
+            log.warning('Waited %.3fs for a db connection (%s)', seconds, pool.status())
+
+    def checked_out(self):
+        if self.pool is None or not hasattr(self.pool, 'checkedout'):
+            return None
+        return self.pool.checkedout()
+
+    def as_dict(self):
+        with self._lock:
+            rval = dict(checkouts=self.checkouts,
+                        overflow_hits=self.overflow_hits,
+                        slow_checkouts=self.slow_checkouts,
+                        timeouts=self.timeouts,
+                        wait_total=self.wait_total,
+                        wait_max=self.wait_max,
+                        checked_out=self.checked_out())
+        if isinstance(self.pool, QueuePool):
+            rval.update(size=self.pool.size(),
+                        overflow=self.pool.overflow(),
+                        checked_in=self.pool.checkedin())
+        return rval
+
+
+class InstrumentedQueuePool(QueuePool):
+
+    """
+    A QueuePool that reports how long each checkout waited for a connection.
+    Use `instrumented_pool_class` to bind it to a PoolStats.
+    """
+
+    stats = None
+
+    def _do_get(self):
+        start = time.time()
+        overflow = self.overflow()
+        try:
+            rval = super(InstrumentedQueuePool, self)._do_get()
+        except TimeoutError:
+            if self.stats is not None:
+                self.stats.on_wait(self, time.time() - start, timeout=True)
+            raise
+        if self.stats is not None:
+            self.stats.on_wait(self, time.time() - start,
+                               overflow=self.overflow() > max(overflow, 0))
+        return rval
+
+
+def instrumented_pool_class(stats):
+    # a subclass, as the pool class (not instance) is kept when the pool is recreated
+    return type('InstrumentedQueuePool', (InstrumentedQueuePool,), dict(stats=stats))
+
+
+def pool_settings(db_uri, pool_config=None, pool_class=None):
+    """
+    Returns (create_engine settings, PoolStats) for the given db uri and pool config.
+    With the `poolclass` given to create_engine as pool_class, only the configured
+    settings are returned, without defaults or the instrumented pool class.
+    """
+    pool_config = dict(pool_config or {})
+    stats = PoolStats(pool_config.pop('slow_checkout', DEFAULT_SLOW_CHECKOUT))
+
+    settings = {}
+    if pool_class is None:
+        url = make_url(db_uri)
+        default_class = url.get_dialect().get_pool_class(url)
+    else:
+        default_class = None
+    if default_class is not None and issubclass(default_class, QueuePool):
+        config = dict(DEFAULT_POOL_SETTINGS)
+        config.update(pool_config)
+        settings['poolclass'] = instrumented_pool_class(stats)
+    else:
+        # i.e. in-memory sqlite or a custom pool class, only pass on what was explicitly configured
+        config = pool_config
+
+    for key, value in config.items():
+        if key not in POOL_SETTINGS:
+            raise ValueError('Unknown db.pool setting %r, expected one of %s' %
+                             (key, ', '.join(sorted(list(POOL_SETTINGS) + ['slow_checkout']))))
+        settings[POOL_SETTINGS[key]] = value
+
+    return settings, stats
+
+
+class PoolStatsHandler(tornado.web.RequestHandler):
+
+    """
+    Returns the connection pool statistics of the application as json.
+    Does not touch the database itself.
+    """
+
+    def get(self):
+        self.write(self.application.pool_stats.as_dict())
@@ -0,0 +1,207 @@
+"""
+Rate limiting and load shedding for BaseHandler.
+
+Rate limits are token buckets, keyed by the current user, the client IP or the route:
+
+class ApiHandler(BaseHandler):
+    rate_limits = [RateLimit(rate=10, burst=20, key='user')]
+
+or for all handlers through the app settings:
+
+Application(handlers, rate_limits=[dict(rate=100, burst=200, key='ip')])
+
+Buckets are kept in a per-process MemoryStore by default, implement `RateLimitStore.take`
+to share them between processes (i.e. in redis).
+A request over the limit gets a 429 with a Retry-After header.
+
+Load shedding rejects requests with a 503 and a Retry-After header when the process is
+overloaded, configured with app settings:
+
+Application(handlers, load_shedding=dict(max_in_flight=200, max_queue_depth=50, max_lag=0.5))
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from bbtornado import metrics
+from bbtornado.handlers import JsonError
+from bbtornado.lag import LagMonitor
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.time() if now is None else now
+
+    def take(self, cost=1, now=None):
+        """
+        Take cost tokens from the bucket.
+        Returns 0 if allowed, otherwise the seconds until enough tokens are available.
+        """
+        if now is None:
+            now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimitStore(object):
+
+    """
+    Interface for storing token buckets.
+
+    `take` may also return a Future, so a shared store can be asynchronous.
+    """
+
+    def take(self, key, rate, burst, cost=1):
+        """Returns 0 if allowed, otherwise the seconds to wait before retrying"""
+        raise NotImplementedError()
+
+
+class MemoryStore(RateLimitStore):
+
+    """In-process store, keeps at most max_keys buckets, dropping the least recently used"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return bucket.take(cost)
+
+
+_default_store = MemoryStore()
+
+
+class RateLimit(object):
+
+    """
+    A token bucket rate limit of `rate` requests per second, allowing bursts of `burst` requests.
+
+    `key` is one of 'user' (falls back to the IP for anonymous requests), 'ip', 'route'
+    or a function taking the handler and returning a key.
+
+    Without a `name` the buckets are per handler class, handlers only share buckets
+    through limits with the same name (the app settings limits are named `app:...`).
+    """
+
+    def __init__(self, rate, burst=None, key='ip', store=None, name=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.key = key
+        self.store = store or _default_store
+        self.name = name
+        self.limit = '%s:%s/%s' % (key if isinstance(key, str) else key.__name__, rate, self.burst)
+
+    def key_for(self, handler):
+        if callable(self.key):
+            return self.key(handler)
+        if self.key == 'user':
+            user = handler.current_user
+            if user is not None:
+                return 'user:%s' % getattr(user, 'id', user)
+            return 'ip:%s' % handler.request.remote_ip
+        if self.key == 'ip':
+            return 'ip:%s' % handler.request.remote_ip
+        if self.key == 'route':
+            return 'route:%s.%s' % (handler.__class__.__module__, handler.__class__.__name__)
+        raise ValueError('Unknown rate limit key %s' % self.key)
+
+    def take(self, handler):
+        name = self.name
+        if name is None:
+            name = '%s.%s:%s' % (handler.__class__.__module__, handler.__class__.__name__, self.limit)
+        return self.store.take('%s|%s' % (name, self.key_for(handler)), self.rate, self.burst)
+
+
+def executor_queue_depth(executor):
+    """Number of tasks waiting for a thread in a ThreadPoolExecutor"""
+    queue = getattr(executor, '_work_queue', None)
+    return queue.qsize() if queue is not None else 0
+
+
+class LoadShedder(object):
+
+    """
+    Rejects requests when there are more than `max_in_flight` requests being handled,
+    more than `max_queue_depth` tasks waiting for the handler executor, or the IOLoop
+    lag is above `max_lag` seconds. Any limit can be None.
+
+    The requests in flight are counted by the shedder, BaseHandler calls `started`
+    and `finished` for every request.
+    """
+
+    def __init__(self, max_in_flight=None, max_queue_depth=None, max_lag=None, retry_after=1,
+                 lag_monitor=None):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.max_lag = max_lag
+        self.retry_after = retry_after
+        self.lag_monitor = lag_monitor
+        if max_lag is not None and lag_monitor is None:
+            self.lag_monitor = LagMonitor()
+        self.in_flight = 0
+
+    def started(self):
+        self.in_flight += 1
+
+    def finished(self):
+        self.in_flight -= 1
+
+    def overload_reason(self, handler):
+        """Returns why the process is overloaded, or None"""
+        if self.max_in_flight is not None:
+            # the current request is included
+            if self.in_flight > self.max_in_flight:
+                return 'in_flight'
+        if self.max_queue_depth is not None:
+            if executor_queue_depth(handler.executor) > self.max_queue_depth:
+                return 'queue_depth'
+        if self.max_lag is not None:
+            # the monitor starts with the first request, as the IOLoop must be running
+            self.lag_monitor.start()
+            if self.lag_monitor.lag > self.max_lag:
+                return 'lag'
+        return None
+
+    def check(self, handler):
+        reason = self.overload_reason(handler)
+        if reason is not None:
+            metrics.incr('loadshed.rejected')
+            metrics.incr('loadshed.rejected.%s' % reason)
+            raise JsonError(503, 'Service overloaded', headers={'Retry-After': str(self.retry_after)})
+
+
+def from_settings(settings):
+    """Create the rate limits and load shedder from app settings"""
+    rate_limits = []
+    for r in settings.get('rate_limits') or []:
+        if not isinstance(r, RateLimit):
+            r = RateLimit(**r)
+        if r.name is None:
+            # shared by all handlers
+            r.name = 'app:%s' % r.limit
+        rate_limits.append(r)
+
+    load_shedder = settings.get('load_shedding')
+    if isinstance(load_shedder, Mapping):
+        load_shedder = LoadShedder(**load_shedder)
+
+    return rate_limits, load_shedder
@@ -0,0 +1,148 @@
+"""
+An indexed router, for applications with many routes.
+
+Tornado tries the url patterns one by one, in order. IndexedRouter only tries the
+patterns that can match the path: static routes are found in a dict, routes with
+a literal prefix (i.e. r'/api/users/(\\d+)') in a trie of path segments, only
+patterns without a literal prefix are always tried. Candidates are tried in the
+original order, so the first matching route still wins.
+
+Enable it with the `indexed_routing` app setting.
+"""
+
+import re
+
+from tornado.routing import PathMatches
+from tornado.web import _ApplicationRouter
+
+_SPECIAL = '.^$*+?{}[]|()'
+
+
+def literal_prefix(matcher):
+    """
+    Returns (prefix, is_static) for a rule matcher, the literal text every matching
+    path starts with, and whether the pattern is only that literal.
+    """
+    if not isinstance(matcher, PathMatches) or matcher.regex.flags & re.IGNORECASE:
+        return '', False
+
+    pattern = matcher.regex.pattern
+    if '|' in pattern:
+        # alternatives may not share the prefix
+        return '', False
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+                prefix.append(pattern[i + 1])
+                i += 2
+                continue
+            break
+        if c in _SPECIAL:
+            if c in '*?{' and prefix:
+                # the quantified character is optional
+                prefix.pop()
+            break
+        prefix.append(c)
+        i += 1
+
+    return ''.join(prefix), pattern[i:] == '$'
+
+
+class _Node(object):
+
+    """
+    A node of the segment trie, with the rules of prefixes ending in a partial
+    segment after the segments of the node, i.e. 'resource' for '/api/resource'
+    """
+
+    __slots__ = ('partials', 'lengths', 'children')
+
+    def __init__(self):
+        self.partials = {}  # partial segment -> rule indexes
+        self.lengths = []
+        self.children = {}
+
+    def add(self, partial, index):
+        self.partials.setdefault(partial, []).append(index)
+        if len(partial) not in self.lengths:
+            self.lengths.append(len(partial))
+
+
+class IndexedRouter(_ApplicationRouter):
+
+    def __init__(self, application, rules=None):
+        self._index = None
+        super(IndexedRouter, self).__init__(application, rules)
+
+    def add_rules(self, rules):
+        super(IndexedRouter, self).add_rules(rules)
+        self._index = None
+
+    def _build_index(self):
+        static = {}
+        trie = _Node()
+        always = []
+        for i, rule in enumerate(self.rules):
+            prefix, is_static = literal_prefix(rule.matcher)
+            if is_static:
+                static.setdefault(prefix, []).append(i)
+            elif prefix:
+                node = trie
+                segments = prefix.split('/')
+                for segment in segments[:-1]:
+                    node = node.children.setdefault(segment, _Node())
+                node.add(segments[-1], i)
+            else:
+                always.append(i)
+        # rebuilt when rules are added, or inserted directly like Application.add_handlers does
+        self._index = (len(self.rules), static, trie, always)
+
+    def candidates(self, path):
+        """Indexes of the rules that may match path, in order"""
+        if self._index is None or self._index[0] != len(self.rules):
+            self._build_index()
+        _, static, node, always = self._index
+
+        rval = list(always)
+        rval.extend(static.get(path, ()))
+        for segment in path.split('/'):
+            for length in node.lengths:
+                rval.extend(node.partials.get(segment[:length], ()))
+            node = node.children.get(segment)
+            if node is None:
+                break
+        if len(rval) > 1:
+            rval.sort()
+        return rval
+
+    def find_handler(self, request, **kwargs):
+        rules = self.rules
+        for i in self.candidates(request.path):
+            rule = rules[i]
+            target_params = rule.matcher.match(request)
+            if target_params is not None:
+                if rule.target_kwargs:
+                    target_params['target_kwargs'] = rule.target_kwargs
+
+                delegate = self.get_target_delegate(rule.target, request, **target_params)
+
+                if delegate is not None:
+                    return delegate
+
+        return None
+
+
+def use_indexed_router(application):
+    """Replace the router of a tornado Application with an IndexedRouter, keeping its rules"""
+    router = IndexedRouter(application, application.wildcard_router.rules)
+    for rule in application.default_router.rules:
+        if rule.target is application.wildcard_router:
+            rule.target = router
+    application.wildcard_router = router
+    return router
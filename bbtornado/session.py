@@ -0,0 +1,138 @@
+"""
+Per-request database access for BaseHandler.
+
+The ORM session (`handler.db`, from the plain `application.sessionmaker`) and a Core
+connection (`handler.conn`) are created when they are first used, so requests that do
+not touch the database (or only cached objects) do not check out a connection. Both
+are closed by `close()`, which the handler calls when the request finishes; closing
+twice is a no-op.
+
+The session is also the one of the scoped `application.Session` for the request, so
+code calling `application.Session()` during a request shares its transaction. A
+session created by `application.Session()` before `handler.db` is used is taken over
+by the handler. `close()` removes it from the registry again.
+
+Handlers with `read_only_db = True` run their statements in autocommit mode, without
+BEGIN/COMMIT round trips, and flushing their session raises an exception.
+
+Core-only handlers can use `self.conn` and skip the ORM session entirely.
+
+The `db.sessions.created` and `db.connections.created` counters can be compared
+to `requests.served`.
+"""
+
+import logging
+
+from sqlalchemy import event
+
+from bbtornado import metrics
+
+log = logging.getLogger('bbtornado.session')
+
+AUTOCOMMIT = dict(isolation_level='AUTOCOMMIT')
+
+
+class ReadOnlySessionError(Exception):
+    pass
+
+
+def _prevent_flush(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        raise ReadOnlySessionError('Session of a read only handler can not be flushed')
+
+
+def _sessionmaker(application):
+    """The plain sessionmaker of the application, not its scoped Session"""
+    maker = getattr(application, 'sessionmaker', None)
+    if maker is None:
+        maker = application.Session.session_factory
+    return maker
+
+
+def _autocommit_engine(application):
+    engine = getattr(application, 'autocommit_engine', None)
+    if engine is None:
+        engine = application.autocommit_engine = application.engine.execution_options(**AUTOCOMMIT)
+    return engine
+
+
+class RequestSession(object):
+
+    __slots__ = ('application', 'read_only', 'request', '_session', '_conn')
+
+    def __init__(self, application, read_only=False, request=None):
+        self.application = application
+        self.read_only = read_only
+        # the scope of application.Session, see _scoped_registry
+        self.request = request
+        self._session = None
+        self._conn = None
+
+    @property
+    def active(self):
+        return self._session is not None or self._conn is not None
+
+    def _scoped_registry(self):
+        """The registry of application.Session, if it is scoped by request"""
+        registry = getattr(getattr(self.application, 'Session', None), 'registry', None)
+        if self.request is None or getattr(registry, 'scopefunc', None) is None:
+            return None
+        return registry
+
+    @property
+    def session(self):
+        if self._session is None:
+            registry = self._scoped_registry()
+            if registry is not None and registry.scopefunc() is not self.request:
+                # used outside of its request, i.e. from a callback
+                registry = None
+
+            if registry is not None and registry.has():
+                # application.Session() was called earlier in this request
+                session = registry()
+                if self.read_only:
+                    event.listen(session, 'before_flush', _prevent_flush)
+            elif self.read_only:
+                # the connection is checked out in autocommit mode when the session first uses it
+                session = _sessionmaker(self.application)(bind=_autocommit_engine(self.application))
+                event.listen(session, 'before_flush', _prevent_flush)
+            else:
+                session = _sessionmaker(self.application)()
+            if registry is not None and not registry.has():
+                registry.set(session)
+            metrics.incr('db.sessions.created')
+            self._session = session
+        return self._session
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = self.application.engine.connect()
+            metrics.incr('db.connections.created')
+            if self.read_only:
+                conn = conn.execution_options(**AUTOCOMMIT)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        """Release the session and connection, if they were used"""
+        if self._session is not None:
+            session, self._session = self._session, None
+            if self.read_only and event.contains(session, 'before_flush', _prevent_flush):
+                event.remove(session, 'before_flush', _prevent_flush)
+            registry = self._scoped_registry()
+            try:
+                if registry is not None and registry.scopefunc() is self.request:
+                    self.application.Session.remove()
+                else:
+                    if registry is not None:
+                        registry.registry.pop(self.request, None)
+                    session.close()
+            except Exception:
+                log.exception('Error closing session')
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            try:
+                conn.close()
+            except Exception:
+                log.exception('Error closing connection')
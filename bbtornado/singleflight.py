@@ -0,0 +1,155 @@
+"""
+Request coalescing, or single-flight: while a call for a key is in flight, identical
+calls wait for its result instead of doing the same work again.
+
+For coroutines, i.e. calls to upstream services:
+
+class Upstream(HTTP):
+    @single_flight()
+    @coroutine
+    def team(self, team_id):
+        ...
+
+For GET methods of a BaseHandler, identical concurrent requests (same route, path
+and query arguments, optionally the same user) get the response of the first one:
+
+class TeamsHandler(BaseHandler):
+    @coalesce()
+    def get(self):
+        ...
+
+Results are shared, callers must not modify them.
+"""
+
+from functools import wraps
+
+from tornado.concurrent import Future
+from tornado.gen import coroutine, convert_yielded
+
+from bbtornado import metrics
+
+
+class SingleFlight(object):
+
+    """A group of in-flight calls, keyed by a hashable key"""
+
+    def __init__(self, name='singleflight'):
+        self.name = name
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call the coroutine fn(*args, **kwargs), unless a call for key is in flight,
+        returns a Future with the (shared) result.
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            metrics.incr('%s.shared' % self.name)
+            return future
+
+        metrics.incr('%s.calls' % self.name)
+        future = convert_yielded(fn(*args, **kwargs))
+        if future.done():
+            return future
+        self._calls[key] = future
+        future.add_done_callback(lambda f: self.forget(key, f))
+        return future
+
+    def forget(self, key, future=None):
+        """Stop sharing the call for key, the next call starts a new one"""
+        if future is None or self._calls.get(key) is future:
+            self._calls.pop(key, None)
+
+
+def _default_key(args, kwargs):
+    return args + tuple(sorted(kwargs.items()))
+
+
+def single_flight(key=None, group=None):
+    """
+    Decorate a coroutine so concurrent calls with the same arguments are made once.
+
+    `key(*args, **kwargs)` returns the key of a call, by default all the (hashable) arguments,
+    including self for methods.
+    """
+    def decorator(fn):
+        flights = group if group is not None else SingleFlight()
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            k = key(*args, **kwargs) if key is not None else _default_key(args, kwargs)
+            return flights.do(k, fn, *args, **kwargs)
+        wrapper.flights = flights
+        return wrapper
+    return decorator
+
+
+# headers of the leader response not written to followers
+_UNSHARED_HEADERS = ('Date', 'Content-Length', 'Set-Cookie', 'Server')
+
+_handler_flights = SingleFlight('singleflight.requests')
+
+
+def coalesce(user_scope=False, group=None):
+    """
+    Decorate GET methods of a BaseHandler, so identical concurrent requests are handled once.
+
+    Requests are identical if they have the same handler, path, query arguments and format,
+    and the same user with `user_scope`, use it when the response depends on the user.
+    Streamed responses are not shared, waiting requests are then handled themselves.
+    """
+    flights = group if group is not None else _handler_flights
+
+    def decorator(method):
+        @wraps(method)
+        @coroutine
+        def wrapper(self, *args, **kwargs):
+            key = (self.__class__, self.request.path,
+                   tuple((k, tuple(v)) for k, v in sorted(self.request.query_arguments.items())),
+                   self.response_format)
+            if user_scope:
+                user = self.current_user
+                key += (getattr(user, 'id', user),)
+
+            leader = flights._calls.get(key)
+            if leader is not None:
+                metrics.incr('%s.shared' % flights.name)
+                response = yield leader
+                if response is not None:
+                    status_code, headers, body = response
+                    self.set_status(status_code)
+                    for name, value in headers:
+                        self.set_header(name, value)
+                    self.finish(body)
+                    return
+
+            response = Future()
+
+            def on_response(status_code, headers, body):
+                flights.forget(key, response)
+                if response.done():
+                    return
+                if body is None:
+                    response.set_result(None)
+                else:
+                    response.set_result((status_code,
+                                         [(k, v) for k, v in headers.get_all() if k not in _UNSHARED_HEADERS],
+                                         body))
+
+            metrics.incr('%s.calls' % flights.name)
+            flights._calls[key] = response
+            self.add_response_listener(on_response)
+            try:
+                yield convert_yielded(method(self, *args, **kwargs))
+            except Exception:
+                # the error response is written after we return, let the waiting requests retry
+                on_response(None, None, None)
+                raise
+            finally:
+                if self._finished and not response.done():
+                    on_response(None, None, None)
+        return wrapper
+    return decorator
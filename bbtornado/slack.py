@@ -1,11 +1,3 @@
-import logging
-import json
-import urllib
-import six
-
-from tornado.ioloop import IOLoop
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest
-
 """
 
 Utilities for logging to slack.
@@ -21,6 +13,16 @@ Messages are either filtered by level, or you can force logging to slack by pass
 
 """
 
+import asyncio
+import logging
+import json
+import urllib.request
+import six
+
+from tornado.ioloop import IOLoop
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+
 def post_message(msg, endpoint, channel, username='BBTornado', unfurl_links=False, icon=":robot_face:"):
 
     """
@@ -30,16 +32,39 @@ def post_message(msg, endpoint, channel, username='BBTornado', unfurl_links=Fals
 
     client = AsyncHTTPClient()
 
-    body = dict(icon_emoji=icon,
-                text=msg,
-                username=username,
-                unfurl_links=unfurl_links,
-                channel=channel)
+    body = _message_body(msg, channel, username, unfurl_links, icon)
 
-    req = HTTPRequest(endpoint, method='POST', headers={ 'Content-Type': 'application/json' }, body=json.dumps(body))
+    req = HTTPRequest(endpoint, method='POST', headers={ 'Content-Type': 'application/json' }, body=body)
 
     IOLoop.current().spawn_callback(client.fetch, req, raise_error=False)
 
+def post_message_blocking(msg, endpoint, channel, username='BBTornado', unfurl_links=False, icon=":robot_face:", timeout=10):
+
+    """
+    Post a message on slack, waiting for the response.
+    For threads without an IOLoop, i.e. the listener thread of bbtornado.logs.
+    """
+
+    body = _message_body(msg, channel, username, unfurl_links, icon)
+
+    req = urllib.request.Request(endpoint, method='POST', headers={ 'Content-Type': 'application/json' }, data=body.encode('utf-8'))
+
+    urllib.request.urlopen(req, timeout=timeout).close()
+
+def _message_body(msg, channel, username, unfurl_links, icon):
+    return json.dumps(dict(icon_emoji=icon,
+                           text=msg,
+                           username=username,
+                           unfurl_links=unfurl_links,
+                           channel=channel))
+
+def _on_io_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
 class SlackFilter(object):
 
     def __init__(self, level):
@@ -52,12 +77,19 @@ class SlackFilter(object):
 
 
 class SlackHandler(logging.Handler):
-    """A logging handler that sends error messages to slack"""
-    def __init__(self, slack_endpoint_url, channel, username="BBTornado", level=logging.ERROR):
+    """
+    A logging handler that sends error messages to slack
+
+    Messages logged on an IOLoop thread are posted from that IOLoop. Messages
+    logged on other threads are posted from the `io_loop` given (with add_callback,
+    which is thread-safe), or without one, right away from the logging thread.
+    """
+    def __init__(self, slack_endpoint_url, channel, username="BBTornado", level=logging.ERROR, io_loop=None):
         logging.Handler.__init__(self)
         self.slack_endpoint = slack_endpoint_url
         self.channel = channel
         self.username = username
+        self.io_loop = io_loop
         self.addFilter(SlackFilter(level))
 
     def emit(self, record):
@@ -79,13 +111,23 @@ class SlackHandler(logging.Handler):
         if hasattr(record, 'slack') and isinstance(record.slack, six.string_types) and record.slack[0] in ('#', '@'):
             channel = record.slack
 
-        post_message(msg=text,
-            endpoint=self.slack_endpoint,
-            unfurl_links=False,
-            username=self.username,
-            channel=channel,
-            icon=icon
-        )
+        message = dict(msg=text,
+                       endpoint=self.slack_endpoint,
+                       unfurl_links=False,
+                       username=self.username,
+                       channel=channel,
+                       icon=icon)
+
+        try:
+            if _on_io_loop():
+                post_message(**message)
+            elif self.io_loop is not None:
+                # add_callback is thread-safe, post_message is not
+                self.io_loop.add_callback(post_message, **message)
+            else:
+                post_message_blocking(**message)
+        except Exception:
+            self.handleError(record)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,343 @@
+"""
+Background tasks, run after the response is sent.
+
+Each Application has a TaskQueue, `app.tasks`, configured with the `tasks` app setting:
+
+tornado:
+  app_settings:
+    tasks:
+      max_size: 1000      # tasks waiting to run, enqueueing more raises QueueFull
+      workers: 4          # tasks running at the same time
+      threads: 4          # run functions on an executor with this many threads, 0 runs them on the IOLoop
+      retries: 3          # attempts after the first one fails
+      backoff: 1          # seconds before the first retry, doubled for each next one
+      durable: false      # also store tasks in the bbtornado_tasks table
+      drain_timeout: 10   # seconds to wait for queued tasks on shutdown
+
+In a BaseHandler, `self.enqueue(send_email, user.email, subject)` queues the task when
+the request is finished. Tasks can be functions or coroutines.
+
+Durable tasks are stored in the db before they run, and removed when done, tasks that
+were not run (i.e. the process was killed) are run when the queue starts again. They must be
+module level functions with json arguments. Their db writes happen on a thread, not the IOLoop.
+Tasks failing all retries are kept with the status `failed`. A task that was running when the
+process died is not run again.
+
+A queue starts its workers and threads with the first enqueue. `main.main` starts durable
+queues with the server, so stored tasks are recovered without waiting for a new task; call
+`app.tasks.start()` on the IOLoop when running the server yourself.
+"""
+
+import importlib
+import inspect
+import json
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, Text, Float, select
+from tornado.concurrent import is_future
+from tornado.gen import coroutine, is_coroutine_function
+from tornado.ioloop import IOLoop
+from tornado.locks import Event
+from tornado.queues import Queue, QueueFull
+from tornado.util import TimeoutError
+
+from bbtornado import metrics
+
+log = logging.getLogger('bbtornado.tasks')
+
+PENDING, RUNNING, FAILED = 'pending', 'running', 'failed'
+
+DEFAULT_THREADS = 4
+
+task_table = Table('bbtornado_tasks', MetaData(),
+                   Column('id', Integer, primary_key=True),
+                   Column('name', String(255), nullable=False),
+                   Column('args', Text, nullable=False),
+                   Column('status', String(16), nullable=False, default=PENDING, index=True),
+                   Column('attempts', Integer, nullable=False, default=0),
+                   Column('created', Float, nullable=False),
+                   Column('error', Text))
+
+
+def init_db(engine):
+    """Create the table for durable tasks"""
+    task_table.create(bind=engine, checkfirst=True)
+
+
+def task_name(fn):
+    return '%s:%s' % (fn.__module__, fn.__qualname__)
+
+
+def resolve_task(name):
+    module, _, qualname = name.partition(':')
+    obj = importlib.import_module(module)
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class Task(object):
+
+    __slots__ = ('fn', 'args', 'kwargs', 'attempts', 'id')
+
+    def __init__(self, fn, args, kwargs, attempts=0, id=None):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.attempts = attempts
+        self.id = id
+
+    def __repr__(self):
+        return '<Task %s %s>' % (task_name(self.fn), self.id or '')
+
+
+class TaskQueue(object):
+
+    def __init__(self, max_size=1000, workers=4, threads=DEFAULT_THREADS, retries=3, backoff=1.0, max_backoff=300,
+                 durable=False, engine=None, drain_timeout=10):
+        self.max_size = max_size
+        self.workers = workers
+        self.threads = threads
+        # created by start, so applications that never enqueue have no threads
+        self.executor = None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.durable = durable
+        self.engine = engine
+        self.db_executor = None
+        self.drain_timeout = drain_timeout
+        self.closed = False
+        self._queue = None
+        self._unfinished = 0
+        self._idle = Event()
+        self._idle.set()
+
+    @property
+    def running(self):
+        return self._queue is not None
+
+    @property
+    def unfinished(self):
+        """Tasks being stored, queued, running or waiting for a retry"""
+        return self._unfinished
+
+    def _task_started(self):
+        self._unfinished += 1
+        self._idle.clear()
+
+    def _task_finished(self):
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._idle.set()
+
+    def start(self):
+        """
+        Start the workers on the current IOLoop, and recover stored tasks of a durable queue.
+        This happens with the first enqueue, or when `main.main` starts the server.
+        """
+        if self.running:
+            return
+        if self.threads and self.executor is None:
+            self.executor = ThreadPoolExecutor(self.threads)
+        if self.durable and self.db_executor is None:
+            # the db writes of durable tasks, off the IOLoop and not waiting for running tasks
+            self.db_executor = ThreadPoolExecutor(1)
+        self._queue = Queue(maxsize=self.max_size)
+        io_loop = IOLoop.current()
+        for _ in range(self.workers):
+            io_loop.spawn_callback(self._worker)
+        if self.durable:
+            # drain waits for the recovered tasks
+            self._task_started()
+            io_loop.spawn_callback(self._recover)
+
+    def enqueue(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) to run in the background.
+        Raises tornado.queues.QueueFull when max_size tasks are waiting.
+
+        Durable tasks are queued once they are stored, the db write happens on `db_executor`.
+        """
+        if self.closed:
+            raise QueueFull('Task queue is closed')
+        self.start()
+        if self._queue.full():
+            metrics.incr('tasks.rejected')
+            raise QueueFull('Task queue is full')
+
+        task = Task(fn, args, kwargs)
+        self._task_started()
+        metrics.incr('tasks.enqueued')
+        if self.durable:
+            IOLoop.current().run_in_executor(self.db_executor, self._store, task).add_done_callback(
+                lambda future: self._stored(task, future))
+        else:
+            self._put(task)
+        return task
+
+    def _stored(self, task, future):
+        try:
+            task.id = future.result()
+        except Exception:
+            log.exception('Could not store %r', task)
+            metrics.incr('tasks.failed')
+            self._task_finished()
+            return
+        self._put(task)
+
+    def _put(self, task):
+        try:
+            self._queue.put_nowait(task)
+        except QueueFull:
+            # a stored task stays pending, and is recovered when a queue starts
+            log.error('Task queue full, dropping %r', task)
+            metrics.incr('tasks.rejected')
+            self._task_finished()
+            return
+        metrics.gauge('tasks.queued', self._queue.qsize())
+
+    def close(self):
+        """Stop accepting new tasks, queued tasks still run"""
+        self.closed = True
+
+    @coroutine
+    def drain(self, timeout=None):
+        """Close the queue and wait for the queued tasks, at most timeout seconds"""
+        self.close()
+        if self._unfinished:
+            timeout = self.drain_timeout if timeout is None else timeout
+            try:
+                yield self._idle.wait(timeout=timedelta(seconds=timeout) if timeout else None)
+            except TimeoutError:
+                log.warning('%d tasks did not finish before the drain timeout', self.unfinished)
+
+    def _run_db(self, fn, *args, **kwargs):
+        """Run a db write of a durable task on the db executor, returns a future"""
+        return IOLoop.current().run_in_executor(self.db_executor, lambda: fn(*args, **kwargs))
+
+    @coroutine
+    def _worker(self):
+        while True:
+            task = yield self._queue.get()
+            metrics.gauge('tasks.queued', self._queue.qsize())
+            retrying = False
+            try:
+                if task.id is None or (yield self._run_db(self._claim, task)):
+                    retrying = yield self._run(task)
+            except Exception:
+                log.exception('Error in task queue')
+            finally:
+                self._queue.task_done()
+                if not retrying:
+                    self._task_finished()
+
+    @coroutine
+    def _run(self, task):
+        """Run the task, returns True if it will be retried"""
+        task.attempts += 1
+        start = time.time()
+        try:
+            if self.executor is not None and not (is_coroutine_function(task.fn) or
+                                                  inspect.iscoroutinefunction(task.fn)):
+                result = yield IOLoop.current().run_in_executor(
+                    self.executor, lambda: task.fn(*task.args, **task.kwargs))
+            else:
+                result = task.fn(*task.args, **task.kwargs)
+            if is_future(result) or hasattr(result, '__await__'):
+                yield result
+        except Exception as e:
+            metrics.timing('tasks.time', time.time() - start)
+            if task.attempts <= self.retries:
+                delay = min(self.max_backoff, self.backoff * 2 ** (task.attempts - 1))
+                log.warning('Task %r failed (attempt %d), retrying in %.1fs', task, task.attempts, delay, exc_info=True)
+                metrics.incr('tasks.retried')
+                IOLoop.current().call_later(delay, self._retry, task)
+                return True
+            log.exception('Task %r failed after %d attempts', task, task.attempts)
+            metrics.incr('tasks.failed')
+            if task.id is not None:
+                yield self._run_db(self._update, task, status=FAILED, error=repr(e))
+            return False
+
+        metrics.timing('tasks.time', time.time() - start)
+        metrics.incr('tasks.succeeded')
+        if task.id is not None:
+            yield self._run_db(self._delete, task)
+        return False
+
+    @coroutine
+    def _retry(self, task):
+        # the task stays unfinished until the retry is queued, so drain waits for it
+        try:
+            if task.id is not None:
+                yield self._run_db(self._update, task, status=PENDING)
+        except Exception:
+            log.exception('Could not update %r', task)
+        self._put(task)
+
+    # durable tasks, these run on the db executor
+
+    def _store(self, task):
+        with self.engine.begin() as conn:
+            result = conn.execute(task_table.insert().values(
+                name=task_name(task.fn), args=json.dumps(dict(args=task.args, kwargs=task.kwargs)),
+                status=PENDING, attempts=0, created=time.time()))
+            return result.inserted_primary_key[0]
+
+    def _claim(self, task):
+        """Mark a stored task as running, False if another process claimed it"""
+        with self.engine.begin() as conn:
+            result = conn.execute(task_table.update()
+                                  .where(task_table.c.id == task.id, task_table.c.status == PENDING)
+                                  .values(status=RUNNING, attempts=task.attempts + 1))
+            return result.rowcount == 1
+
+    def _update(self, task, **values):
+        with self.engine.begin() as conn:
+            conn.execute(task_table.update().where(task_table.c.id == task.id).values(**values))
+
+    def _delete(self, task):
+        with self.engine.begin() as conn:
+            conn.execute(task_table.delete().where(task_table.c.id == task.id))
+
+    def _load_pending(self):
+        with self.engine.connect() as conn:
+            return conn.execute(select(task_table).where(task_table.c.status == PENDING)
+                                .order_by(task_table.c.id).limit(self.max_size)).fetchall()
+
+    @coroutine
+    def _recover(self):
+        """Queue the stored tasks that did not run"""
+        try:
+            rows = yield self._run_db(self._load_pending)
+            for row in rows:
+                try:
+                    fn = resolve_task(row.name)
+                except (ImportError, AttributeError):
+                    log.error('Unknown task %s', row.name)
+                    continue
+                data = json.loads(row.args)
+                self._task_started()
+                self._put(Task(fn, tuple(data['args']), data['kwargs'], row.attempts, row.id))
+            if rows:
+                log.info('Recovered %d stored tasks', len(rows))
+        except Exception:
+            log.exception('Could not recover stored tasks')
+        finally:
+            self._task_finished()
+
+
+_default_queue = None
+
+
+def default_queue():
+    """A queue for handlers of applications without one"""
+    global _default_queue
+    if _default_queue is None:
+        _default_queue = TaskQueue()
+    return _default_queue
@@ -9,6 +9,9 @@ from tornado.gen import coroutine
 
 from sqlalchemy import func
 
+from bbtornado import formats
+from bbtornado.singleflight import single_flight
+
 def now():
     """A datetime of now with timezone"""
     return datetime.now(dateutil.tz.tzutc())
@@ -33,21 +36,40 @@ class HTTP(object):
     """
     a more user-friendly (i.e. requests like :) )
     wrapper for using tornado async http-client with json endpoints
+
+    with coalesce=True, concurrent GETs of the same url share one upstream request
+
+    with binary=True, bodies are sent and requested as MessagePack, if the
+    msgpack package is installed, responses are decoded by their Content-Type
     """
 
-    def __init__(self, client=None, base=None, cookie=None):
+    def __init__(self, client=None, base=None, cookie=None, coalesce=False, binary=False):
         self.base = base or ''
         self.client = client or AsyncHTTPClient()
         self.cookie = cookie
+        self.coalesce = coalesce
+        self.binary = binary and formats.msgpack is not None
+
+    def _encode(self, body):
+        if self.binary:
+            return formats.packb(body), { 'Content-type': formats.MSGPACK }
+        return json.dumps(body), _json
+
+    def _decode(self, r):
+        if formats.is_msgpack(r.headers.get('Content-Type')):
+            return formats.unpackb(r.body)
+        return json.loads(r.body)
 
     @coroutine
     def _fetch(self, *args, headers=None, **kwargs):
 
-        if not headers: headers = {}
+        # a copy, callers pass shared default dicts
+        headers = dict(headers or {})
 
         # this could re-use httpheaders util from tornado,
         # that would give correct case insensitivity
         if 'Cookie' not in headers and self.cookie: headers['Cookie'] = self.cookie
+        if 'Accept' not in headers and self.binary: headers['Accept'] = formats.MSGPACK
 
         r = yield self.client.fetch(*args, headers=headers, **kwargs)
 
@@ -62,27 +84,39 @@ class HTTP(object):
     @coroutine
     def post(self, url, body=None, headers=None, raise_error=True):
 
-        r = yield self._fetch(self.base+url, body=json.dumps(body) if body is not None else None,
+        body, content_type = self._encode(body) if body is not None else (None, {})
+        r = yield self._fetch(self.base+url, body=body,
                               allow_nonstandard_methods=True,
-                              method='POST', headers=dict(**_json if body is not None else {}, **headers or {}), raise_error=raise_error)
+                              method='POST', headers=dict(**content_type, **headers or {}), raise_error=raise_error)
 
-        return json.loads(r.body)
+        return self._decode(r)
 
 
     @coroutine
     def put(self, url, body, headers={}, raise_error=True):
 
-        r = yield self._fetch(self.base+url, body=json.dumps(body),
-                              method='PUT', headers=dict(**_json, **headers), raise_error=raise_error)
+        body, content_type = self._encode(body)
+        r = yield self._fetch(self.base+url, body=body,
+                              method='PUT', headers=dict(**content_type, **headers), raise_error=raise_error)
 
-        return json.loads(r.body)
+        return self._decode(r)
+
+    @single_flight()
+    @coroutine
+    def _coalesced_get(self, url, headers, raise_error):
+        # headers are a sorted tuple of items, to be part of the key
+        r = yield self._fetch(url, method='GET', headers=dict(headers), raise_error=raise_error)
+        return r
 
     @coroutine
     def get(self, url, headers={}, raise_error=True):
 
-        r = yield self._fetch(self.base+url, method='GET', headers=headers, raise_error=raise_error)
+        if self.coalesce:
+            r = yield self._coalesced_get(self.base+url, tuple(sorted(headers.items())), raise_error)
+        else:
+            r = yield self._fetch(self.base+url, method='GET', headers=headers, raise_error=raise_error)
 
-        return json.loads(r.body)
+        return self._decode(r)
 
 
     @coroutine
@@ -90,4 +124,4 @@ class HTTP(object):
 
         r = yield self._fetch(self.base+url, method='DELETE', headers=headers, raise_error=raise_error)
 
-        return json.loads(r.body)
+        return self._decode(r)
@@ -1,14 +1,3 @@
-from tornado.concurrent import is_future
-
-from functools import wraps
-import collections
-import jsonschema
-
-from bbtornado.jsend import JSendMixin
-from bbtornado.handlers import JsonError
-from bbtornado.models import _to_json
-
-
 '''
 Use the validate_json utility function to verify a json object or string
 against a given schema. An exception (jsonschema.ValidationError) is
@@ -57,6 +46,22 @@ Example:
 
 '''
 
+from tornado.concurrent import is_future
+from tornado.gen import coroutine, Return
+
+from functools import wraps
+from itertools import chain
+import collections
+import collections.abc
+import jsonschema
+
+from sqlalchemy.orm.query import Query
+
+from bbtornado.jsend import JSendMixin
+from bbtornado.handlers import JsonError, _payload_items
+from bbtornado.models import _load_for_json, _to_json
+
+
 # based on
 # https://github.com/hfaran/Tornado-JSON/blob/master/tornado_json/schema.py
 
@@ -156,6 +161,30 @@ def validate_json(json_data,
     return json_data
 
 
+def validate_json_items(items,
+                        json_schema=None,
+                        validator_cls=None,
+                        format_checker=jsonschema.FormatChecker(),
+                        on_empty_404=False):
+    """Like validate_json for an iterator of items, i.e. a generator, for a
+    schema of type array. Returns an iterator validating each item against
+    the ``items`` schema as it is consumed, so the output can be streamed.
+    """
+    items = iter(items)
+    if on_empty_404:
+        try:
+            first = next(items)
+        except StopIteration:
+            raise JsonError(404, "Not found.")
+        items = chain([first], items)
+
+    item_schema = (json_schema or {}).get('items')
+    if item_schema is None:
+        return items
+    return (validate_json(item, item_schema, validator_cls=validator_cls, format_checker=format_checker)
+            for item in items)
+
+
 def validate_json_input(input_schema=None,
                         input_example=None,
                         validator_cls=None,
@@ -262,12 +291,24 @@ def validate_json_output(output_schema=None,
             # Call the requesthandler method
             output = rh_method(self, *args, **kwargs)
 
-            def validate_output(output):
-                # in case output is a future, we can be sure it is finished
-                if is_future(output):
-                    output = output.result()
-
-                json_data = validate_json(
+            # iterators and queries are streamed by JSend handlers with stream_output
+            stream = isinstance(self, JSendMixin) and self.stream_output
+
+            def validate(output):
+                if isinstance(output, Query) and output_schema is None:
+                    # nothing to validate, written with the requested fields
+                    return output
+                if isinstance(output, (collections.abc.Iterator, Query)):
+                    if stream:
+                        return validate_json_items(
+                            output,
+                            json_schema=output_schema,
+                            validator_cls=validator_cls,
+                            format_checker=format_checker,
+                            on_empty_404=on_empty_404
+                        )
+                    output = list(output)
+                return validate_json(
                     json_data=output,
                     json_schema=output_schema,
                     json_example=output_example,
@@ -276,23 +317,60 @@ def validate_json_output(output_schema=None,
                     on_empty_404=on_empty_404
                 )
 
+            def write_output(json_data):
                 if json_data and write_json and \
                    not self._finished:
                     if isinstance(self, JSendMixin):
+                        if stream and isinstance(json_data, (collections.abc.Iterator, Query)):
+                            # returns a future
+                            return self.stream_success(json_data)
                         self.success(json_data)
                     else:
                         self.write(json_data)
 
-            # If the rh_method returned a Future a la `raise Return(value)`, we
-            # don't evaluate it immediately
-            if is_future(output):
-                output.add_done_callback(validate_output)
+            def load(output):
+                # queries that are validated (and not streamed) are loaded on the IOLoop thread,
+                # so they can be counted, and the executor never uses the request session
+                if isinstance(output, Query) and output_schema is not None and not stream:
+                    return output.all()
                 return output
+
+            def should_offload(output):
+                # offloading needs the executor of a BaseHandler
+                if not hasattr(self, 'should_offload'):
+                    return False
+                return self.should_offload('validate', _payload_items(output))
+
+            @coroutine
+            def validate_output_async(output, loaded=None):
+                # wait for the rh_method, and then validate large outputs
+                # on the executor to keep the IOLoop responsive
+                if is_future(output):
+                    output = yield output
+                if loaded is None:
+                    loaded = load(output)
+
+                if should_offload(loaded):
+                    _load_for_json(loaded)
+                    json_data = yield self.run_offloaded(validate, loaded)
+                else:
+                    json_data = validate(loaded)
+
+                yield write_output(json_data)
+                raise Return(output)
+
+            # If the rh_method returned a Future a la `raise Return(value)`, or
+            # the output is large, validation happens asynchronously
+            if is_future(output):
+                return validate_output_async(output)
+            loaded = load(output)
+            if should_offload(loaded):
+                return validate_output_async(output, loaded)
             else:
                 # Validate the obtained output, but don't catch
                 # any exceptions, so that errors result in status
                 # code 500
-                validate_output(output)
+                return write_output(validate(loaded))
 
         setattr(_wrapper, "output_schema", output_schema)
         setattr(_wrapper, "output_example", output_example)
@@ -0,0 +1,88 @@
+"""
+A watchdog for code blocking the IOLoop.
+
+The IOLoop lag is measured like the LagMonitor, and a helper thread checks if the
+scheduled callback is late. If it is more than `threshold` seconds late, the IOLoop
+is blocked right now, and the helper thread logs the stack of the IOLoop thread,
+showing what code is blocking it.
+
+Reports are logged as warnings on the `bbtornado.watchdog` logger, at most once per
+`report_interval` seconds. They are marked for slack (`extra=dict(slack=True)`), so a
+SlackHandler posts them at its default ERROR level too. Blocks are counted in the
+`watchdog.blocked` metric.
+
+Enable it from the config, it is started by bbtornado.main.main:
+
+tornado:
+  watchdog:
+    interval: 0.1
+    threshold: 0.5
+    report_interval: 60
+"""
+
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from bbtornado import metrics
+from bbtornado.lag import LagMonitor
+
+log = logging.getLogger('bbtornado.watchdog')
+
+
+class Watchdog(LagMonitor):
+
+    def __init__(self, interval=0.1, threshold=0.5, report_interval=60, io_loop=None):
+        super(Watchdog, self).__init__(interval=interval, io_loop=io_loop)
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.suppressed = 0
+        self._last_report = 0
+        self._thread = None
+        self._thread_id = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start the watchdog, must be called from the IOLoop thread"""
+        if self.running:
+            return
+        super(Watchdog, self).start()
+        self._thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name='bbtornado-watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        super(Watchdog, self).stop()
+        self._stopped.set()
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval / 2.0):
+            deadline = self._deadline
+            if deadline is None or deadline == reported:
+                continue
+            lag = time.time() - deadline
+            if lag > self.threshold:
+                # only once per blocking callback
+                reported = deadline
+                self.on_blocked(lag)
+
+    def on_blocked(self, lag):
+        metrics.incr('watchdog.blocked')
+
+        now = time.time()
+        if now - self._last_report < self.report_interval:
+            self.suppressed += 1
+            metrics.incr('watchdog.suppressed')
+            return
+        self._last_report = now
+
+        frame = sys._current_frames().get(self._thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else '(unknown)'
+        log.warning('IOLoop blocked for more than %.3fs (%d reports suppressed), stack:\n%s',
+                    lag, self.suppressed, stack, extra=dict(slack=True))
+        self.suppressed = 0
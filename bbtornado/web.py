@@ -4,8 +4,18 @@ import tornado.web
 
 from sqlalchemy.orm import scoped_session
 
+import bbtornado.health
+import bbtornado.modelcache
 import bbtornado.models
+import bbtornado.ratelimit
+import bbtornado.tasks
+from bbtornado.frozen import thaw
+from bbtornado.writebehind import WriteBehindBuffer
 from bbtornado.handlers import ThreadRequestContext
+from bbtornado.pool import PoolStatsHandler, pool_settings
+from bbtornado.compression import compression_transform, ResponseCache
+from bbtornado.batch import BatchHandler
+from bbtornado.routing import use_indexed_router
 
 log = logging.getLogger('bbtornado.web')
 
@@ -30,28 +40,79 @@ class Application(tornado.web.Application):
             handlers = [(base + x[0],) + x[1:] for x in handlers]
 
         # Init app settings with config.tornado and add override by passed args.
+        # The config is frozen, tornado and handlers get plain dicts and lists.
         app_settings = {}
-        app_settings.update(tornado_opts.app_settings)
+        app_settings.update(thaw(tornado_opts.app_settings))
         app_settings.update(settings)
         super(Application, self).__init__(handlers=handlers, default_host=default_host,
                                           transforms=transforms, wsgi=wsgi, **app_settings)
 
-        # Init engine settings with config.db and add overrider by passed args.
+        # look up routes in an index instead of trying every pattern
+        if self.settings.get('indexed_routing'):
+            use_indexed_router(self)
+
+        # rate limits and load shedding from the rate_limits and load_shedding settings
+        self.rate_limits, self.load_shedder = bbtornado.ratelimit.from_settings(self.settings)
+
+        # response compression and caching
+        self.compression = None
+        if self.settings.get('compression'):
+            compression_settings = self.settings['compression']
+            if compression_settings is True:
+                compression_settings = {}
+            self.compression = compression_transform(**compression_settings)
+            self.add_transform(self.compression)
+        self.response_cache = ResponseCache(**(self.settings.get('response_cache') or {}))
+
+        # the batch endpoint, if enabled
+        if self.settings.get('batch_url'):
+            self.add_handlers('.*$', [(tornado_opts.server.base + self.settings['batch_url'], BatchHandler)])
+
+        # Init engine settings with config.db, pool settings and add overrider by passed args.
+        db_uri = bbtornado.config.db.uri
         _create_engine_settings = {}
-        _create_engine_settings.update(bbtornado.config.db)
+        _create_engine_settings.update(thaw(bbtornado.config.db))
+        pool_config = _create_engine_settings.pop('pool', None)
+        pool_class = create_engine_settings.get('poolclass', _create_engine_settings.get('poolclass'))
+        _pool_settings, self.pool_stats = pool_settings(db_uri, pool_config, pool_class)
+        _create_engine_settings.update(_pool_settings)
         _create_engine_settings.update(create_engine_settings)
         # Handle db_uri explicitely
-        db_uri = bbtornado.config.db.uri
         _create_engine_settings.pop('uri', None)
         # setup database engine
         log.info('Using database from %s'%db_uri)
-        self.engine = create_engine(db_uri,
-                                    convert_unicode=True,
-                                    **_create_engine_settings)
+        self.engine = create_engine(db_uri, **_create_engine_settings)
+        self.pool_stats.attach(self.engine)
+        if self.settings.get('pool_stats_url'):
+            self.add_handlers('.*$', [(tornado_opts.server.base + self.settings['pool_stats_url'], PoolStatsHandler)])
+
+        # buffered counters and upserts, see bbtornado.writebehind
+        self.write_behind = WriteBehindBuffer(self.engine, **(self.settings.get('write_behind') or {}))
+
+        # background tasks, see bbtornado.tasks
+        self.tasks = bbtornado.tasks.TaskQueue(engine=self.engine, **(self.settings.get('tasks') or {}))
+
+        # /healthz, /readyz and /stats, see bbtornado.health
+        self.draining = False
+        if self.settings.get('health'):
+            health_settings = self.settings['health']
+            if health_settings is True:
+                health_settings = {}
+            bbtornado.health.add_handlers(self, base=tornado_opts.server.base, **health_settings)
 
         if init_db:
             bbtornado.models.init_db(self.engine)
-        self.Session = scoped_session(sessionmaker(bind=self.engine, **sessionmaker_settings), scopefunc=lambda: ThreadRequestContext.data.get('request', None))
+            if self.tasks.durable:
+                bbtornado.tasks.init_db(self.engine)
+        # handlers create their sessions from the plain sessionmaker, and register them
+        # as the Session of their request, see bbtornado.session
+        self.sessionmaker = sessionmaker(bind=self.engine, **sessionmaker_settings)
+        # cached rows for Model.cached_get, used by the sessions of the sessionmaker,
+        # see bbtornado.modelcache
+        if self.settings.get('model_cache'):
+            bbtornado.modelcache.default_cache().configure(**self.settings['model_cache'])
+            bbtornado.modelcache.watch(self.sessionmaker)
+        self.Session = scoped_session(self.sessionmaker, scopefunc=lambda: ThreadRequestContext.data.get('request', None))
         # this allows the BaseHandler to get and set a model for self.current_user
         self.user_model = user_model
 
@@ -0,0 +1,201 @@
+"""
+Write-behind buffering of counters and last-seen style columns.
+
+Instead of an UPDATE per request on a few hot rows, operations are buffered in
+memory, merged by row, and written with one bulk statement per model:
+
+app.write_behind.increment(Page, dict(id=page.id), views=1)
+app.write_behind.upsert(UserSeen, dict(user_id=user.id), last_seen=now())
+
+Increments of the same row are summed and only update existing rows, upserts of
+the same row keep the last value of each column, and insert missing rows (using
+BaseModel.bulk_upsert). Upserts are written before increments.
+
+The buffer is flushed through `Application.engine` every `flush_interval` seconds,
+when `max_size` rows are buffered, and at shutdown. Configure it with the
+`write_behind` app setting:
+
+tornado:
+  app_settings:
+    write_behind:
+      flush_interval: 1   # seconds, the most that is lost if the process dies
+      max_size: 1000      # buffered rows that trigger a flush
+
+If a flush fails, the rows are merged back into the buffer and written with the next one,
+rows that would grow the buffer past `max_size` are dropped and counted in `writebehind.dropped`.
+"""
+
+import logging
+import threading
+import time
+
+from sqlalchemy import bindparam, update
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from bbtornado import metrics
+
+log = logging.getLogger('bbtornado.writebehind')
+
+
+class WriteBehindBuffer(object):
+
+    def __init__(self, engine=None, flush_interval=1.0, max_size=1000, executor=None):
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.executor = executor
+        self._increments = {}
+        self._upserts = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._flushing = None
+        self.io_loop = None
+
+    def __len__(self):
+        return len(self._increments) + len(self._upserts)
+
+    def start(self):
+        """Start flushing on the current IOLoop, this happens with the first operation"""
+        if self._timer is not None:
+            return
+        self.io_loop = IOLoop.current()
+        self._timer = PeriodicCallback(self.flush, self.flush_interval * 1000)
+        self._timer.start()
+
+    def increment(self, model, key, **deltas):
+        """Add deltas to the columns of the row of model with the key (a dict of columns)"""
+        row_key = (model, tuple(sorted(key.items())))
+        with self._lock:
+            row = self._increments.get(row_key)
+            if row is None:
+                self._increments[row_key] = dict(deltas)
+            else:
+                metrics.incr('writebehind.merged')
+                for column, delta in deltas.items():
+                    row[column] = row.get(column, 0) + delta
+        self._added()
+
+    def upsert(self, model, key, **values):
+        """Set the columns of the row of model with the key, inserting it if needed"""
+        row_key = (model, tuple(sorted(key.items())))
+        with self._lock:
+            row = self._upserts.get(row_key)
+            if row is None:
+                self._upserts[row_key] = dict(values)
+            else:
+                metrics.incr('writebehind.merged')
+                row.update(values)
+        self._added()
+
+    def _added(self):
+        size = len(self)
+        metrics.gauge('writebehind.size', size)
+        if self._timer is None:
+            self.start()
+        if size >= self.max_size and self._flushing is None:
+            self.io_loop.add_callback(self.flush)
+
+    def _take(self):
+        with self._lock:
+            increments, self._increments = self._increments, {}
+            upserts, self._upserts = self._upserts, {}
+        metrics.gauge('writebehind.size', len(self))
+        return increments, upserts
+
+    def _restore(self, increments, upserts):
+        # merge a failed batch back, newer upserted values win. Rows that are not
+        # buffered again are only added up to max_size rows, the rest are dropped
+        dropped = 0
+        with self._lock:
+            size = len(self._increments) + len(self._upserts)
+            for row_key, deltas in increments.items():
+                row = self._increments.get(row_key)
+                if row is None:
+                    if size >= self.max_size:
+                        dropped += 1
+                        continue
+                    row = self._increments[row_key] = {}
+                    size += 1
+                for column, delta in deltas.items():
+                    row[column] = row.get(column, 0) + delta
+            for row_key, values in upserts.items():
+                newer = self._upserts.get(row_key)
+                if newer is None:
+                    if size >= self.max_size:
+                        dropped += 1
+                        continue
+                    size += 1
+                    newer = {}
+                self._upserts[row_key] = dict(values, **newer)
+        if dropped:
+            log.warning('Write-behind buffer full, dropped %d rows of a failed flush', dropped)
+            metrics.incr('writebehind.dropped', dropped)
+        metrics.gauge('writebehind.size', len(self))
+
+    @coroutine
+    def flush(self):
+        """Write the buffer on the executor, one flush at a time"""
+        if self._flushing is not None or not len(self):
+            return
+        increments, upserts = self._take()
+        self._flushing = IOLoop.current().run_in_executor(self.executor, self._write, increments, upserts)
+        try:
+            yield self._flushing
+        except Exception:
+            log.exception('Write-behind flush failed, retrying with the next flush')
+            metrics.incr('writebehind.errors')
+            self._restore(increments, upserts)
+        finally:
+            self._flushing = None
+
+    def flush_now(self):
+        """Write the buffer synchronously, i.e. at shutdown"""
+        increments, upserts = self._take()
+        if increments or upserts:
+            try:
+                self._write(increments, upserts)
+            except Exception:
+                metrics.incr('writebehind.errors')
+                self._restore(increments, upserts)
+                raise
+
+    def close(self):
+        """Stop the timer and write what is left"""
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+        try:
+            self.flush_now()
+        except Exception:
+            log.exception('Write-behind flush failed, %d rows lost', len(self))
+
+    def _write(self, increments, upserts):
+        start = time.time()
+        with self.engine.begin() as conn:
+            for (model, key_columns, value_columns), rows in _group(upserts):
+                model.bulk_upsert(conn, [dict(key, **values) for key, values in rows],
+                                  index_elements=list(key_columns), update_columns=list(value_columns))
+            for (model, key_columns, value_columns), rows in _group(increments):
+                table = model.__table__
+                stmt = update(table) \
+                    .where(*[table.c[c] == bindparam('k_' + c) for c in key_columns]) \
+                    .values({c: table.c[c] + bindparam('d_' + c) for c in value_columns})
+                conn.execute(stmt, [dict([('k_' + c, key[c]) for c in key_columns] +
+                                         [('d_' + c, values[c]) for c in value_columns])
+                                    for key, values in rows])
+        metrics.incr('writebehind.flushes')
+        metrics.incr('writebehind.rows', len(increments) + len(upserts))
+        metrics.timing('writebehind.flush', time.time() - start)
+
+
+def _group(buffered):
+    """
+    Group buffered rows by model and columns, each group is written with one executemany.
+    Returns ((model, key columns, value columns), [(key, values), ...]) pairs.
+    """
+    groups = {}
+    for (model, key), values in buffered.items():
+        group = (model, tuple(c for c, _ in key), tuple(sorted(values)))
+        groups.setdefault(group, []).append((dict(key), values))
+    return groups.items()
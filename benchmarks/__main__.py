@@ -0,0 +1,57 @@
+"""
+Run the benchmark suite:
+
+    $ python -m benchmarks                         # run everything
+    $ python -m benchmarks -k models               # only benchmarks matching a regex
+    $ python -m benchmarks -o new.json -c old.json # store results and compare to a previous run
+
+Exits with status 1 if any benchmark regressed more than the threshold.
+"""
+
+import argparse
+import sys
+
+from benchmarks import suite
+
+# register the benchmarks
+import benchmarks.micro
+import benchmarks.e2e
+import benchmarks.bench_bulk
+import benchmarks.bench_request_context
+import benchmarks.bench_formats
+import benchmarks.bench_routing
+import benchmarks.bench_allocations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='bbtornado benchmarks')
+    parser.add_argument('-k', dest='pattern', help='only run benchmarks matching this regex')
+    parser.add_argument('-o', '--output', help='store the results as json in this file')
+    parser.add_argument('-c', '--compare', help='compare with the results stored in this file')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='relative change counted as a regression (default 0.1)')
+    args = parser.parse_args(argv)
+
+    results = suite.run(args.pattern)
+
+    print('')
+    for name, result in results.items():
+        print('%-45s %12s' % (name, suite.format_value(result)))
+
+    if args.output:
+        suite.save(results, args.output)
+
+    if args.compare:
+        print('')
+        regressions = 0
+        for name, old, new, change, regression in suite.compare(suite.load(args.compare), results, args.threshold):
+            print('%-45s %+7.1f%% %s' % (name, change * 100, 'REGRESSION' if regression else ''))
+            regressions += regression
+        if regressions:
+            print('\n%d regression(s)' % regressions)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Benchmark the memory allocated per request, with tracemalloc.
+
+Measures the bytes allocated by a request context (the slotted RequestData vs
+the ObjectDict it replaced), and by a full request through BaseHandler vs a plain
+RequestHandler. Also times config lookups in the frozen config vs ObjectDicts.
+
+    $ python -m benchmarks.bench_allocations
+"""
+
+import time
+import timeit
+import tracemalloc
+
+import tornado.web
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
+from tornado.httpserver import HTTPServer
+from tornado.httpclient import AsyncHTTPClient
+from tornado.testing import bind_unused_port
+from tornado.util import ObjectDict
+
+from bbtornado.frozen import GlobalConfig
+from bbtornado.handlers import BaseHandler, RequestData, ThreadRequestContext
+
+from benchmarks.suite import benchmark
+
+
+N = 1000
+N_REQUESTS = 200
+
+CONFIG = dict(tornado=dict(server=dict(host='127.0.0.1', port=5000, base=''),
+                           app_settings=dict(debug=False, cookie_secret='bench')),
+              db=dict(uri='sqlite://', echo=False))
+
+
+def allocated(fn, n=N):
+    """Average bytes allocated (peak above the start) per call of fn"""
+    fn()
+    total = 0
+    tracemalloc.start()
+    try:
+        for i in range(n):
+            start, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - start
+    finally:
+        tracemalloc.stop()
+    return total / float(n)
+
+
+def request_data():
+    data = RequestData(request=object())
+    data.current_user = None
+    data.setdefault('memo_stats', None)
+    return data
+
+
+def object_dict():
+    # the request context data as it was before RequestData
+    data = ObjectDict(dict(request=object()))
+    data.current_user = None
+    data.setdefault('memo_stats', None)
+    return data
+
+
+def request_context():
+    with ThreadRequestContext(request=object()):
+        ThreadRequestContext.data.current_user = None
+
+
+class PlainHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write('ok')
+
+
+class ContextHandler(BaseHandler):
+    def get(self):
+        self.write('ok')
+
+
+@coroutine
+def request_allocations(handler):
+    """Average bytes allocated per request, client included"""
+    app = tornado.web.Application([(r'/', handler)], cookie_secret='bench')
+    app.user_model = None
+    sock, port = bind_unused_port()
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+    client = AsyncHTTPClient()
+    url = 'http://127.0.0.1:%d/' % port
+    total = 0
+    try:
+        yield client.fetch(url)
+        tracemalloc.start()
+        for i in range(N_REQUESTS):
+            start, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            yield client.fetch(url)
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - start
+        return total / float(N_REQUESTS)
+    finally:
+        tracemalloc.stop()
+        server.stop()
+
+
+def config_lookup(config):
+    number = 100000
+    t = timeit.Timer(lambda: config.tornado.server.base).timeit(number)
+    return t / number
+
+
+def object_dicts(src):
+    # the global config as it was before the frozen config
+    return ObjectDict((k, object_dicts(v) if isinstance(v, dict) else v) for k, v in src.items())
+
+
+def configs():
+    return GlobalConfig(CONFIG), object_dicts(CONFIG)
+
+
+@benchmark('allocations', raw=True)
+def allocations():
+    def b(value):
+        return dict(value=value, unit='B', higher_is_better=False)
+
+    def s(value):
+        return dict(value=value, unit='s', higher_is_better=False)
+
+    run = IOLoop.current().run_sync
+    frozen, _ = configs()
+    return dict(request_data=b(allocated(request_data)),
+                request_context=b(allocated(request_context)),
+                plain_request=b(run(lambda: request_allocations(PlainHandler))),
+                base_handler_request=b(run(lambda: request_allocations(ContextHandler))),
+                config_lookup=s(config_lookup(frozen)))
+
+
+def main():
+    print('%-20s %8.0f B per request data' % ('RequestData', allocated(request_data)))
+    print('%-20s %8.0f B per request data' % ('ObjectDict', allocated(object_dict)))
+    print('%-20s %8.0f B per request context' % ('ThreadRequestContext', allocated(request_context)))
+
+    run = IOLoop.current().run_sync
+    plain = run(lambda: request_allocations(PlainHandler))
+    base = run(lambda: request_allocations(ContextHandler))
+    print('%-20s %8.0f B per request' % ('RequestHandler', plain))
+    print('%-20s %8.0f B per request (%.0f B overhead)' % ('BaseHandler', base, base - plain))
+
+    frozen, nested = configs()
+    print('%-20s %8.3f us per config.tornado.server.base' % ('FrozenConfig', config_lookup(frozen) * 1e6))
+    print('%-20s %8.3f us per config.tornado.server.base' % ('ObjectDict', config_lookup(nested) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark BaseModel.bulk_insert/bulk_upsert against adding ORM objects one by one.
+
+Uses a sqlite database in a temporary file.
+
+    $ python -m benchmarks.bench_bulk
+"""
+
+import os
+import tempfile
+import time
+
+from sqlalchemy import Column, types, create_engine
+from sqlalchemy.orm import sessionmaker
+
+from bbtornado.models import Base, BaseModel
+
+from benchmarks.suite import benchmark
+
+
+N_ROWS = 20000
+
+
+class BenchRow(Base, BaseModel):
+    __tablename__ = 'bench_bulk_row'
+
+    id = Column(types.Integer, primary_key=True)
+    name = Column(types.String, nullable=False)
+    value = Column(types.Integer)
+
+
+def rows():
+    return [dict(name='row %d' % i, value=i) for i in range(N_ROWS)]
+
+
+def orm_add(session):
+    for row in rows():
+        session.add(BenchRow(**row))
+    session.flush()
+
+
+def bulk_insert(session):
+    BenchRow.bulk_insert(session, rows())
+
+
+def bulk_insert_pks(session):
+    BenchRow.bulk_insert(session, rows(), return_pks=True)
+
+
+def bulk_upsert(session):
+    BenchRow.bulk_insert(session, rows())
+    BenchRow.bulk_upsert(session, [dict(id=i + 1, name='updated', value=-i) for i in range(N_ROWS)])
+
+
+def run(fn):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    engine = create_engine('sqlite:///%s' % path)
+    try:
+        BenchRow.__table__.create(engine)
+        session = sessionmaker(bind=engine)()
+        start = time.time()
+        fn(session)
+        session.commit()
+        elapsed = time.time() - start
+        session.close()
+        return elapsed
+    finally:
+        engine.dispose()
+        os.unlink(path)
+
+
+@benchmark('bulk.sqlite', raw=True)
+def bulk_sqlite():
+    return {fn.__name__: dict(value=run(fn), unit='s', higher_is_better=False)
+            for fn in (orm_add, bulk_insert, bulk_insert_pks, bulk_upsert)}
+
+
+def main():
+    baseline = run(orm_add)
+    print('%-16s %8.3fs for %d rows' % ('orm add', baseline, N_ROWS))
+    for fn in (bulk_insert, bulk_insert_pks, bulk_upsert):
+        elapsed = run(fn)
+        print('%-16s %8.3fs for %d rows (%.1fx)' % (fn.__name__.replace('_', ' '), elapsed, N_ROWS, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
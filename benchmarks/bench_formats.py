@@ -0,0 +1,59 @@
+"""
+Compare JSON and MessagePack for a large numeric payload, as sent between services:
+encode/decode CPU time and payload size.
+
+    $ python -m benchmarks.bench_formats
+"""
+
+import json
+import random
+import timeit
+
+from bbtornado import formats
+
+from benchmarks.suite import benchmark
+
+
+def payload(n=10000):
+    rnd = random.Random(42)
+    return dict(series=[dict(id=i, value=rnd.random() * 1000, count=rnd.randint(0, 100000))
+                        for i in range(n)])
+
+
+def encoders():
+    rval = [('json', lambda d: json.dumps(d).encode('utf8'), json.loads)]
+    if formats.msgpack is not None:
+        rval.append(('msgpack', formats.packb, formats.unpackb))
+    return rval
+
+
+def measure(number=5):
+    data = payload()
+    results = {}
+    for name, encode, decode in encoders():
+        body = encode(data)
+        results['%s.size' % name] = dict(value=len(body), unit='B', higher_is_better=False)
+        results['%s.encode' % name] = dict(value=min(timeit.repeat(lambda: encode(data), number=number, repeat=3)) / number,
+                                           unit='s', higher_is_better=False)
+        results['%s.decode' % name] = dict(value=min(timeit.repeat(lambda: decode(body), number=number, repeat=3)) / number,
+                                           unit='s', higher_is_better=False)
+    return results
+
+
+@benchmark('formats', raw=True)
+def formats_benchmark():
+    return measure()
+
+
+def main():
+    if formats.msgpack is None:
+        print('msgpack is not installed, only measuring json')
+    for name, result in sorted(measure().items()):
+        if result['unit'] == 's':
+            print('%-16s %8.2fms' % (name, result['value'] * 1e3))
+        else:
+            print('%-16s %8dB' % (name, result['value']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark the per-request overhead of the request context.
+
+Measures entering a request context and running callbacks in it, with
+the contextvars based ThreadRequestContext and, if the installed tornado
+still has it (< 6.0), with the old StackContext approach.
+Also measures a full request through BaseHandler vs a plain RequestHandler.
+
+    $ python -m benchmarks.bench_request_context
+"""
+
+import time
+from functools import partial
+
+import tornado.web
+from tornado.gen import coroutine, moment
+from tornado.ioloop import IOLoop
+from tornado.httpserver import HTTPServer
+from tornado.httpclient import AsyncHTTPClient
+from tornado.testing import bind_unused_port
+
+from bbtornado.handlers import BaseHandler, ThreadRequestContext
+
+from benchmarks.suite import benchmark
+
+try:
+    import tornado.stack_context as stack_context
+except ImportError:
+    stack_context = None
+
+
+N = 20000
+N_REQUESTS = 2000
+N_CALLBACKS = 5
+
+
+@coroutine
+def contextvars_request():
+    with ThreadRequestContext(request=object()):
+        for i in range(N_CALLBACKS):
+            yield moment
+            ThreadRequestContext.data.request
+
+
+@coroutine
+def stack_context_request():
+    with stack_context.StackContext(partial(_ThreadLocalContext, request=object())):
+        for i in range(N_CALLBACKS):
+            yield moment
+            _ThreadLocalContext.data['request']
+
+
+class _ThreadLocalContext(object):
+    # the thread-local ThreadRequestContext as it was before contextvars
+    data = {}
+
+    def __init__(self, **data):
+        self._data = data
+
+    def __enter__(self):
+        self._prev = _ThreadLocalContext.data
+        _ThreadLocalContext.data = self._data
+
+    def __exit__(self, *exc):
+        _ThreadLocalContext.data = self._prev
+        return False
+
+
+@coroutine
+def time_context(fn):
+    start = time.time()
+    for i in range(N):
+        yield fn()
+    return (time.time() - start) / N
+
+
+class PlainHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write('ok')
+
+
+class ContextHandler(BaseHandler):
+    def get(self):
+        self.write('ok')
+
+
+@coroutine
+def time_requests(handler):
+    app = tornado.web.Application([(r'/', handler)], cookie_secret='bench')
+    app.user_model = None
+    sock, port = bind_unused_port()
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+    client = AsyncHTTPClient()
+    url = 'http://127.0.0.1:%d/' % port
+    try:
+        start = time.time()
+        for i in range(N_REQUESTS):
+            yield client.fetch(url)
+        return (time.time() - start) / N_REQUESTS
+    finally:
+        server.stop()
+
+
+@benchmark('request_context', raw=True)
+def request_context():
+    def run(fn):
+        return dict(value=IOLoop.current().run_sync(fn), unit='s', higher_is_better=False)
+
+    results = dict(contextvars=run(lambda: time_context(contextvars_request)),
+                   plain_request=run(lambda: time_requests(PlainHandler)),
+                   base_handler_request=run(lambda: time_requests(ContextHandler)))
+    if stack_context is not None:
+        results['stack_context'] = run(lambda: time_context(stack_context_request))
+    return results
+
+
+@coroutine
+def main():
+    results = dict(contextvars=(yield time_context(contextvars_request)))
+    if stack_context is not None:
+        results['stack_context'] = yield time_context(stack_context_request)
+
+    plain = yield time_requests(PlainHandler)
+    base = yield time_requests(ContextHandler)
+
+    for name, t in sorted(results.items()):
+        print('%-20s %8.2f us per request context (%d callbacks)' % (name, t * 1e6, N_CALLBACKS))
+    if stack_context is None:
+        print('tornado.stack_context not available (tornado >= 6), no comparison')
+    else:
+        print('%-20s %8.2f us saved per request' % ('contextvars', (results['stack_context'] - results['contextvars']) * 1e6))
+    print('%-20s %8.2f us per request' % ('RequestHandler', plain * 1e6))
+    print('%-20s %8.2f us per request (%.2f us overhead)' % ('BaseHandler', base * 1e6, (base - plain) * 1e6))
+
+
+if __name__ == '__main__':
+    IOLoop.current().run_sync(main)
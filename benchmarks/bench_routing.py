@@ -0,0 +1,71 @@
+"""
+Route dispatch with tornado's linear router and the IndexedRouter,
+over a large synthetic route table.
+
+    $ python -m benchmarks.bench_routing
+"""
+
+import timeit
+
+from tornado.httputil import HTTPServerRequest
+from tornado.web import Application, RequestHandler
+
+from bbtornado.routing import use_indexed_router
+
+from benchmarks.suite import benchmark
+
+
+N_RESOURCES = 100
+
+
+def route_table(n=N_RESOURCES):
+    # 5 routes per resource, like a typical REST api
+    handlers = []
+    for i in range(n):
+        handlers += [(r'/api/resource%d' % i, RequestHandler),
+                     (r'/api/resource%d/(\d+)' % i, RequestHandler),
+                     (r'/api/resource%d/(\d+)/children' % i, RequestHandler),
+                     (r'/api/resource%d/(\d+)/children/(\d+)' % i, RequestHandler),
+                     (r'/api/resource%d/search/?' % i, RequestHandler)]
+    handlers.append((r'/(.*)', RequestHandler))
+    return handlers
+
+
+PATHS = ['/api/resource0',
+         '/api/resource%d/42' % (N_RESOURCES // 2),
+         '/api/resource%d/42/children/3' % (N_RESOURCES - 1),
+         '/not/found']
+
+
+def dispatcher(indexed):
+    app = Application(route_table())
+    if indexed:
+        use_indexed_router(app)
+    requests = [HTTPServerRequest(method='GET', uri=path) for path in PATHS]
+
+    def run():
+        for request in requests:
+            app.find_handler(request)
+    return run
+
+
+@benchmark('routing.linear')
+def routing_linear():
+    return dispatcher(False)
+
+
+@benchmark('routing.indexed')
+def routing_indexed():
+    return dispatcher(True)
+
+
+def main():
+    print('%d routes, %d requests per run' % (len(route_table()), len(PATHS)))
+    for indexed in (False, True):
+        run = dispatcher(indexed)
+        elapsed = min(timeit.repeat(run, number=1000, repeat=5)) / 1000
+        print('%-8s %8.2fus per request' % ('indexed' if indexed else 'linear', elapsed / len(PATHS) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
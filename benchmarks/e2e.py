@@ -0,0 +1,122 @@
+"""
+End-to-end throughput and latency benchmarks.
+
+A real bbtornado.web.Application backed by sqlite runs in a separate process,
+and a local load generator with a fixed number of concurrent clients
+requests each endpoint for a fixed duration.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from tornado.gen import coroutine, multi
+from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+
+from benchmarks.suite import benchmark
+
+
+CONCURRENCY = 20
+DURATION = 5 # seconds per endpoint
+
+
+def _serve(db_path, port_queue):
+    # runs in the server process
+    import bbtornado.main
+    bbtornado.main.setup_global_config(db_path='sqlite:///%s' % db_path)
+
+    from sqlalchemy.orm import sessionmaker
+    from tornado.httpserver import HTTPServer
+    from tornado.testing import bind_unused_port
+
+    from bbtornado.handlers import BaseHandler
+    from bbtornado.models import _to_json
+    from bbtornado.web import Application
+    from benchmarks.fixtures import BenchTeam, BenchUser, populate
+
+    class UsersHandler(BaseHandler):
+        def get(self):
+            self.write(dict(users=_to_json(self.db.query(BenchUser).limit(50))))
+
+    class TeamHandler(BaseHandler):
+        def get(self, team_id):
+            team = self.db.query(BenchTeam).get(int(team_id))
+            self.write(team._to_json(extra_fields=['users', 'users.!score']))
+
+    class EchoHandler(BaseHandler):
+        def post(self):
+            self.write(dict(count=len(self.json_data['items'])))
+
+    app = Application([(r'/users', UsersHandler),
+                       (r'/teams/(\d+)', TeamHandler),
+                       (r'/echo', EchoHandler)])
+    populate(sessionmaker(bind=app.engine)())
+
+    sock, port = bind_unused_port()
+    HTTPServer(app).add_sockets([sock])
+    port_queue.put(port)
+    IOLoop.current().start()
+
+
+@coroutine
+def _load(url, duration, concurrency, **kwargs):
+    client = AsyncHTTPClient(max_clients=concurrency)
+    latencies = []
+    deadline = time.time() + duration
+
+    @coroutine
+    def worker():
+        while time.time() < deadline:
+            start = time.time()
+            yield client.fetch(url, **kwargs)
+            latencies.append(time.time() - start)
+
+    start = time.time()
+    yield multi([worker() for i in range(concurrency)])
+    elapsed = time.time() - start
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return {
+        'rps': dict(value=len(latencies) / elapsed, unit='req/s', higher_is_better=True),
+        'p50': dict(value=percentile(0.50), unit='s', higher_is_better=False),
+        'p95': dict(value=percentile(0.95), unit='s', higher_is_better=False),
+        'p99': dict(value=percentile(0.99), unit='s', higher_is_better=False),
+    }
+
+
+ECHO_BODY = json.dumps(dict(items=[dict(id=i, name='item %d' % i) for i in range(100)]))
+
+ENDPOINTS = [
+    ('users', '/users', {}),
+    ('team', '/teams/1', {}),
+    ('echo', '/echo', dict(method='POST', body=ECHO_BODY, headers={'Content-Type': 'application/json'})),
+]
+
+
+@benchmark('e2e.http', raw=True)
+def http():
+    tmpdir = tempfile.mkdtemp()
+    ctx = multiprocessing.get_context('spawn')
+    port_queue = ctx.Queue()
+    server = ctx.Process(target=_serve, args=(os.path.join(tmpdir, 'bench.db'), port_queue))
+    server.start()
+    try:
+        port = port_queue.get(timeout=30)
+        results = {}
+        for name, path, kwargs in ENDPOINTS:
+            url = 'http://127.0.0.1:%d%s' % (port, path)
+            load = IOLoop.current().run_sync(lambda: _load(url, DURATION, CONCURRENCY, **kwargs))
+            for metric, result in load.items():
+                results['%s.%s' % (name, metric)] = result
+        return results
+    finally:
+        server.terminate()
+        server.join()
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,58 @@
+"""
+Models and data shared by the benchmarks
+"""
+
+from datetime import datetime
+
+from sqlalchemy import Column, types, ForeignKey
+from sqlalchemy.orm import relationship
+
+from bbtornado.models import Base, BaseModel
+
+
+class BenchTeam(Base, BaseModel):
+    __tablename__ = 'bench_team'
+
+    id = Column(types.Integer, primary_key=True)
+    name = Column(types.String, nullable=False)
+    created = Column(types.DateTime, default=datetime.utcnow)
+
+    users = relationship('BenchUser', back_populates='team')
+
+    _json_fields_private = ['users']
+
+
+class BenchUser(Base, BaseModel):
+    __tablename__ = 'bench_user'
+
+    id = Column(types.Integer, primary_key=True)
+    name = Column(types.String, nullable=False)
+    email = Column(types.String)
+    password = Column(types.String)
+    visits = Column(types.Integer, default=0)
+    score = Column(types.Numeric(10, 2))
+    created = Column(types.DateTime, default=datetime.utcnow)
+    team_id = Column(types.Integer, ForeignKey('bench_team.id'))
+
+    team = relationship('BenchTeam', back_populates='users')
+
+    _json_fields_private = ['email']
+    _json_fields_hidden = ['password', 'team_id', 'team']
+
+
+def create_team(n_users=20, id=1):
+    team = BenchTeam(id=id, name='team %d' % id, created=datetime(2017, 1, 1))
+    team.users = [create_user(id * 1000 + i, team) for i in range(n_users)]
+    return team
+
+
+def create_user(id, team=None):
+    return BenchUser(id=id, name='user %d' % id, email='user%d@example.com' % id,
+                     password='secret', visits=id, score=id / 3.0,
+                     created=datetime(2017, 1, 1), team=team)
+
+
+def populate(session, n_teams=10, n_users=20):
+    for i in range(n_teams):
+        session.add(create_team(n_users, id=i + 1))
+    session.commit()
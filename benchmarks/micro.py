@@ -0,0 +1,96 @@
+"""
+Micro benchmarks of the hot paths in bbtornado
+"""
+
+import json
+from unittest.mock import Mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tornado.httputil import HTTPServerRequest, HTTPHeaders
+import tornado.web
+
+from bbtornado import base62
+from bbtornado.handlers import BaseHandler
+from bbtornado.models import init_db, _to_json
+from bbtornado.validate import validate_json
+
+from benchmarks.fixtures import create_team, create_user, populate, BenchUser
+from benchmarks.suite import benchmark
+
+
+@benchmark('models.to_json.flat')
+def to_json_flat():
+    user = create_user(1)
+    return lambda: user._to_json()
+
+
+@benchmark('models.to_json.nested')
+def to_json_nested():
+    team = create_team(20)
+    return lambda: team._to_json(extra_fields=['users'])
+
+
+@benchmark('models.to_json.extra_fields')
+def to_json_extra_fields():
+    team = create_team(20)
+    return lambda: team._to_json(extra_fields=['users', '^id', '^name', '^users', 'users.!email', 'users.!score'])
+
+
+@benchmark('models.to_json.query')
+def to_json_query():
+    engine = create_engine('sqlite://')
+    init_db(engine)
+    session = sessionmaker(bind=engine)()
+    populate(session, n_teams=5, n_users=20)
+
+    def run():
+        _to_json(session.query(BenchUser))
+        session.expunge_all()
+    return run
+
+
+USER_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer"},
+            "name": {"type": "string"},
+            "visits": {"type": "integer"},
+            "created": {"type": "string"},
+        },
+        "required": ["id", "name"]
+    }
+}
+
+
+@benchmark('validate.validate_json')
+def validate():
+    users = [create_user(i) for i in range(100)]
+    return lambda: validate_json(users, json_schema=USER_SCHEMA)
+
+
+@benchmark('base62.encode')
+def base62_encode():
+    return lambda: base62.encode(2 ** 62)
+
+
+@benchmark('base62.decode')
+def base62_decode():
+    s = base62.encode(2 ** 62)
+    return lambda: base62.decode(s)
+
+
+@benchmark('handlers.prepare.json')
+def prepare_json():
+    body = json.dumps(dict(users=[create_user(i)._to_json() for i in range(50)]), default=str).encode()
+    app = tornado.web.Application()
+    connection = Mock()
+
+    def run():
+        request = HTTPServerRequest(method='POST', uri='/', body=body,
+                                    headers=HTTPHeaders({'Content-Type': 'application/json'}),
+                                    connection=connection)
+        BaseHandler(app, request).prepare()
+    return run
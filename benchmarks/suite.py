@@ -0,0 +1,130 @@
+"""
+A small benchmark harness.
+
+Benchmarks are registered with the @benchmark decorator, and results are
+stored as json so runs can be compared with `compare`:
+
+@benchmark('models.to_json.flat')
+def to_json_flat():
+    obj = create_object()
+    return lambda: obj._to_json()
+
+The decorated function does the setup and returns the callable to time.
+Micro benchmarks report seconds per call (lower is better), other benchmarks
+can return a dict of metrics themselves by registering with `raw=True`.
+"""
+
+import json
+import platform
+import re
+import subprocess
+import time
+import timeit
+
+from collections import OrderedDict
+
+
+_benchmarks = OrderedDict()
+
+
+def benchmark(name, number=None, repeat=5, raw=False):
+    """
+    Register a benchmark.
+
+    `number` is the calls per timing run (calibrated to ~0.2s if None),
+    the best of `repeat` runs is reported.
+
+    With `raw=True` the function is called once and must return a dict of
+    metric name -> dict(value=..., unit=..., higher_is_better=...)
+    """
+    def decorator(fn):
+        _benchmarks[name] = dict(fn=fn, number=number, repeat=repeat, raw=raw)
+        return fn
+    return decorator
+
+
+def _time(fn, number, repeat):
+    timer = timeit.Timer(fn)
+    if number is None:
+        number, _ = timer.autorange()
+        number = max(1, number)
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    times.sort()
+    return dict(value=times[0], median=times[len(times) // 2], number=number,
+                unit='s', higher_is_better=False)
+
+
+def run(pattern=None, log=print):
+    """Run all benchmarks with a name matching the regex pattern, returns results dict"""
+    results = OrderedDict()
+    for name, b in _benchmarks.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        start = time.time()
+        if b['raw']:
+            for metric, result in b['fn']().items():
+                results['%s.%s' % (name, metric)] = result
+        else:
+            results[name] = _time(b['fn'](), b['number'], b['repeat'])
+        log('%-45s done in %.1fs' % (name, time.time() - start))
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def metadata():
+    import tornado
+    import sqlalchemy
+    return dict(timestamp=time.time(),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                tornado=tornado.version,
+                sqlalchemy=sqlalchemy.__version__,
+                revision=_git_revision())
+
+
+def save(results, path):
+    with open(path, 'w') as fd:
+        json.dump(dict(meta=metadata(), results=results), fd, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as fd:
+        return json.load(fd)['results']
+
+
+def compare(baseline, results, threshold=0.1):
+    """
+    Compare results against a baseline, returns a list of
+    (name, baseline value, new value, relative change, is regression)
+
+    A change is a regression if it is more than `threshold` worse.
+    """
+    rval = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['value'], result['value']
+        if not old:
+            continue
+        change = (new - old) / float(old)
+        if result.get('higher_is_better'):
+            regression = change < -threshold
+        else:
+            regression = change > threshold
+        rval.append((name, old, new, change, regression))
+    return rval
+
+
+def format_value(result):
+    value = result['value']
+    if result.get('unit') == 's':
+        if value < 1e-3:
+            return '%.2fus' % (value * 1e6)
+        return '%.2fms' % (value * 1e3)
+    return '%.2f%s' % (value, result.get('unit', ''))
@@ -31,9 +31,11 @@ setup(
     url='http://github.com/bakkenbaeck/bbtornado',
     description='Basic app setup using tornado.',
     long_description=open('README.md').read(),
-    install_requires=['tornado', 'sqlalchemy', 'six', 'python-dateutil', 'PyYAML'],
+    python_requires='>=3.7',
+    install_requires=['tornado', 'sqlalchemy>=1.4', 'six', 'python-dateutil', 'PyYAML'],
     extras_require={
-        ':python_version == "2.7"': ['futures'],
-        'jsonschema': ['jsonschema']
+        'jsonschema': ['jsonschema'],
+        'brotli': ['brotli'],
+        'msgpack': ['msgpack']
     }
 )
@@ -0,0 +1,123 @@
+import time
+from unittest import TestCase
+
+from tornado.escape import json_decode
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, create_signed_value, decode_signed_value
+
+from bbtornado import metrics
+from bbtornado.auth import SignedValueCache, cached_decode, signed_timestamp
+from bbtornado.handlers import BaseHandler
+
+
+class User(object):
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class LoginHandler(BaseHandler):
+
+    user_snapshot_fields = ('name',)
+
+    def post(self):
+        self.current_user = User(5, 'ann')
+
+
+class WhoAmIHandler(BaseHandler):
+
+    def get(self):
+        self.write(dict(user=self.current_user))
+
+
+class SnapshotHandler(WhoAmIHandler):
+
+    user_snapshot_fields = ('name',)
+
+
+class SignedValueCacheTest(TestCase):
+
+    def test_expiry_and_size(self):
+        """
+        Cached values expire with the signature, and the least recently used are dropped
+        """
+        old = create_signed_value('secret', 'user_id', '1', clock=lambda: time.time() - 10 * 86400).decode()
+        new = create_signed_value('secret', 'user_id', '2', version=1).decode()
+        self.assertAlmostEqual(signed_timestamp(new), time.time(), delta=2)
+
+        cache = SignedValueCache(max_size=2)
+        cache.put('user_id', old, 1)
+        cache.put('user_id', new, 2)
+        self.assertEqual(cache.get('user_id', old, max_age_days=31), 1)
+        self.assertIsNone(cache.get('user_id', old, max_age_days=5))
+        self.assertEqual(cache.get('user_id', new, max_age_days=5), 2)
+
+        cache.put('user_id', create_signed_value('secret', 'user_id', '3').decode(), 3)
+        cache.put('user_id', create_signed_value('secret', 'user_id', '4').decode(), 4)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('user_id', new, max_age_days=5))
+
+    def test_keyed_by_name(self):
+        """
+        A value is cached per name, it is decoded again as another name
+        """
+        value = create_signed_value('secret', 'user_id', '1').decode()
+        cache = SignedValueCache()
+        decoded = []
+
+        def decode_as(name):
+            def decode(value):
+                decoded.append(name)
+                return decode_signed_value('secret', name, value)
+            return decode
+
+        self.assertEqual(cached_decode(cache, 'user_id', value, 31, decode_as('user_id')), b'1')
+        self.assertIsNone(cached_decode(cache, 'user_token', value, 31, decode_as('user_token')))
+        self.assertEqual(cached_decode(cache, 'user_id', value, 31, decode_as('user_id')), b'1')
+        self.assertEqual(decoded, ['user_id', 'user_token'])
+
+
+class AuthTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Application([(r'/login', LoginHandler), (r'/me', WhoAmIHandler), (r'/snapshot', SnapshotHandler)],
+                          cookie_secret='secret')
+        app.user_model = None
+        app.domain = None
+        return app
+
+    def test_cookie_verified_once(self):
+        """
+        The user_id cookie is verified once, then found in the cache
+        """
+        metrics.reset()
+        cookie = 'user_id=%s' % create_signed_value('secret', 'user_id', '7').decode()
+        for i in range(3):
+            response = self.fetch('/me', headers={'Cookie': cookie})
+            self.assertEqual(json_decode(response.body), dict(user=7))
+        self.assertEqual(metrics.get('auth.cache.misses'), 1)
+        self.assertEqual(metrics.get('auth.cache.hits'), 2)
+
+        forged = 'user_id=2|1:0|10:%d|7:user_id|4:OA==|00' % time.time()
+        response = self.fetch('/me', headers={'Cookie': forged})
+        self.assertEqual(json_decode(response.body), dict(user=None))
+
+    def test_user_token(self):
+        """
+        Logging in sets a user token, handlers with user_snapshot_fields use it without the db
+        """
+        self._app.user_model = User
+        response = self.fetch('/login', method='POST', body='')
+        cookies = [c.split(';')[0] for c in response.headers.get_list('Set-Cookie')]
+        self.assertEqual(sorted(c.split('=')[0] for c in cookies), ['user_id', 'user_token'])
+
+        response = self.fetch('/snapshot', headers={'Cookie': '; '.join(cookies)})
+        self.assertEqual(json_decode(response.body), dict(user=dict(id=5, name='ann')))
+
+        token = dict(c.split('=', 1) for c in cookies)['user_token']
+        response = self.fetch('/snapshot', headers={'Authorization': 'Bearer %s' % token})
+        self.assertEqual(json_decode(response.body), dict(user=dict(id=5, name='ann')))
+
+        response = self.fetch('/snapshot', headers={'Authorization': 'Bearer %s' % token[:-2]})
+        self.assertEqual(json_decode(response.body), dict(user=None))
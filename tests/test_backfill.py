@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, event, text
+
+from bbtornado.alembic.backfill import backfill, estimate
+from bbtornado.models import init_db
+
+from tests.test_models import MockModel
+
+
+class BackfillTest(TestCase):
+    """
+    Test batched backfills against sqlite
+    """
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        init_db(self.engine)
+        with self.engine.begin() as conn:
+            MockModel.bulk_insert(conn, [dict(name='row %d' % i, child_id=None if i % 2 else i)
+                                         for i in range(1, 101)])
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def values(self):
+        with self.engine.connect() as conn:
+            return [r[0] for r in conn.execute(text('SELECT child_id FROM mockmodel ORDER BY id'))]
+
+    def test_backfill(self):
+        """
+        Rows matching the condition are updated in batches
+        """
+        result = backfill(self.engine, MockModel, {'child_id': MockModel.id * 10},
+                          where=MockModel.child_id.is_(None), batch_size=15)
+        self.assertEqual(result.rows, 50)
+        self.assertEqual(result.batches, 4)
+        self.assertEqual(result.last_key, 99)
+        self.assertEqual(self.values(), [i * 10 if i % 2 else i for i in range(1, 101)])
+
+    def test_resume(self):
+        """
+        A backfill resumes after the last processed key
+        """
+        result = backfill(self.engine, 'mockmodel', {'name': 'done'}, start_after=90, batch_size=4)
+        self.assertEqual((result.rows, result.batches, result.last_key), (10, 3, 100))
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT min(id) FROM mockmodel WHERE name = 'done'")).scalar(), 91)
+
+    def test_no_count(self):
+        """
+        A backfill does not count the rows first, sqlite has no table estimate
+        """
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', record)
+        result = backfill(self.engine, 'mockmodel', {'name': 'done'}, batch_size=50)
+        event.remove(self.engine, 'before_cursor_execute', record)
+        self.assertEqual(result.rows, 100)
+        self.assertIsNone(result.estimate)
+        self.assertFalse([s for s in statements if 'count(' in s.lower()])
+
+    def test_dry_run(self):
+        """
+        A dry run estimates the rows, without updating them
+        """
+        self.assertEqual(estimate(self.engine, MockModel, 'child_id IS NULL'), 50)
+        with self.engine.connect() as conn:
+            result = backfill(conn, MockModel, {'child_id': 1}, where='child_id IS NULL', dry_run=True)
+        self.assertEqual((result.estimate, result.rows), (50, 0))
+        self.assertEqual(self.values().count(None), 50)
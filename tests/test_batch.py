@@ -0,0 +1,158 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from tornado.escape import json_decode, json_encode
+from tornado.gen import sleep
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, HTTPError
+
+from bbtornado import metrics
+from bbtornado.batch import BatchHandler
+from bbtornado.handlers import BaseHandler, JsonErrorHandler, ThreadRequestContext
+from bbtornado.ratelimit import MemoryStore, RateLimit
+
+
+events = []
+sessions = []
+
+
+class ItemHandler(JsonErrorHandler, BaseHandler):
+
+    async def get(self, item_id):
+        events.append('start %s' % item_id)
+        await sleep(0.01)
+        events.append('end %s' % item_id)
+        if item_id == '404':
+            raise HTTPError(404)
+        self.write(dict(id=int(item_id), user=self.current_user))
+
+    def post(self, item_id):
+        events.append('post %s' % item_id)
+        self.set_status(201)
+        self.write(dict(id=int(item_id), name=self.json_data['name']))
+
+
+class SessionHandler(BaseHandler):
+
+    async def get(self):
+        db = self.db
+        await sleep(0.01)
+        sessions.append((db, self.application.Session()))
+        self.write(dict(ok=True))
+
+
+class LimitedHandler(JsonErrorHandler, BaseHandler):
+
+    rate_limits = [RateLimit(rate=1, burst=1, key='ip', store=MemoryStore())]
+
+    def get(self):
+        self.write(dict(ok=True))
+
+
+class TokenHandler(BaseHandler):
+
+    rate_limits = ()
+
+    def get(self):
+        self.write(dict(token=self.xsrf_token.decode('ascii')))
+
+
+class BatchTestCase(AsyncHTTPTestCase):
+
+    xsrf_cookies = False
+
+    def setUp(self):
+        super(BatchTestCase, self).setUp()
+        del events[:]
+        del sessions[:]
+        metrics.reset()
+
+    def get_app(self):
+        app = Application([(r'/items/(\d+)', ItemHandler), (r'/sessions', SessionHandler),
+                           (r'/limited', LimitedHandler), (r'/token', TokenHandler),
+                           (r'/batch', BatchHandler)],
+                          cookie_secret='secret', xsrf_cookies=self.xsrf_cookies)
+        app.user_model = None
+        app.rate_limits = [RateLimit(rate=1, burst=1, key='ip', store=MemoryStore(), name='app:test')]
+        app.engine = create_engine('sqlite://', poolclass=StaticPool, connect_args=dict(check_same_thread=False))
+        app.sessionmaker = sessionmaker(bind=app.engine)
+        app.Session = scoped_session(app.sessionmaker,
+                                     scopefunc=lambda: ThreadRequestContext.data.get('request', None))
+        return app
+
+    def batch(self, requests, headers=None):
+        headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+        response = self.fetch('/batch', method='POST', body=json_encode(requests), headers=headers)
+        self.assertEqual(response.code, 200)
+        body = json_decode(response.body)
+        self.assertEqual(body['status'], 'success')
+        return body['data']
+
+
+class BatchTest(BatchTestCase):
+
+    def test_batch(self):
+        """
+        Sub-requests are dispatched to their handlers, GETs concurrently and writes in order
+        """
+        results = self.batch([dict(url='/items/1'),
+                              dict(url='/items/2'),
+                              dict(method='POST', url='/items/3', body=dict(name='three')),
+                              dict(url='/items/4')])
+
+        self.assertEqual([r['status'] for r in results], [200, 200, 201, 200])
+        self.assertEqual(results[0]['body'], dict(id=1, user=None))
+        self.assertEqual(results[2]['body'], dict(id=3, name='three'))
+        self.assertEqual(events, ['start 1', 'start 2', 'end 1', 'end 2', 'post 3', 'start 4', 'end 4'])
+
+    def test_errors(self):
+        """
+        Errors of sub-requests are returned per sub-request
+        """
+        results = self.batch(dict(requests=[dict(url='/items/404'), dict(url='/nothing'), dict(url='/batch')]))
+        self.assertEqual([r['status'] for r in results], [404, 404, 400])
+
+    def test_limits(self):
+        """
+        A batch is one request for the application's rate limits and the in-flight metrics,
+        rate limits of a handler apply to each of its sub-requests
+        """
+        results = self.batch([dict(url='/items/1'), dict(url='/items/2'), dict(url='/limited'), dict(url='/limited')])
+        self.assertEqual([r['status'] for r in results], [200, 200, 200, 429])
+        self.assertEqual(metrics.get('requests.served'), 1)
+        self.assertEqual(metrics.get('requests.in_flight'), 0)
+
+        # the batch took the one token of the application's limit
+        self.assertEqual(self.fetch('/items/5').code, 429)
+
+    def test_sessions(self):
+        """
+        Concurrent sub-requests each have their own db session, the scoped Session of their request
+        """
+        results = self.batch([dict(url='/sessions'), dict(url='/sessions')])
+        self.assertEqual([r['status'] for r in results], [200, 200])
+        (db1, scoped1), (db2, scoped2) = sessions
+        self.assertIsNot(db1, db2)
+        self.assertIs(db1, scoped1)
+        self.assertIs(db2, scoped2)
+
+
+class BatchXsrfTest(BatchTestCase):
+
+    xsrf_cookies = True
+
+    def test_xsrf(self):
+        """
+        Sub-requests are sent with the xsrf token of the batch request
+        """
+        response = self.fetch('/token')
+        token = json_decode(response.body)['token']
+        cookie = response.headers['Set-Cookie'].split(';')[0]
+
+        results = self.batch([dict(method='POST', url='/items/3', body=dict(name='three'))],
+                             headers={'Cookie': cookie, 'X-Xsrftoken': token})
+        self.assertEqual([r['status'] for r in results], [201])
+
+        response = self.fetch('/batch', method='POST', body=json_encode([dict(url='/items/1')]),
+                              headers={'Cookie': cookie})
+        self.assertEqual(response.code, 403)
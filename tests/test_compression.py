@@ -0,0 +1,75 @@
+import gzip
+
+from tornado.escape import json_decode
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from bbtornado import metrics
+from bbtornado.compression import compression_transform, cache_response, ResponseCache
+from bbtornado.handlers import BaseHandler
+
+
+calls = []
+
+
+class DataHandler(BaseHandler):
+
+    def get(self, size):
+        calls.append(size)
+        self.write(dict(data='x' * int(size)))
+
+
+class CachedHandler(DataHandler):
+
+    @cache_response(ttl=60)
+    def get(self, size):
+        return super(CachedHandler, self).get(size)
+
+
+class CompressionTest(AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(CompressionTest, self).setUp()
+        del calls[:]
+        metrics.reset()
+
+    def get_app(self):
+        app = Application([(r'/data/(\d+)', DataHandler), (r'/cached/(\d+)', CachedHandler)], cookie_secret='secret')
+        app.user_model = None
+        app.compression = compression_transform(min_size=200, level=1)
+        app.add_transform(app.compression)
+        app.response_cache = ResponseCache()
+        return app
+
+    def fetch_gzip(self, path):
+        return self.fetch(path, headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+
+    def test_min_size(self):
+        """
+        Only responses above the size threshold are compressed
+        """
+        response = self.fetch_gzip('/data/10')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json_decode(response.body), dict(data='x' * 10))
+
+        response = self.fetch_gzip('/data/1000')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json_decode(gzip.decompress(response.body)), dict(data='x' * 1000))
+
+    def test_cached_compressed(self):
+        """
+        Cached responses are stored compressed, and served without calling the handler
+        """
+        first = self.fetch_gzip('/cached/1000')
+        second = self.fetch_gzip('/cached/1000')
+        self.assertEqual(calls, ['1000'])
+        self.assertEqual(second.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(second.body, first.body)
+        self.assertEqual(metrics.get('compression.gzip'), 1)
+        self.assertEqual(metrics.get('response_cache.hits'), 1)
+
+        # clients not accepting gzip get the uncompressed body
+        response = self.fetch('/cached/1000', decompress_response=False)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json_decode(response.body), dict(data='x' * 1000))
+        self.assertEqual(calls, ['1000', '1000'])
@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sqlalchemy.dialects import postgresql
+
+from bbtornado.alembic import enums
+
+
+class MockContext(object):
+
+    def __init__(self, as_sql=False):
+        self.as_sql = as_sql
+        self.dialect = postgresql.dialect()
+        self.blocks = 0
+
+    @contextmanager
+    def autocommit_block(self):
+        self.blocks += 1
+        yield
+
+
+def mock_op(existing, as_sql=False):
+    op = Mock()
+    op.get_context.return_value = MockContext(as_sql)
+    rows = [(name, label) for name, labels in existing.items() for label in labels]
+    op.get_bind.return_value.execute.return_value = rows
+    return op
+
+
+class EnumSyncTest(TestCase):
+
+    def statements(self, op):
+        return [c[0][0] for c in op.execute.call_args_list]
+
+    def test_missing_options(self):
+        """
+        Missing options are positioned after the previous, or before the next existing option
+        """
+        self.assertEqual(enums.missing_options(['b', 'd'], ['a', 'b', 'c', 'd', 'e']),
+                         [('a', ('BEFORE', 'b')), ('c', ('AFTER', 'b')), ('e', ('AFTER', 'd'))])
+        self.assertEqual(enums.missing_options(['b'], ['a', 'c'], ordered=False), [('a', None), ('c', None)])
+
+    def test_sync(self):
+        """
+        pg_enum is read once, and only missing options are added in one autocommit block
+        """
+        op = mock_op({'status': ['draft', 'published'], 'role': ['admin', 'viewer']})
+        enums.sync(op, {'status': ['draft', 'review', 'published'], 'role': ['admin', 'viewer']})
+
+        self.assertEqual(op.get_bind.return_value.execute.call_count, 1)
+        self.assertEqual(op.get_context.return_value.blocks, 1)
+        self.assertEqual(self.statements(op),
+                         ["ALTER TYPE status ADD VALUE IF NOT EXISTS 'review' AFTER 'draft'"])
+
+    def test_nothing_to_do(self):
+        """
+        No autocommit block when all options exist
+        """
+        op = mock_op({'status': ['draft', 'published']})
+        enums.sync(op, {'status': ['draft', 'published']})
+        self.assertEqual(op.get_context.return_value.blocks, 0)
+        self.assertEqual(self.statements(op), [])
+
+    def test_offline(self):
+        """
+        In as_sql mode all options are added with IF NOT EXISTS, in order
+        """
+        op = mock_op({}, as_sql=True)
+        enums.sync(op, {'status': ['draft', "it's"]})
+        op.get_bind.return_value.execute.assert_not_called()
+        self.assertEqual(self.statements(op),
+                         ["ALTER TYPE status ADD VALUE IF NOT EXISTS 'draft'",
+                          "ALTER TYPE status ADD VALUE IF NOT EXISTS 'it''s' AFTER 'draft'"])
@@ -0,0 +1,81 @@
+import json
+import unittest
+
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
+
+from bbtornado import formats
+from bbtornado.handlers import BaseHandler
+from bbtornado.utils import HTTP
+
+
+class EchoHandler(BaseHandler):
+
+    def get(self):
+        self.write(dict(values=list(range(5)), name='echo'))
+
+    def post(self):
+        self.write(dict(received=self.json_data))
+
+
+@unittest.skipIf(formats.msgpack is None, 'msgpack is not installed')
+class FormatsTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Application([(r'/echo', EchoHandler)], cookie_secret='secret')
+        app.user_model = None
+        return app
+
+    def test_negotiate(self):
+        """
+        The response is MessagePack if accepted, JSON otherwise
+        """
+        response = self.fetch('/echo')
+        self.assertEqual(json.loads(response.body), dict(values=list(range(5)), name='echo'))
+        self.assertEqual(response.headers['Vary'], 'Accept')
+
+        response = self.fetch('/echo', headers={'Accept': formats.MSGPACK})
+        self.assertEqual(response.headers['Content-Type'], formats.MSGPACK)
+        self.assertEqual(formats.unpackb(response.body), dict(values=list(range(5)), name='echo'))
+
+    def test_accept_quality(self):
+        """
+        Media ranges are weighed by quality, then specificity and order, q=0 refuses a format
+        """
+        def negotiate(accept):
+            response = self.fetch('/echo', headers={'Accept': accept})
+            return response.headers['Content-Type'].split(';')[0]
+
+        self.assertEqual(negotiate('application/json, application/msgpack;q=0'), formats.JSON)
+        self.assertEqual(negotiate('application/json;q=0.5, application/msgpack'), formats.MSGPACK)
+        self.assertEqual(negotiate('application/msgpack;q=0.5, application/json'), formats.JSON)
+        self.assertEqual(negotiate('*/*, application/x-msgpack'), formats.MSGPACK)
+        self.assertEqual(negotiate('application/json, application/msgpack'), formats.JSON)
+        self.assertEqual(negotiate('text/html, */*;q=0.1'), formats.JSON)
+
+    def test_request_body(self):
+        """
+        MessagePack request bodies are decoded like JSON bodies
+        """
+        response = self.fetch('/echo', method='POST', body=formats.packb(dict(a=[1, 2])),
+                              headers={'Content-Type': formats.MSGPACK})
+        self.assertEqual(json.loads(response.body), dict(received=dict(a=[1, 2])))
+
+    @gen_test
+    def test_http_binary(self):
+        """
+        utils.HTTP with binary=True sends and requests MessagePack
+        """
+        http = HTTP(client=self.http_client, base=self.get_url(''), binary=True)
+        result = yield http.get('/echo')
+        self.assertEqual(result, dict(values=list(range(5)), name='echo'))
+        result = yield http.post('/echo', dict(a=1))
+        self.assertEqual(result, dict(received=dict(a=1)))
+
+    def test_invalid_request_body(self):
+        """
+        Invalid MessagePack bodies are rejected without mentioning JSON
+        """
+        response = self.fetch('/echo', method='POST', body=b'\xc1', headers={'Content-Type': formats.MSGPACK})
+        self.assertEqual(response.code, 400)
+        self.assertEqual(response.reason, 'Invalid request body.')
@@ -0,0 +1,96 @@
+import copy
+import pickle
+from unittest import TestCase
+
+from tornado.util import ObjectDict
+
+import bbtornado
+from bbtornado.frozen import FrozenConfig, GlobalConfig, freeze, thaw
+from bbtornado.main import deep_copy, setup_global_config, update_global_config
+from bbtornado.web import Application
+
+
+class FreezeTest(TestCase):
+
+    def test_freeze(self):
+        """
+        Dicts become read only FrozenConfig objects, that work as mappings and with attributes
+        """
+        config = freeze(dict(server=dict(host='localhost', port=80), hosts=['a', dict(b=1)],
+                             items=1, **{'with-dash': 2}))
+        self.assertIsInstance(config, FrozenConfig)
+        self.assertEqual(config.server.host, 'localhost')
+        self.assertEqual(config['server']['port'], 80)
+        self.assertEqual(config.server.get('base', ''), '')
+        self.assertEqual(config.hosts, ('a', freeze(dict(b=1))))
+        self.assertEqual(config.hosts[1].b, 1)
+        self.assertEqual(config['items'], 1)
+        self.assertEqual(config['with-dash'], 2)
+        self.assertEqual(dict(**config.server), dict(host='localhost', port=80))
+        self.assertRaises(AttributeError, getattr, config, 'missing')
+
+        self.assertRaises(TypeError, setattr, config.server, 'host', 'other')
+        with self.assertRaises(TypeError):
+            config.server['host'] = 'other'
+
+        # one class per set of keys
+        self.assertIs(type(config.server), type(freeze(dict(port=1, host='x'))))
+
+    def test_thaw_copy_pickle(self):
+        """
+        Frozen configs can be thawed, copied and pickled
+        """
+        data = dict(db=dict(uri='sqlite://', pool=dict(size=1)), hosts=['a'])
+        config = freeze(data)
+        self.assertEqual(thaw(config), data)
+        self.assertEqual(copy.deepcopy(config), config)
+        self.assertEqual(pickle.loads(pickle.dumps(config)).db.pool.size, 1)
+
+
+class GlobalConfigTest(TestCase):
+
+    def test_loaded_in_place(self):
+        """
+        setup_global_config loads bbtornado.config in place, so references to it stay valid
+        """
+        config = bbtornado.config
+        self.assertIsInstance(config, GlobalConfig)
+        setup_global_config(port=8001, db_path='sqlite://')
+        self.assertIs(bbtornado.config, config)
+        self.assertEqual(config.tornado.server.port, 8001)
+        self.assertEqual(config['db'].uri, 'sqlite://')
+        self.assertRaises(TypeError, setattr, config, 'db', None)
+
+        setup_global_config(port=8002, db_path='sqlite://')
+        self.assertEqual(config.tornado.server.port, 8002)
+
+    def test_update(self):
+        """
+        update_global_config merges changes into the read only config, deep_copy still works but warns
+        """
+        config = bbtornado.config
+        setup_global_config(port=8001, db_path='sqlite://')
+        update_global_config(dict(db=dict(echo=True), tornado=dict(server=dict(port=8003))))
+        self.assertEqual(config.db.uri, 'sqlite://')
+        self.assertTrue(config.db.echo)
+        self.assertEqual(config.tornado.server.port, 8003)
+        self.assertEqual(config.tornado.server.host, '127.0.0.1')
+
+        with self.assertWarns(DeprecationWarning):
+            deep_copy(config, dict(db=dict(uri='sqlite:///other.db')))
+        self.assertEqual(config.db, dict(uri='sqlite:///other.db'))
+        target = ObjectDict()
+        with self.assertWarns(DeprecationWarning):
+            deep_copy(target, dict(db=dict(uri='sqlite://')))
+        self.assertEqual(target.db.uri, 'sqlite://')
+
+    def test_app_settings_thawed(self):
+        """
+        Applications get the app settings of the config as plain dicts and lists
+        """
+        setup_global_config(db_path='sqlite://')
+        update_global_config(dict(tornado=dict(app_settings=dict(hosts=['a'], limits=dict(a=1)))))
+        app = Application(init_db=False)
+        self.assertEqual(app.settings['hosts'], ['a'])
+        self.assertIs(type(app.settings['limits']), dict)
+        app.engine.dispose()
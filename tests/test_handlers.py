@@ -1,8 +1,21 @@
 from unittest import TestCase
+from unittest.mock import Mock
 
-from tornado.web import HTTPError
+from tornado.httputil import HTTPServerRequest, HTTPHeaders
+from tornado import gen
+from tornado.escape import json_decode
+from tornado.testing import AsyncTestCase, AsyncHTTPTestCase, gen_test
+from tornado.web import HTTPError, Application
 
-from bbtornado.handlers import json_requires
+from bbtornado import metrics
+from bbtornado.handlers import json_requires, BaseHandler, ThreadRequestContext, RequestData, request_memoize
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from bbtornado.models import _load_for_json, init_db
+
+from tests.test_models import MockModel, create_mock_object
 
 
 class MockClass:
@@ -51,3 +64,217 @@ class JsonRequiresTest(TestCase):
 
         except HTTPError as e:
             self.assertEqual(e.status_code, 400)
+
+
+class OffloadTest(AsyncTestCase):
+
+    def create_handler(self, body=b'', **settings):
+        app = Application(**settings)
+        request = HTTPServerRequest(method='POST', uri='/', body=body,
+                                    headers=HTTPHeaders({'Content-Type': 'application/json'}),
+                                    connection=Mock())
+        return BaseHandler(app, request)
+
+    @gen_test
+    def test_small_body_decoded_inline(self):
+        """
+        Small json bodies are decoded on the IOLoop thread
+        """
+        metrics.reset()
+        handler = self.create_handler(b'{"a": 1}')
+        self.assertIsNone(handler.prepare())
+        self.assertEqual(handler.json_data, {'a': 1})
+        self.assertEqual(metrics.get('offload.decode.inline'), 1)
+        self.assertEqual(metrics.get('offload.decode.offloaded'), 0)
+
+    @gen_test
+    def test_large_body_decoded_on_executor(self):
+        """
+        Bodies above the threshold are decoded on the executor
+        """
+        metrics.reset()
+        handler = self.create_handler(b'{"a": [1, 2, 3]}', offload_body_size=10)
+        yield handler.prepare()
+        self.assertEqual(handler.json_data, {'a': [1, 2, 3]})
+        self.assertEqual(metrics.get('offload.decode.offloaded'), 1)
+
+    def test_invalid_body_raises(self):
+        """
+        Invalid json is rejected by prepare itself, also when a subclass does not yield it
+        """
+        handler = self.create_handler(b'{"a": ')
+        with self.assertRaises(HTTPError) as cm:
+            handler.prepare()
+        self.assertEqual(cm.exception.status_code, 400)
+
+    @gen_test
+    def test_offloaded_relationships_loaded(self):
+        """
+        Relationships are loaded before the output is serialised on the executor
+        """
+        engine = create_engine('sqlite://')
+        init_db(engine)
+        session = sessionmaker(bind=engine)()
+        for i in range(3):
+            obj = create_mock_object()
+            obj.id = i + 1
+            obj.child_id = i or None
+            session.add(obj)
+        session.commit()
+        session.expunge_all()
+
+        handler = self.create_handler(offload_output_items=2)
+        objs = session.query(MockModel).order_by(MockModel.id).all()
+        _load_for_json(objs)
+        self.assertTrue(all('child' in obj.__dict__ for obj in objs))
+
+        session.close()
+        data = yield handler.to_json(objs)
+        self.assertEqual([d['child'] and d['child']['id'] for d in data], [2, 3, None])
+        engine.dispose()
+
+    @gen_test
+    def test_per_route_override(self):
+        """
+        Handler class attributes override the application setting
+        """
+        metrics.reset()
+        handler = self.create_handler(offload_output_items=10)
+        handler.offload_output_items = 2
+        data = yield handler.to_json([{'a': 1}, {'b': 2}, {'c': 3}])
+        self.assertEqual(data, [{'a': 1}, {'b': 2}, {'c': 3}])
+        self.assertEqual(metrics.get('offload.serialize.offloaded'), 1)
+
+
+calls = []
+
+@request_memoize
+def lookup(x):
+    calls.append(x)
+    return x * 2
+
+
+class RequestMemoizeTest(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        metrics.reset()
+
+    def test_memoized_within_request(self):
+        """
+        Repeated calls within one request only call the function once per argument
+        """
+        with ThreadRequestContext(request=object()):
+            self.assertEqual(lookup(2), 4)
+            self.assertEqual(lookup(2), 4)
+            self.assertEqual(lookup(3), 6)
+            self.assertEqual(ThreadRequestContext.data.memo_stats, dict(hits=1, misses=2))
+
+        self.assertEqual(calls, [2, 3])
+        self.assertEqual(metrics.get('request.memoize.hits'), 1)
+
+    def test_not_shared_between_requests(self):
+        """
+        Each request gets its own cache, and nothing is cached outside a request
+        """
+        with ThreadRequestContext(request=object()):
+            lookup(2)
+        with ThreadRequestContext(request=object()):
+            lookup(2)
+        lookup(2)
+        lookup(2)
+        self.assertEqual(calls, [2, 2, 2, 2])
+
+
+class ContextHandler(BaseHandler):
+
+    async def get(self):
+        await gen.sleep(0)
+        in_loop = ThreadRequestContext.data.request is self.request
+        in_executor = await self.run_offloaded(lambda: ThreadRequestContext.data.request is self.request)
+        self.write(dict(in_loop=in_loop, in_executor=in_executor))
+
+
+class RequestContextTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Application([(r'/', ContextHandler)], cookie_secret='secret')
+        app.user_model = None
+        return app
+
+    def test_context_in_async_handler_and_executor(self):
+        """
+        ThreadRequestContext.data follows native coroutines and offloaded functions
+        """
+        response = self.fetch('/')
+        self.assertEqual(json_decode(response.body), dict(in_loop=True, in_executor=True))
+        self.assertEqual(ThreadRequestContext.data, {})
+
+
+class RequestDataTest(TestCase):
+
+    def test_mapping_and_attributes(self):
+        """
+        RequestData works as a dict and with attributes, for slots and other keys
+        """
+        data = RequestData(request='r', custom=1)
+        self.assertEqual(data.request, 'r')
+        self.assertEqual(data['custom'], 1)
+        self.assertNotIn('current_user', data)
+        self.assertEqual(data.get('current_user', 'none'), 'none')
+
+        data.current_user = 'u'
+        data['other'] = 2
+        self.assertEqual(data.setdefault('memo', {}), {})
+        self.assertEqual(dict(data), dict(request='r', current_user='u', memo={}, custom=1, other=2))
+
+        self.assertEqual(data.pop('memo'), {})
+        self.assertEqual(data.pop('memo', None), None)
+        self.assertRaises(KeyError, data.pop, 'custom2')
+        self.assertRaises(AttributeError, getattr, data, 'memo')
+        del data['other']
+        self.assertRaises(AttributeError, getattr, data, 'other')
+
+    def test_keys(self):
+        """
+        Only the data are keys, a key set to None is present
+        """
+        data = RequestData(request='r', current_user=None)
+        self.assertIsNone(data['current_user'])
+        self.assertIn('current_user', data)
+        self.assertEqual(dict(data), dict(request='r', current_user=None))
+
+        self.assertNotIn('items', data)
+        self.assertIsNone(data.get('keys'))
+        self.assertRaises(KeyError, data.__getitem__, 'get')
+        data['items'] = 1
+        self.assertEqual(data['items'], 1)
+        self.assertEqual(RequestData(), {})
+
+
+class FieldsHandler(BaseHandler):
+
+    allowed_fields = ['child']
+
+    def get(self):
+        obj = create_mock_object()
+        obj.child = create_mock_object()
+        self.write(dict(data=obj))
+
+
+class FieldsTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Application([(r'/', FieldsHandler)], cookie_secret='secret')
+        app.user_model = None
+        return app
+
+    def test_fields(self):
+        """
+        ?fields= selects the fields written, fields must be allowed
+        """
+        response = self.fetch('/?fields=id,child.^name')
+        self.assertEqual(json_decode(response.body), dict(data=dict(id=1, child=dict(name='Name'))))
+
+        response = self.fetch('/?fields=child.child')
+        self.assertEqual(response.code, 400)
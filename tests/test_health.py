@@ -0,0 +1,102 @@
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from sqlalchemy import create_engine
+from tornado import gen
+from tornado.escape import json_decode
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from bbtornado import health, main
+from bbtornado.pool import PoolStats
+
+
+class SlowEngine(object):
+
+    def connect(self):
+        time.sleep(0.5)
+        raise Exception('unreachable')
+
+
+class HealthTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.stats_dir = tempfile.mkdtemp()
+        app = Application()
+        app.engine = create_engine('sqlite://')
+        app.pool_stats = PoolStats()
+        app.pool_stats.attach(app.engine)
+        health.add_handlers(app, prefix='/internal', readiness_timeout=0.2, stats_dir=self.stats_dir)
+        return app
+
+    def tearDown(self):
+        self._app.worker_stats.stop()
+        shutil.rmtree(self.stats_dir)
+        super(HealthTest, self).tearDown()
+
+    def test_health_and_readiness(self):
+        """
+        /healthz only needs the IOLoop, /readyz checks the db and the drain status
+        """
+        response = self.fetch('/internal/healthz')
+        self.assertEqual(json_decode(response.body), dict(status='ok'))
+
+        response = self.fetch('/internal/readyz')
+        self.assertEqual(response.code, 200)
+
+        self._app.draining = True
+        response = self.fetch('/internal/readyz')
+        self.assertEqual(response.code, 503)
+        self.assertEqual(json_decode(response.body)['reason'], 'draining')
+
+    def test_drain_grace(self):
+        """
+        On shutdown /readyz fails right away, the server stops after the drain grace
+        """
+        self._app.drain_grace = 0.2
+        with patch.object(main, 'http_server', Mock(request_callback=self._app)), \
+             patch.object(main, 'stop_server') as stop_server:
+            main.shutdown()
+            self.assertEqual(self.fetch('/internal/readyz').code, 503)
+            self.assertFalse(stop_server.called)
+            self.io_loop.run_sync(lambda: gen.sleep(0.3))
+            self.assertTrue(stop_server.called)
+
+    def test_readiness_timeout(self):
+        """
+        /readyz fails when no connection can be checked out within the timeout
+        """
+        readiness = health.ReadinessCheck(SlowEngine(), timeout=0.1)
+        self.assertEqual(self.io_loop.run_sync(readiness.check), 'db_timeout')
+
+    def test_stats(self):
+        """
+        /stats reports this process, and all workers sharing their stats
+        """
+        body = json_decode(self.fetch('/internal/stats').body)
+        self.assertEqual(body['requests']['in_flight'], 0)
+        self.assertEqual(body['executor']['queue_depth'], 0)
+        self.assertIn('checked_out', body['db_pool'])
+        self.assertIn('lag', body['ioloop'])
+        self.assertEqual(len(body['workers']), 1)
+        self.assertEqual(body['total']['workers'], 1)
+
+
+class AggregateTest(TestCase):
+
+    def test_aggregate(self):
+        """
+        Worker stats are summed, lags are the max
+        """
+        workers = [dict(requests=dict(in_flight=2, served=10), executor=dict(queue_depth=1),
+                        db_pool=dict(checked_out=3, timeouts=0), ioloop=dict(lag=0.1, max_lag=0.5), tasks=None),
+                   dict(requests=dict(in_flight=1, served=5), executor=dict(queue_depth=0),
+                        db_pool=None, ioloop=dict(lag=0.3, max_lag=0.4), tasks=dict(unfinished=2))]
+        total = health.aggregate(workers)
+        self.assertEqual(total['requests'], dict(in_flight=3, served=15))
+        self.assertEqual(total['db_pool']['checked_out'], 3)
+        self.assertEqual(total['ioloop'], dict(lag=0.3, max_lag=0.5))
+        self.assertEqual(total['tasks'], dict(unfinished=2))
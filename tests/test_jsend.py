@@ -0,0 +1,118 @@
+from tornado.escape import json_decode
+from tornado.iostream import StreamClosedError
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from bbtornado.handlers import BaseHandler
+from bbtornado.jsend import JSendMixin
+from bbtornado.validate import validate_json_output
+
+
+def numbers(count, fail_at=None):
+    for i in range(count):
+        if i == fail_at:
+            raise ValueError('broken')
+        yield dict(n=i)
+
+
+class StreamHandler(JSendMixin, BaseHandler):
+
+    stream_batch_size = 10
+
+    def get(self):
+        fail_at = self.get_argument('fail_at', None)
+        return self.stream_success(numbers(int(self.get_argument('count')),
+                                    int(fail_at) if fail_at is not None else None))
+
+
+class DisconnectingHandler(StreamHandler):
+
+    def flush(self, include_footers=False):
+        # the client goes away after the headers and first items are sent
+        future = super(DisconnectingHandler, self).flush(include_footers)
+        if not include_footers:
+            raise StreamClosedError()
+        return future
+
+
+class ListHandler(JSendMixin, BaseHandler):
+
+    def get(self):
+        self.success(numbers(3))
+
+
+class ValidatedStreamHandler(JSendMixin, BaseHandler):
+
+    stream_output = True
+    stream_batch_size = 10
+
+    @validate_json_output({'type': 'array', 'items': {'type': 'object', 'properties': {'n': {'maximum': 20}}}})
+    def get(self):
+        return numbers(int(self.get_argument('count')))
+
+
+class StreamTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Application([(r'/stream', StreamHandler), (r'/validated', ValidatedStreamHandler),
+                           (r'/list', ListHandler), (r'/disconnecting', DisconnectingHandler)],
+                          cookie_secret='secret')
+        app.user_model = None
+        return app
+
+    def test_stream(self):
+        """
+        Generators are written as a JSend envelope with chunked transfer encoding
+        """
+        response = self.fetch('/stream?count=25')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers.get('Transfer-Encoding'), 'chunked')
+        self.assertEqual(json_decode(response.body), dict(status='success', data=[dict(n=i) for i in range(25)]))
+
+    def test_error_after_streaming(self):
+        """
+        An exception after the first flush closes the envelope with an error status
+        """
+        response = self.fetch('/stream?count=25&fail_at=15')
+        self.assertEqual(response.code, 200)
+        body = json_decode(response.body)
+        self.assertEqual(body['status'], 'error')
+        self.assertEqual(len(body['data']), 15)
+
+    def test_client_disconnect(self):
+        """
+        Streaming stops when the client disconnects, without writing an error status
+        """
+        with self.assertLogs('bbtornado', 'DEBUG') as logs:
+            response = self.fetch('/disconnecting?count=25')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body.decode('utf8'), '{"data": [' + ', '.join('{"n": %d}' % i for i in range(10)))
+        self.assertEqual(logs.output, ['DEBUG:bbtornado:Client disconnected while streaming response'])
+
+    def test_error_before_streaming(self):
+        """
+        An exception before anything is sent is a normal error response
+        """
+        response = self.fetch('/stream?count=25&fail_at=5')
+        self.assertEqual(response.code, 500)
+
+    def test_validated_items(self):
+        """
+        validate_json_output validates each item of a generator while streaming
+        """
+        response = self.fetch('/validated?count=21')
+        self.assertEqual(json_decode(response.body)['status'], 'success')
+
+        response = self.fetch('/validated?count=25')
+        body = json_decode(response.body)
+        self.assertEqual(body['status'], 'error')
+        self.assertEqual(len(body['data']), 21)
+
+    def test_success_iterator(self):
+        """
+        success writes iterators as a list, without streaming
+        """
+        response = self.fetch('/list')
+        self.assertEqual(response.code, 200)
+        self.assertIsNone(response.headers.get('Transfer-Encoding'))
+        self.assertEqual(json_decode(response.body), dict(status='success', data=[dict(n=i) for i in range(3)]))
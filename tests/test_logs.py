@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from unittest import TestCase
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from bbtornado import metrics
+from bbtornado.handlers import BaseHandler, JsonErrorHandler
+from bbtornado.logs import SamplingFilter, setup_logging, stop_logging, truncate
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        record.thread_name = threading.current_thread().name
+        record.formatted = self.format(record)
+        self.records.append(record)
+
+
+def record(msg, *args, **kwargs):
+    return logging.LogRecord('test', logging.ERROR, __file__, 1, msg, args, None, **kwargs)
+
+
+class LogsTest(TestCase):
+
+    def test_truncate(self):
+        """
+        Long values are cut, with their length
+        """
+        self.assertEqual(truncate(b'x' * 10, 4), b'xxxx... (10 bytes)')
+        self.assertEqual(truncate('abc', 4), 'abc')
+        self.assertEqual(truncate(None), None)
+
+    def test_sampling(self):
+        """
+        Errors with the same message template are logged burst times per window, whatever their
+        arguments, the next one counts the suppressed ones
+        """
+        metrics.reset()
+        sampling = SamplingFilter(window=0.05, burst=2)
+        self.assertEqual([sampling.filter(record('error %s', i)) for i in range(5)], [True, True, False, False, False])
+        self.assertTrue(sampling.filter(record('other error %s', 1)))
+        self.assertEqual(metrics.get('logs.suppressed'), 3)
+
+        time.sleep(0.06)
+        r = record('error %s', 1)
+        self.assertTrue(sampling.filter(r))
+        self.assertEqual(r.getMessage(), 'error 1 (3 similar messages suppressed)')
+
+    def test_queue(self):
+        """
+        Records are handled on the listener thread, tracebacks are formatted there
+        """
+        logger = logging.getLogger('bbtornado.test_logs')
+        handler = ListHandler()
+        logger.addHandler(handler)
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        try:
+            setup_logging(logger=logger, sample_burst=1)
+            for i in range(3):
+                try:
+                    raise ValueError('boom')
+                except ValueError:
+                    logger.exception('failed %d', 1)
+            logger.info('info %s', 'message')
+        finally:
+            stop_logging()
+            logger.removeHandler(handler)
+
+        self.assertEqual([r.getMessage() for r in handler.records], ['failed 1', 'info message'])
+        self.assertNotEqual(handler.records[0].thread_name, threading.current_thread().name)
+        self.assertIn('ValueError: boom', handler.records[0].formatted)
+
+
+class ErrorHandler(JsonErrorHandler, BaseHandler):
+
+    def post(self):
+        raise Exception('error')
+
+
+class WriteErrorTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Application([(r'/', ErrorHandler)], cookie_secret='secret', max_body_log=10)
+        app.user_model = None
+        return app
+
+    def test_body_truncated(self):
+        """
+        Request bodies logged with 500 errors are truncated
+        """
+        with self.assertLogs('bbtornado', logging.ERROR) as logs:
+            response = self.fetch('/', method='POST', body='x' * 100)
+        self.assertEqual(response.code, 500)
+        self.assertIn("b'xxxxxxxxxx... (100 bytes)'", logs.output[-1])
@@ -0,0 +1,182 @@
+import datetime
+import pickle
+
+from decimal import Decimal
+from unittest import TestCase
+
+from sqlalchemy import Column, event, types, create_engine
+from sqlalchemy.orm import sessionmaker
+
+from bbtornado import metrics
+from bbtornado.modelcache import ModelCacheBackend, default_cache, invalidate, watch
+from bbtornado.models import BaseModel, Base, init_db
+
+
+class CachedModel(Base, BaseModel):
+    __tablename__ = 'cachedmodel'
+
+    _cache_ttl = 60
+
+    id = Column(types.Integer, primary_key=True)
+    name = Column(types.String, nullable=False)
+    created = Column(types.DateTime)
+    price = Column(types.Numeric(10, 2, asdecimal=True))
+
+
+class DictBackend(ModelCacheBackend):
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl):
+        self.values[key] = value
+
+    def delete(self, keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+class ModelCacheTest(TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        init_db(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        watch(self.Session)
+        self.queries = []
+        event.listen(self.engine, 'before_cursor_execute', lambda *args: self.queries.append(args[2]))
+
+        self.backend = DictBackend()
+        self.cache = default_cache()
+        self.cache.configure(backend=self.backend)
+        metrics.reset()
+
+        session = self.Session()
+        session.add_all([CachedModel(id=1, name='one'), CachedModel(id=2, name='two')])
+        session.commit()
+        session.close()
+        del self.queries[:]
+
+    def tearDown(self):
+        self.cache.configure()
+        self.cache.backend = None
+        self.engine.dispose()
+
+    def get(self, id):
+        session = self.Session()
+        try:
+            obj = CachedModel.cached_get(session, id)
+            return obj.name if obj is not None else None
+        finally:
+            session.close()
+
+    def test_cached_get(self):
+        """
+        Rows are loaded once, then restored from the cache without queries
+        """
+        self.assertEqual(self.get(1), 'one')
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(self.get(1), 'one')
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(metrics.get('modelcache.hits.local'), 1)
+
+        # the restored object is persistent in the session, and can be changed
+        session = self.Session()
+        obj = CachedModel.cached_get(session, 1)
+        self.assertIs(CachedModel.cached_get(session, 1), obj)
+        self.assertIn(obj, session)
+        obj.name = 'uno'
+        session.commit()
+        session.close()
+
+        # invalidated by the commit
+        self.assertEqual(self.get(1), 'uno')
+        self.assertIsNone(self.get(3))
+
+    def test_shared_tier(self):
+        """
+        Rows missing from the local tier are found in the shared backend
+        """
+        self.get(2)
+        self.cache.clear()
+        del self.queries[:]
+        self.assertEqual(self.get(2), 'two')
+        self.assertEqual(self.queries, [])
+        self.assertEqual(metrics.get('modelcache.hits.shared'), 1)
+
+        # deleted through a session
+        session = self.Session()
+        session.delete(CachedModel.cached_get(session, 2))
+        session.commit()
+        session.close()
+        self.assertEqual(self.backend.values, {})
+        self.assertIsNone(self.get(2))
+
+    def test_invalidate(self):
+        """
+        Rows updated without the session are invalidated explicitly, rollbacks invalidate nothing
+        """
+        self.get(1)
+        with self.engine.begin() as conn:
+            conn.execute(CachedModel.__table__.update().values(name='changed'))
+        self.assertEqual(self.get(1), 'one')
+        invalidate(CachedModel, 1)
+        self.assertEqual(self.get(1), 'changed')
+
+        session = self.Session()
+        CachedModel.cached_get(session, 1).name = 'rolled back'
+        session.flush()
+        session.rollback()
+        session.close()
+        self.assertEqual(metrics.get('modelcache.invalidations'), 1)
+        self.assertEqual(self.get(1), 'changed')
+
+    def test_json_snapshots(self):
+        """
+        Snapshots are json, column types json lacks are tagged, other values are never unpickled
+        """
+        session = self.Session()
+        obj = CachedModel.cached_get(session, 1)
+        obj.created = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        obj.price = Decimal('1.50')
+        session.commit()
+        session.close()
+
+        self.get(1)
+        self.cache.clear()
+        session = self.Session()
+        obj = CachedModel.cached_get(session, 1)
+        self.assertEqual(metrics.get('modelcache.hits.shared'), 1)
+        self.assertEqual(obj.created, datetime.datetime(2020, 1, 2, 3, 4, 5))
+        self.assertEqual(obj.price, Decimal('1.50'))
+        session.close()
+        self.assertIn(b'"$datetime"', self.backend.values['cachedmodel:1'])
+
+        self.cache.clear()
+        self.backend.values['cachedmodel:1'] = pickle.dumps(dict(id=1, name='pickled'))
+        del self.queries[:]
+        self.assertEqual(self.get(1), 'one')
+        self.assertEqual(len(self.queries), 1)
+
+    def test_unwatched_session(self):
+        """
+        Sessions of other sessionmakers do not use the cache, and do not invalidate it
+        """
+        Session = sessionmaker(bind=self.engine)
+        session = Session()
+        self.assertEqual(CachedModel.cached_get(session, 1).name, 'one')
+        session.close()
+        session = Session()
+        self.assertEqual(CachedModel.cached_get(session, 1).name, 'one')
+        session.close()
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual(len(self.cache), 0)
+
+        session = Session()
+        session.get(CachedModel, 1).name = 'uno'
+        session.commit()
+        session.close()
+        self.assertEqual(metrics.get('modelcache.invalidations'), 0)
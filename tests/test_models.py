@@ -1,12 +1,14 @@
 import operator
 from datetime import datetime, date
+from unittest import TestCase
+from unittest.mock import Mock
 
-from sqlalchemy import Column, types, ForeignKey
+from sqlalchemy import Column, types, ForeignKey, create_engine
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, sessionmaker
 from tornado.testing import AsyncTestCase
 
-from bbtornado.models import BaseModel, Base
+from bbtornado.models import BaseModel, Base, _only_field, init_db, parse_fields, project_query
 
 
 class MockModel(Base, BaseModel):
@@ -112,3 +114,133 @@ class ToJsonTest(AsyncTestCase):
         obj.child = create_mock_object()
 
         self.assertEquals(obj._to_json(extra_fields=['^name', '^child', 'child.!name']), expectation)
+
+
+class BulkWriteTest(TestCase):
+    """
+    Test the chunked bulk_insert and bulk_upsert class methods of BaseModel
+    """
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        init_db(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+
+    def test_bulk_insert(self):
+        """
+        bulk_insert inserts all rows in batches and returns the primary keys in order
+        """
+        rows = [dict(name='name %d' % i) for i in range(25)]
+        pks = MockModel.bulk_insert(self.session, rows, return_pks=True, batch_size=10)
+        self.assertEqual(pks, [(i,) for i in range(1, 26)])
+        self.assertEqual(self.session.query(MockModel).count(), 25)
+        self.assertEqual(self.session.query(MockModel).get(3).name, 'name 2')
+
+    def test_bulk_upsert(self):
+        """
+        bulk_upsert updates existing rows and inserts new ones
+        """
+        MockModel.bulk_insert(self.session, [dict(id=1, name='a'), dict(id=2, name='b')])
+        MockModel.bulk_upsert(self.session, [dict(id=2, name='B'), dict(id=3, name='C')], batch_size=1)
+        names = [m.name for m in self.session.query(MockModel).order_by(MockModel.id)]
+        self.assertEqual(names, ['a', 'B', 'C'])
+
+    def test_bulk_upsert_do_nothing(self):
+        """
+        Without update columns conflicting rows are skipped, return_pks is refused then
+        """
+        MockModel.bulk_insert(self.session, [dict(id=1, name='a')])
+        self.assertRaises(ValueError, MockModel.bulk_upsert, self.session, [dict(id=1), dict(id=2)],
+                          update_columns=[], return_pks=True)
+        MockModel.bulk_upsert(self.session, [dict(id=1, name='x'), dict(id=2, name='b')], update_columns=[])
+        names = [m.name for m in self.session.query(MockModel).order_by(MockModel.id)]
+        self.assertEqual(names, ['a', 'b'])
+
+    def test_bulk_upsert_empty(self):
+        """
+        Upserting no rows does nothing, like bulk_insert
+        """
+        self.assertEqual(MockModel.bulk_upsert(self.session, [], return_pks=True), [])
+        self.assertIsNone(MockModel.bulk_upsert(self.session, iter([])))
+        self.assertEqual(MockModel.bulk_insert(self.session, [], return_pks=True), [])
+
+    def test_bulk_upsert_unsupported(self):
+        """
+        Dialects without ON CONFLICT raise a ValueError
+        """
+        connection = Mock()
+        connection.dialect.name = 'mysql'
+        self.assertRaises(ValueError, MockModel.bulk_upsert, connection, [dict(id=1, name='a')])
+
+
+class SparseFieldsTest(TestCase):
+    """
+    Test parsing ?fields= into extra_fields, and the column projection of queries
+    """
+
+    def test_parse_fields(self):
+        """
+        Top-level names select fields, dotted names select fields of related objects
+        """
+        self.assertEqual(parse_fields('id,name'), ['^id', '^name'])
+        self.assertEqual(parse_fields('id,child.^id'), ['^id', '^child', 'child.^id'])
+        self.assertEqual(parse_fields('!date'), ['!date'])
+        self.assertEqual(parse_fields('child.child', allowed_fields=['child', 'child.child']),
+                         ['^child', 'child', 'child.child'])
+
+    def test_parse_fields_allowed(self):
+        """
+        Fields adding to the output must be allowed
+        """
+        self.assertRaises(ValueError, parse_fields, 'child.child')
+        self.assertRaises(ValueError, parse_fields, 'child.!name.x')
+        self.assertRaises(ValueError, parse_fields, 'id,,^')
+
+    def test_output(self):
+        """
+        The parsed fields give the sparse output
+        """
+        obj = create_mock_object()
+        obj.child = create_mock_object()
+        obj.child.id = 2
+        self.assertEqual(obj._to_json(extra_fields=parse_fields('id,name')), dict(id=1, name='Name'))
+        self.assertEqual(obj._to_json(extra_fields=parse_fields('id,child.^id')), dict(id=1, child=dict(id=2)))
+
+    def test_hidden_fields(self):
+        """
+        Hidden fields of related objects cannot be selected
+        """
+        self.assertRaises(ValueError, parse_fields, 'child.^child_id', model=MockModel)
+        self.assertRaises(ValueError, parse_fields, 'child.^_canceled', model=MockModel)
+        self.assertRaises(ValueError, parse_fields, 'child_id', model=MockModel)
+        self.assertRaises(ValueError, parse_fields, 'child.^_sa_instance_state', model=MockModel)
+        self.assertEqual(parse_fields('id,child.^id', model=MockModel), ['^id', '^child', 'child.^id'])
+
+        # without a model, the output still never has hidden fields
+        obj = create_mock_object()
+        obj.child_id = 3
+        self.assertEqual(_only_field([obj], 'child_id', False, ['^child_id']), [{}])
+        self.assertEqual(_only_field([obj], '_sa_instance_state', False, ['^_sa_instance_state']), [{}])
+        self.assertEqual(_only_field([obj], 'id', False, ['^id']), [1])
+
+    def test_project_query(self):
+        """
+        Only the selected columns are loaded
+        """
+        engine = create_engine('sqlite://')
+        init_db(engine)
+        session = sessionmaker(bind=engine)()
+        session.add(create_mock_object())
+        session.commit()
+        session.expunge_all()
+
+        q = project_query(session.query(MockModel), parse_fields('id,name'))
+        obj = q.one()
+        self.assertEqual(set(obj.__dict__) & {'id', 'name', 'date', 'datetime'}, {'id', 'name'})
+        self.assertEqual(obj._to_json(extra_fields=parse_fields('id,name')), dict(id=1, name='Name'))
+        session.close()
+        engine.dispose()
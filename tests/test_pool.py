@@ -0,0 +1,82 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, StaticPool
+
+from bbtornado.main import setup_global_config
+from bbtornado.pool import pool_settings, InstrumentedQueuePool
+from bbtornado.web import Application
+
+
+class PoolSettingsTest(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.uri = 'sqlite:///%s' % self.path
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_defaults_only_for_queue_pools(self):
+        """
+        Production pool defaults are used for file databases, but not for in-memory sqlite
+        """
+        settings, stats = pool_settings(self.uri)
+        self.assertEqual(settings['pool_size'], 10)
+        self.assertTrue(settings['pool_pre_ping'])
+        self.assertTrue(issubclass(settings['poolclass'], InstrumentedQueuePool))
+
+        settings, stats = pool_settings('sqlite://')
+        self.assertEqual(settings, {})
+
+    def test_custom_pool_class(self):
+        """
+        No defaults or instrumented pool class are added when create_engine gets a poolclass
+        """
+        settings, stats = pool_settings(self.uri, pool_class=NullPool)
+        self.assertEqual(settings, {})
+        engine = create_engine(self.uri, poolclass=NullPool, **settings)
+        engine.connect().close()
+        engine.dispose()
+
+        settings, stats = pool_settings(self.uri, dict(pre_ping=True), pool_class=NullPool)
+        self.assertEqual(settings, dict(pool_pre_ping=True))
+
+        setup_global_config(db_path=self.uri)
+        app = Application(init_db=False, create_engine_settings=dict(poolclass=StaticPool))
+        self.assertIsInstance(app.engine.pool, StaticPool)
+        app.engine.dispose()
+
+    def test_stats(self):
+        """
+        Checkouts, overflow hits and timeouts are counted from the pool
+        """
+        settings, stats = pool_settings(self.uri, dict(size=1, overflow=1, timeout=0.01, slow_checkout=None))
+        engine = create_engine(self.uri, **settings)
+        stats.attach(engine)
+
+        c1 = engine.connect()
+        c2 = engine.connect()
+        self.assertEqual(stats.as_dict()['checked_out'], 2)
+        self.assertRaises(TimeoutError, engine.connect)
+        c1.close()
+        c2.close()
+
+        result = stats.as_dict()
+        self.assertEqual(result['checkouts'], 2)
+        self.assertEqual(result['overflow_hits'], 1)
+        self.assertEqual(result['timeouts'], 1)
+        self.assertEqual(result['checked_out'], 0)
+        engine.dispose()
+
+    def test_unknown_setting(self):
+        """
+        Unknown pool settings raise a ValueError naming the setting
+        """
+        with self.assertRaises(ValueError) as cm:
+            pool_settings(self.uri, dict(max_size=5))
+        self.assertIn("'max_size'", str(cm.exception))
@@ -0,0 +1,114 @@
+from unittest import TestCase
+
+from tornado.escape import json_decode
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from bbtornado import metrics
+from bbtornado.handlers import BaseHandler, JsonErrorHandler
+from bbtornado.frozen import freeze
+from bbtornado.ratelimit import TokenBucket, RateLimit, MemoryStore, LoadShedder, from_settings
+
+
+class TokenBucketTest(TestCase):
+
+    def test_take(self):
+        """
+        A bucket allows bursts, then refills at the given rate
+        """
+        bucket = TokenBucket(rate=2, burst=3, now=0)
+        self.assertEqual([bucket.take(now=0) for i in range(3)], [0, 0, 0])
+        self.assertEqual(bucket.take(now=0), 0.5)
+        self.assertEqual(bucket.take(now=0.5), 0)
+        self.assertEqual(bucket.take(now=0.5), 0.5)
+
+
+class LimitedHandler(JsonErrorHandler, BaseHandler):
+
+    rate_limits = [RateLimit(rate=1, burst=2, key='ip', store=MemoryStore())]
+
+    def get(self):
+        self.write(dict(ok=True))
+
+
+class OpenHandler(JsonErrorHandler, BaseHandler):
+
+    def get(self):
+        self.write(dict(ok=True))
+
+
+class SameLimitHandler(JsonErrorHandler, BaseHandler):
+
+    rate_limits = [RateLimit(rate=1, burst=1, key='ip')]
+
+    def get(self):
+        self.write(dict(ok=True))
+
+
+class OtherSameLimitHandler(SameLimitHandler):
+
+    rate_limits = [RateLimit(rate=1, burst=1, key='ip')]
+
+
+class RateLimitTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Application([(r'/limited', LimitedHandler), (r'/open', OpenHandler),
+                           (r'/same', SameLimitHandler), (r'/other', OtherSameLimitHandler)],
+                          cookie_secret='secret')
+        app.user_model = None
+        return app
+
+    def test_rate_limit(self):
+        """
+        Requests over the limit get a 429 with Retry-After
+        """
+        self.assertEqual(self.fetch('/limited').code, 200)
+        self.assertEqual(self.fetch('/limited').code, 200)
+        response = self.fetch('/limited')
+        self.assertEqual(response.code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(json_decode(response.body)['status'], 429)
+        # other handlers are not limited
+        self.assertEqual(self.fetch('/open').code, 200)
+
+    def test_buckets_per_handler(self):
+        """
+        Unnamed limits with the same parameters do not share buckets between handlers
+        """
+        self.assertEqual(self.fetch('/same').code, 200)
+        self.assertEqual(self.fetch('/same').code, 429)
+        self.assertEqual(self.fetch('/other').code, 200)
+
+    def test_load_shedding(self):
+        """
+        Requests are rejected with a 503 when too many are in flight
+        """
+        self._app.load_shedder = LoadShedder(max_in_flight=0, retry_after=5)
+        metrics.reset()
+        response = self.fetch('/open')
+        self.assertEqual(response.code, 503)
+        self.assertEqual(response.headers['Retry-After'], '5')
+        self.assertEqual(metrics.get('loadshed.rejected.in_flight'), 1)
+        self.assertEqual(metrics.get('requests.in_flight'), 0)
+        self.assertEqual(self._app.load_shedder.in_flight, 0)
+
+    def test_in_flight_after_metrics_reset(self):
+        """
+        The shedder counts requests itself, resetting the metrics does not disable it
+        """
+        load_shedder = self._app.load_shedder = LoadShedder(max_in_flight=0)
+        load_shedder.started()
+        metrics.reset()
+        self.assertEqual(load_shedder.overload_reason(None), 'in_flight')
+
+    def test_from_config(self):
+        """
+        Rate limits and load shedding are created from (frozen) config sections
+        """
+        rate_limits, load_shedder = from_settings(freeze(dict(rate_limits=[dict(rate=10, key='ip')],
+                                                              load_shedding=dict(max_in_flight=5))))
+        self.assertEqual(rate_limits[0].rate, 10)
+        self.assertEqual(rate_limits[0].name, 'app:ip:10/10')
+        self.assertIsInstance(load_shedder, LoadShedder)
+        self.assertEqual(load_shedder.max_in_flight, 5)
@@ -0,0 +1,87 @@
+import random
+from unittest import TestCase
+
+from tornado.httputil import HTTPServerRequest
+from tornado.routing import PathMatches
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, RequestHandler
+
+from bbtornado.routing import literal_prefix, use_indexed_router
+
+
+class NamedHandler(RequestHandler):
+
+    def initialize(self, name):
+        self.name = name
+
+    def get(self, *args):
+        self.write(dict(name=self.name, args=list(args)))
+
+
+def route_table():
+    handlers = [(r'/', NamedHandler, dict(name='root')),
+                (r'/api/users/me', NamedHandler, dict(name='first regex wins over static')),
+                (r'/api/users/(me|\d+)', NamedHandler, dict(name='user')),
+                (r'/api/users/me', NamedHandler, dict(name='static after regex')),
+                (r'/(.*)\.txt', NamedHandler, dict(name='txt'))]
+    for i in range(50):
+        handlers.append((r'/api/v%d/items' % i, NamedHandler, dict(name='items %d' % i)))
+        handlers.append((r'/api/v%d/items/(\d+)/?' % i, NamedHandler, dict(name='item %d' % i)))
+        handlers.append((r'/api/v%d-legacy[0-9]*/x' % i, NamedHandler, dict(name='legacy %d' % i)))
+    handlers.append((r'/(.*)', NamedHandler, dict(name='fallback')))
+    return handlers
+
+
+class LiteralPrefixTest(TestCase):
+
+    def test_literal_prefix(self):
+        """
+        The literal prefix stops at the first special character
+        """
+        self.assertEqual(literal_prefix(PathMatches(r'/api/users')), ('/api/users', True))
+        self.assertEqual(literal_prefix(PathMatches(r'/api/users/(\d+)')), ('/api/users/', False))
+        self.assertEqual(literal_prefix(PathMatches(r'/api/users?')), ('/api/user', False))
+        self.assertEqual(literal_prefix(PathMatches(r'/favicon\.ico')), ('/favicon.ico', True))
+        self.assertEqual(literal_prefix(PathMatches(r'/a|/b')), ('', False))
+
+
+class IndexedRouterTest(TestCase):
+
+    def test_same_as_linear(self):
+        """
+        The indexed router finds the same handler as tornado's router for any path
+        """
+        linear = Application(route_table())
+        indexed = Application(route_table())
+        use_indexed_router(indexed)
+
+        paths = ['/', '/api/users/me', '/api/users/12', '/api/users/x', '/notes.txt', '/api/v3/items',
+                 '/api/v3/items/', '/api/v3/items/7', '/api/v3/items/7/', '/api/v49-legacy12/x',
+                 '/api/v4-legacy/x', '/api/v4-legacyx/x', '/api/v50/items', '/api', '']
+        rnd = random.Random(1)
+        for i in range(200):
+            paths.append('/api/v%d/items/%s' % (rnd.randint(0, 60), rnd.choice(['', '1', '1/', 'a'])))
+
+        for path in paths:
+            request = HTTPServerRequest(method='GET', uri=path or '/x')
+            request.path = path
+            a = linear.find_handler(request)
+            b = indexed.find_handler(request)
+            self.assertEqual((a.handler_kwargs, a.path_args), (b.handler_kwargs, b.path_args), path)
+
+
+class IndexedRoutingTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Application(route_table())
+        use_indexed_router(app)
+        app.add_handlers('.*$', [(r'/added', NamedHandler, dict(name='added'))])
+        return app
+
+    def test_requests(self):
+        """
+        Requests are dispatched through the index, handlers can still be added
+        """
+        self.assertEqual(self.fetch('/api/users/me').body, b'{"name": "first regex wins over static", "args": []}')
+        self.assertEqual(self.fetch('/api/v7/items/3').body, b'{"name": "item 7", "args": ["3"]}')
+        self.assertEqual(self.fetch('/added').body, b'{"name": "added", "args": []}')
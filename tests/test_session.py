@@ -0,0 +1,130 @@
+from unittest.mock import Mock
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from tornado.escape import json_decode
+from tornado.httputil import HTTPServerRequest
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from bbtornado import metrics
+from bbtornado.handlers import BaseHandler, ThreadRequestContext
+from bbtornado.models import init_db
+
+from tests.test_models import MockModel
+
+
+class NoDbHandler(BaseHandler):
+
+    def get(self):
+        self.write(dict(ok=True))
+
+
+class OrmHandler(BaseHandler):
+
+    def get(self):
+        self.write(dict(count=self.db.query(MockModel).count()))
+
+    def post(self):
+        self.db.add(MockModel(name='new'))
+        self.db.commit()
+        self.write(dict(ok=True))
+
+
+class ReadOnlyHandler(OrmHandler):
+
+    read_only_db = True
+
+
+class CoreHandler(BaseHandler):
+
+    def get(self):
+        self.write(dict(count=self.conn.execute(text('select count(*) from mockmodel')).scalar()))
+
+
+class RequestSessionTest(AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(RequestSessionTest, self).setUp()
+        metrics.reset()
+
+    def get_app(self):
+        app = Application([(r'/none', NoDbHandler), (r'/orm', OrmHandler),
+                           (r'/read', ReadOnlyHandler), (r'/core', CoreHandler)], cookie_secret='secret')
+        app.user_model = None
+        app.engine = create_engine('sqlite://', poolclass=StaticPool, connect_args=dict(check_same_thread=False))
+        init_db(app.engine)
+        app.sessionmaker = sessionmaker(bind=app.engine)
+        app.Session = scoped_session(app.sessionmaker,
+                                     scopefunc=lambda: ThreadRequestContext.data.get('request', None))
+        return app
+
+    def test_lazy(self):
+        """
+        Sessions and connections are only created when used
+        """
+        self.fetch('/none')
+        self.fetch('/orm', method='POST', body='')
+        self.assertEqual(json_decode(self.fetch('/core').body), dict(count=1))
+        self.assertEqual(metrics.get('requests.served'), 3)
+        self.assertEqual(metrics.get('db.sessions.created'), 1)
+        self.assertEqual(metrics.get('db.connections.created'), 1)
+        self.assertEqual(self._app.Session.registry.registry, {})
+
+    def test_read_only(self):
+        """
+        Read only handlers can query, but not flush
+        """
+        self.assertEqual(json_decode(self.fetch('/read').body), dict(count=0))
+        response = self.fetch('/read', method='POST', body='')
+        self.assertEqual(response.code, 500)
+        self.assertEqual(json_decode(self.fetch('/orm').body), dict(count=0))
+
+    def test_close_once(self):
+        """
+        Closing twice, i.e. from on_connection_close and on_finish, is safe
+        """
+        request = HTTPServerRequest(method='GET', uri='/', connection=Mock())
+        handler = OrmHandler(self._app, request)
+        with ThreadRequestContext(request=handler.request):
+            handler.db.query(MockModel).count()
+            handler.on_connection_close()
+            handler.on_finish()
+        self.assertFalse(handler.request_session.active)
+
+    def test_read_only_lazy(self):
+        """
+        Read only sessions check out their autocommit connection when first used
+        """
+        request = HTTPServerRequest(method='GET', uri='/', connection=Mock())
+        handler = ReadOnlyHandler(self._app, request)
+        with ThreadRequestContext(request=handler.request):
+            session = handler.db
+            self.assertFalse(session.in_transaction())
+            self.assertEqual(session.query(MockModel).count(), 0)
+            self.assertEqual(session.connection().get_execution_options().get('isolation_level'), 'AUTOCOMMIT')
+            handler.on_finish()
+        self.assertEqual(self._app.Session.registry.registry, {})
+
+    def test_scoped_session(self):
+        """
+        application.Session() during a request is the session of the handler, and is removed after it
+        """
+        request = HTTPServerRequest(method='GET', uri='/', connection=Mock())
+        handler = OrmHandler(self._app, request)
+        with ThreadRequestContext(request=handler.request):
+            db = handler.db
+            self.assertIs(self._app.Session(), db)
+            db.add(MockModel(name='scoped'))
+            self.assertEqual(self._app.Session().query(MockModel).count(), 1)
+            handler.on_finish()
+            self.assertEqual(self._app.Session.registry.registry, {})
+
+        request = HTTPServerRequest(method='GET', uri='/', connection=Mock())
+        handler = OrmHandler(self._app, request)
+        with ThreadRequestContext(request=handler.request):
+            session = self._app.Session()
+            self.assertIs(handler.db, session)
+            handler.on_finish()
+        self.assertEqual(self._app.Session.registry.registry, {})
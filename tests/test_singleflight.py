@@ -0,0 +1,93 @@
+from tornado.concurrent import Future
+from tornado.escape import json_decode
+from tornado.gen import coroutine, multi
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application
+
+from bbtornado import metrics
+from bbtornado.handlers import BaseHandler
+from bbtornado.singleflight import SingleFlight, single_flight, coalesce
+
+
+calls = []
+release = []
+
+
+class SlowHandler(BaseHandler):
+
+    @coalesce()
+    @coroutine
+    def get(self):
+        calls.append(self.get_argument('q', None))
+        f = Future()
+        release.append(f)
+        yield f
+        self.set_header('X-Leader', 'yes')
+        self.write(dict(calls=len(calls)))
+
+
+class SingleFlightTest(AsyncTestCase):
+
+    @gen_test
+    def test_shared_result(self):
+        """
+        Concurrent calls with the same key share one call
+        """
+        group = SingleFlight()
+        waiting = []
+
+        @single_flight(group=group)
+        @coroutine
+        def fetch(key):
+            calls.append(key)
+            f = Future()
+            waiting.append(f)
+            result = yield f
+            return result
+
+        del calls[:]
+        futures = [fetch('a'), fetch('a'), fetch('b')]
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertEqual(len(group), 2)
+        for i, f in enumerate(waiting):
+            f.set_result(i)
+        results = yield multi(futures)
+        self.assertEqual(results, [0, 0, 1])
+        self.assertEqual(len(group), 0)
+
+        # a new call after the first finished is made again
+        fetch('a')
+        self.assertEqual(calls, ['a', 'b', 'a'])
+
+
+class CoalesceTest(AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(CoalesceTest, self).setUp()
+        del calls[:]
+        del release[:]
+        metrics.reset()
+
+    def get_app(self):
+        app = Application([(r'/slow', SlowHandler)], cookie_secret='secret')
+        app.user_model = None
+        return app
+
+    @gen_test
+    def test_coalesce(self):
+        """
+        Identical concurrent GETs are handled once, with different arguments they are not
+        """
+        requests = [self.http_client.fetch(self.get_url(path))
+                    for path in ('/slow?q=1', '/slow?q=1', '/slow?q=1', '/slow?q=2')]
+        while len(calls) < 2 or metrics.get('singleflight.requests.shared') < 2:
+            yield self.io_loop.run_in_executor(None, lambda: None)
+        self.assertEqual(calls, ['1', '2'])
+        for f in release:
+            f.set_result(None)
+
+        responses = yield multi(requests)
+        self.assertEqual([r.code for r in responses], [200] * 4)
+        self.assertEqual(json_decode(responses[1].body), json_decode(responses[0].body))
+        self.assertEqual(responses[2].headers['X-Leader'], 'yes')
+        self.assertEqual(len(calls), 2)
@@ -0,0 +1,41 @@
+import logging
+import threading
+
+from unittest.mock import patch
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from bbtornado.slack import SlackHandler
+
+
+def record(msg):
+    return logging.LogRecord('test', logging.ERROR, __file__, 1, msg, None, None)
+
+
+class SlackHandlerTest(AsyncTestCase):
+
+    def test_no_loop_captured(self):
+        """
+        A handler built before the IOLoop exists posts from the thread logging, without an IOLoop
+        """
+        handler = SlackHandler('http://slack.invalid/hook', '#test')
+        self.assertIsNone(handler.io_loop)
+        with patch('bbtornado.slack.post_message_blocking') as blocking, \
+             patch('bbtornado.slack.post_message') as post:
+            thread = threading.Thread(target=handler.emit, args=(record('from a thread'),))
+            thread.start()
+            thread.join()
+        self.assertEqual(blocking.call_args[1]['msg'], 'from a thread')
+        self.assertFalse(post.called)
+
+    @gen_test
+    def test_post_from_io_loop(self):
+        """
+        Messages logged on the IOLoop thread are posted from the running IOLoop
+        """
+        handler = SlackHandler('http://slack.invalid/hook', '#test')
+        with patch('bbtornado.slack.post_message_blocking') as blocking, \
+             patch('bbtornado.slack.post_message') as post:
+            handler.emit(record('on the loop'))
+        self.assertEqual(post.call_args[1]['channel'], '#test')
+        self.assertFalse(blocking.called)
@@ -0,0 +1,152 @@
+import threading
+
+from unittest.mock import Mock
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.pool import StaticPool
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application
+
+from bbtornado import metrics
+from bbtornado.handlers import BaseHandler
+from bbtornado.main import start_tasks
+from bbtornado.tasks import TaskQueue, init_db, task_table
+
+
+calls = []
+
+
+def record(value):
+    calls.append(value)
+
+
+def flaky(value):
+    calls.append(value)
+    if len(calls) < 3:
+        raise ValueError('try again')
+
+
+class TaskHandler(BaseHandler):
+
+    def get(self):
+        self.enqueue(record, 'after response')
+        calls.append('handler')
+        self.write(dict(ok=True))
+
+
+class TaskQueueTest(AsyncTestCase):
+
+    def setUp(self):
+        super(TaskQueueTest, self).setUp()
+        del calls[:]
+        metrics.reset()
+
+    @gen_test
+    def test_retries(self):
+        """
+        Failing tasks are retried with backoff, drain waits for retries
+        """
+        tasks = TaskQueue(retries=3, backoff=0.01)
+        tasks.enqueue(flaky, 'x')
+        yield tasks.drain(timeout=5)
+        self.assertEqual(calls, ['x', 'x', 'x'])
+        self.assertEqual(metrics.get('tasks.retried'), 2)
+        self.assertEqual(metrics.get('tasks.succeeded'), 1)
+
+    @gen_test
+    def test_coroutines_and_executor(self):
+        """
+        Tasks can be coroutines, or run on an executor
+        """
+        @gen.coroutine
+        def later(value):
+            yield gen.sleep(0.01)
+            calls.append(value)
+
+        tasks = TaskQueue(threads=2)
+        tasks.enqueue(record, 'thread')
+        tasks.enqueue(later, 'coroutine')
+        yield tasks.drain(timeout=5)
+        self.assertEqual(sorted(calls), ['coroutine', 'thread'])
+
+    @gen_test
+    def test_default_executor(self):
+        """
+        Functions run on an executor thread by default, threads=0 runs them on the IOLoop
+        """
+        def thread_name():
+            calls.append(threading.current_thread().name)
+
+        tasks = TaskQueue()
+        tasks.enqueue(thread_name)
+        self.assertEqual(tasks.unfinished, 1)
+        yield tasks.drain(timeout=5)
+        self.assertEqual(tasks.unfinished, 0)
+
+        tasks = TaskQueue(threads=0)
+        tasks.enqueue(thread_name)
+        yield tasks.drain(timeout=5)
+        self.assertNotEqual(calls[0], threading.current_thread().name)
+        self.assertEqual(calls[1], threading.current_thread().name)
+
+    def test_lazy_start(self):
+        """
+        Queues create their threads when started, only durable queues are started with the server
+        """
+        tasks = TaskQueue()
+        self.assertIsNone(start_tasks(Mock(tasks=tasks)))
+        self.assertFalse(tasks.running)
+        self.assertIsNone(tasks.executor)
+        tasks.start()
+        self.assertIsNotNone(tasks.executor)
+        self.assertIsNone(tasks.db_executor)
+        tasks.executor.shutdown()
+
+    @gen_test
+    def test_durable(self):
+        """
+        Durable tasks are stored until they ran, stored tasks are run when a queue starts
+        """
+        # the db writes happen on another thread
+        engine = create_engine('sqlite://', poolclass=StaticPool, connect_args=dict(check_same_thread=False))
+        init_db(engine)
+        stopped = TaskQueue(durable=True, engine=engine, workers=0)
+        task = stopped.enqueue(record, 'stored')
+        # stored from the db executor
+        while task.id is None:
+            yield gen.sleep(0.01)
+        with engine.connect() as conn:
+            self.assertEqual(len(conn.execute(select(task_table)).fetchall()), 1)
+
+        # started with the server, without a new task
+        tasks = TaskQueue(durable=True, engine=engine)
+        self.assertIs(start_tasks(Mock(tasks=tasks)), tasks)
+        yield tasks.drain(timeout=5)
+        self.assertEqual(calls, ['stored'])
+        with engine.connect() as conn:
+            self.assertEqual(len(conn.execute(select(task_table)).fetchall()), 0)
+        engine.dispose()
+
+
+class EnqueueTest(AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(EnqueueTest, self).setUp()
+        del calls[:]
+
+    def get_app(self):
+        app = Application([(r'/', TaskHandler)], cookie_secret='secret')
+        app.user_model = None
+        app.tasks = TaskQueue()
+        return app
+
+    def test_enqueue(self):
+        """
+        Tasks enqueued by a handler run after the response
+        """
+        response = self.fetch('/')
+        self.assertEqual(response.code, 200)
+        self.io_loop.run_sync(lambda: self._app.tasks.drain(timeout=5))
+        self.assertEqual(calls, ['handler', 'after response'])
@@ -0,0 +1,90 @@
+from unittest.mock import Mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from tornado.escape import json_decode
+from tornado.gen import coroutine
+from tornado.httputil import HTTPServerRequest
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application
+
+from bbtornado.handlers import BaseHandler
+from bbtornado.models import init_db
+from bbtornado.validate import validate_json_output
+
+from tests.test_models import MockModel, create_mock_object
+
+
+class AsyncOutputHandler(BaseHandler):
+
+    @validate_json_output({'type': 'object'})
+    @coroutine
+    def get(self):
+        return dict(a=1)
+
+
+class QueryHandler(BaseHandler):
+
+    @validate_json_output()
+    def get(self):
+        return self.db.query(MockModel)
+
+
+class ValidatedQueryHandler(BaseHandler):
+
+    @validate_json_output({'type': 'array', 'items': {'type': 'object', 'required': ['id']}})
+    def get(self):
+        return self.db.query(MockModel)
+
+
+class ValidateOutputTest(AsyncTestCase):
+
+    def create_handler(self, handler_class):
+        app = Application(cookie_secret='secret')
+        app.user_model = None
+        request = HTTPServerRequest(method='GET', uri='/', connection=Mock())
+        return handler_class(app, request)
+
+    @gen_test
+    def test_async_output(self):
+        """
+        The future of a decorated coroutine resolves to its output, after it is written
+        """
+        handler = self.create_handler(AsyncOutputHandler)
+        output = yield handler.get()
+        self.assertEqual(output, dict(a=1))
+        self.assertEqual(b''.join(handler._write_buffer), b'{"a": 1}')
+
+
+class ValidateQueryTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Application([(r'/query', QueryHandler), (r'/validated', ValidatedQueryHandler)],
+                          cookie_secret='secret')
+        app.user_model = None
+        app.engine = create_engine('sqlite://', poolclass=StaticPool, connect_args=dict(check_same_thread=False))
+        init_db(app.engine)
+        app.sessionmaker = sessionmaker(bind=app.engine)
+        app.Session = scoped_session(app.sessionmaker)
+        session = app.sessionmaker()
+        session.add(create_mock_object())
+        session.commit()
+        session.close()
+        return app
+
+    def test_query_without_schema(self):
+        """
+        Queries are written as json by handlers without JSend and without a schema
+        """
+        response = self.fetch('/query?fields=id,name')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json_decode(response.body), [dict(id=1, name='Name')])
+
+    def test_validated_query(self):
+        """
+        Queries are loaded and validated against the schema
+        """
+        response = self.fetch('/validated')
+        self.assertEqual(response.code, 200)
+        self.assertEqual([item['id'] for item in json_decode(response.body)], [1])
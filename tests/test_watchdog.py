@@ -0,0 +1,53 @@
+import logging
+import time
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from bbtornado import metrics
+from bbtornado.slack import SlackFilter
+from bbtornado.watchdog import Watchdog
+
+
+def block_the_ioloop():
+    time.sleep(0.3)
+
+
+class WatchdogTest(AsyncTestCase):
+
+    @gen_test
+    def test_blocking_call_reported(self):
+        """
+        A blocked IOLoop is reported with the stack of the blocking code, and measured as lag
+        """
+        metrics.reset()
+        watchdog = Watchdog(interval=0.02, threshold=0.1, report_interval=60)
+        watchdog.start()
+        try:
+            yield gen.sleep(0.05)
+            with self.assertLogs('bbtornado.watchdog', 'WARNING') as logs:
+                block_the_ioloop()
+                yield gen.sleep(0.05)
+                block_the_ioloop()
+                yield gen.sleep(0.05)
+        finally:
+            watchdog.stop()
+
+        # the second block is counted, but not reported again
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('block_the_ioloop', logs.output[0])
+        self.assertEqual(metrics.get('watchdog.blocked'), 2)
+        self.assertEqual(watchdog.suppressed, 1)
+        self.assertTrue(watchdog.max_lag > 0.2)
+
+    def test_report_sent_to_slack(self):
+        """
+        Reports are warnings marked for slack, so a SlackHandler at ERROR level posts them
+        """
+        watchdog = Watchdog()
+        with self.assertLogs('bbtornado.watchdog', 'WARNING') as logs:
+            watchdog.on_blocked(1.0)
+        record = logs.records[0]
+        self.assertEqual(record.levelno, logging.WARNING)
+        self.assertIs(record.slack, True)
+        self.assertTrue(SlackFilter(logging.ERROR).filter(record))
@@ -0,0 +1,87 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from tornado.testing import AsyncTestCase, gen_test
+
+from bbtornado import metrics
+from bbtornado.models import init_db
+from bbtornado.writebehind import WriteBehindBuffer
+
+from tests.test_models import MockModel
+
+
+class WriteBehindTest(AsyncTestCase):
+
+    def setUp(self):
+        super(WriteBehindTest, self).setUp()
+        metrics.reset()
+        self.engine = create_engine('sqlite://', poolclass=StaticPool, connect_args=dict(check_same_thread=False))
+        init_db(self.engine)
+        with self.engine.begin() as conn:
+            MockModel.bulk_insert(conn, [dict(id=1, name='a', child_id=0), dict(id=2, name='b', child_id=0)])
+
+    def tearDown(self):
+        self.engine.dispose()
+        super(WriteBehindTest, self).tearDown()
+
+    def rows(self):
+        session = sessionmaker(bind=self.engine)()
+        rval = [(m.id, m.name, m.child_id) for m in session.query(MockModel).order_by(MockModel.id)]
+        session.close()
+        return rval
+
+    @gen_test
+    def test_merge_and_flush(self):
+        """
+        Operations on the same row are merged, and written with one flush
+        """
+        buffer = WriteBehindBuffer(self.engine, flush_interval=60)
+        for i in range(10):
+            buffer.increment(MockModel, dict(id=1), child_id=1)
+        buffer.increment(MockModel, dict(id=2), child_id=5)
+        buffer.upsert(MockModel, dict(id=2), name='x')
+        buffer.upsert(MockModel, dict(id=2), name='B')
+        buffer.upsert(MockModel, dict(id=3), name='C')
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(metrics.get('writebehind.merged'), 10)
+
+        yield buffer.flush()
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.rows(), [(1, 'a', 10), (2, 'B', 5), (3, 'C', None)])
+        self.assertEqual(metrics.get('writebehind.flushes'), 1)
+        buffer.close()
+
+    @gen_test
+    def test_failed_flush(self):
+        """
+        A failed flush keeps the rows for the next one
+        """
+        buffer = WriteBehindBuffer(self.engine, flush_interval=60)
+        buffer.increment(MockModel, dict(id=1), child_id=2)
+        engine, buffer.engine = buffer.engine, None
+        yield buffer.flush()
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(metrics.get('writebehind.errors'), 1)
+
+        buffer.increment(MockModel, dict(id=1), child_id=1)
+        buffer.engine = engine
+        buffer.close()
+        self.assertEqual(self.rows()[0], (1, 'a', 3))
+
+    @gen_test
+    def test_failed_flush_capped(self):
+        """
+        Rows of a failed flush are kept up to max_size, the rest are dropped
+        """
+        buffer = WriteBehindBuffer(self.engine, flush_interval=60, max_size=2)
+        buffer.engine = None
+        buffer.increment(MockModel, dict(id=1), child_id=1)
+        buffer.upsert(MockModel, dict(id=2), name='x')
+        buffer.upsert(MockModel, dict(id=3), name='y')
+        yield buffer.flush()
+        buffer.increment(MockModel, dict(id=4), child_id=1)
+        yield buffer.flush()
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(metrics.get('writebehind.dropped'), 2)
+        buffer.engine = self.engine
+        buffer.close()